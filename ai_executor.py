@@ -0,0 +1,203 @@
+# ai_executor.py
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AIRequestTimeout(Exception):
+    """請求超過期限仍未完成。"""
+
+
+class AIRequestRejected(Exception):
+    """同時進行中的請求已達上限，新的請求被拒絕。"""
+
+
+class AIRequest:
+    """
+    提交給 AIRequestExecutor 的單一請求。工作函式會收到這個物件，
+    可用 report_progress() 回報進度 (例如串流片段)，並在長時間的迴圈中檢查 should_stop()。
+    """
+
+    def __init__(self, request_id, timeout_s, events):
+        self.request_id = request_id
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + timeout_s if timeout_s else None
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._events = events
+        self.finished = False # 結果或錯誤已交給回呼 (由 poll() 所在的執行緒設定)
+        self.cancel_reason = None
+
+    def cancel(self, reason="cancelled"):
+        """取消請求：尚未開始的工作不會執行，執行中的工作會在下一次檢查 should_stop() 時停止，之後的結果一律被丟棄。"""
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def remaining(self):
+        """距離期限的秒數 (沒有期限時為 None)。"""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def should_stop(self):
+        """工作函式應在迴圈中檢查：請求已被取消或超過期限時回傳 True。"""
+        return self._cancel_event.is_set() or self.expired()
+
+    def report_progress(self, payload):
+        """(工作執行緒) 回報進度，回呼會在 poll() 所在的執行緒中執行。"""
+        if not self._cancel_event.is_set():
+            self._events.put((self, "progress", payload))
+
+
+class AIRequestExecutor:
+    def __init__(self, max_workers=2, max_in_flight=4, default_timeout_s=30.0):
+        """
+        在背景執行緒池中執行 AI 請求，讓繪製迴圈不會因網路往返而停頓。
+        回呼 (進度、完成、錯誤) 不會在工作執行緒中執行，而是排入佇列，
+        由繪製迴圈每幀呼叫 poll() 時在主執行緒中執行，因此可以安全地更新畫面狀態。
+        :param max_workers: 同時執行的請求數量上限 (執行緒池大小)。
+        :param max_in_flight: 執行中與排隊中的請求總數上限，超過時新的請求會被拒絕。
+        :param default_timeout_s: 預設的請求期限 (秒)，None 表示不限。
+        """
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.default_timeout_s = default_timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="AIRequest")
+        self._events = queue.Queue()
+        self._ids = itertools.count(1)
+        self._callbacks = {} # AIRequest -> (on_progress, on_complete, on_error)
+        self._active = set() # 已交給執行緒池且尚未結束的請求 (包含已被取代但網路呼叫仍在進行的)
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "timed_out": 0, "superseded": 0, "rejected": 0}
+
+    def submit(self, task, on_complete=None, on_error=None, on_progress=None, timeout_s=None, supersede=True):
+        """
+        提交一個請求。
+        :param task: 工作函式 task(request) -> 結果，在背景執行緒中執行。
+        :param on_complete: (可選) on_complete(結果)。
+        :param on_error: (可選) on_error(例外)，包含 AIRequestTimeout 與 AIRequestRejected。
+        :param on_progress: (可選) on_progress(進度)，對應工作函式中的 request.report_progress()。
+        :param timeout_s: (可選) 請求期限 (秒)，預設為 default_timeout_s。
+        :param supersede: 是否取消先前尚未完成的請求 (使用者再次提問時，舊的回應已沒有意義)。
+        :return: AIRequest
+        """
+        request = AIRequest(next(self._ids), timeout_s if timeout_s is not None else self.default_timeout_s, self._events)
+        with self._lock:
+            self.stats["submitted"] += 1
+            if len(self._active) >= self.max_in_flight:
+                # 先檢查上限再取代：被拒絕的請求不會丟掉先前仍然有效的回應
+                self._callbacks[request] = (on_progress, on_complete, on_error)
+                self.stats["rejected"] += 1
+                request.cancel("rejected")
+                self._events.put((request, "error", AIRequestRejected(f"進行中的 AI 請求已達上限 ({self.max_in_flight})。")))
+                return request
+            if supersede:
+                for previous in list(self._callbacks):
+                    if not previous.cancelled():
+                        previous.cancel("superseded")
+                        self.stats["superseded"] += 1
+                    del self._callbacks[previous] # 被取代的請求不再呼叫回呼
+            self._callbacks[request] = (on_progress, on_complete, on_error)
+            self._active.add(request)
+        request.future = self._pool.submit(self._run, task, request)
+        request.future.add_done_callback(lambda _future, r=request: self._discard_active(r))
+        return request
+
+    def _discard_active(self, request):
+        with self._lock:
+            self._active.discard(request)
+
+    def _run(self, task, request):
+        """(工作執行緒) 執行工作函式並把結果排入事件佇列。"""
+        if request.cancelled(): # 被取代或已由 poll() 判定逾時：回呼已處理或不再需要
+            return
+        if request.expired(): # 在佇列中等待時就超過期限：仍需回報，否則 poll() 會因工作已返回而略過它
+            self._events.put((request, "error", AIRequestTimeout(
+                f"AI 請求逾時 (排隊 {time.monotonic() - request.submitted_at:.1f} 秒)。")))
+            return
+        try:
+            result = task(request)
+        except Exception as e:
+            self._events.put((request, "error", e))
+        else:
+            self._events.put((request, "complete", result))
+
+    def poll(self, max_events=100):
+        """
+        (繪製迴圈每幀呼叫) 執行已到達的回呼，並將超過期限的請求以 AIRequestTimeout 結束。不會阻塞。
+        :return: 本次處理的事件數量。
+        """
+        handled = 0
+        # 先處理已到達的結果，再判斷逾時：結果已在佇列中的請求不會被當成逾時而丟棄
+        while handled < max_events:
+            try:
+                request, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == "progress":
+                with self._lock:
+                    callbacks = self._callbacks.get(request)
+                if callbacks and not request.finished and not request.cancelled() and callbacks[0]:
+                    self._safe_call(callbacks[0], payload)
+            elif request.cancel_reason in (None, "rejected"):
+                self._finish(request, kind, payload)
+
+        now = time.monotonic()
+        with self._lock:
+            # 工作函式已經返回的請求，其結果已排入佇列 (超過 max_events 時留到下一次 poll() 處理)
+            expired = [r for r in self._callbacks if not r.finished and r.deadline is not None and now >= r.deadline
+                       and not (r.future is not None and r.future.done())]
+        for request in expired:
+            request.cancel("timeout")
+            self._finish(request, "error", AIRequestTimeout(f"AI 請求逾時 ({now - request.submitted_at:.1f} 秒)。"))
+            handled += 1
+        return handled
+
+    def _finish(self, request, kind, payload):
+        """將請求標記為完成並呼叫對應的回呼 (每個請求只會呼叫一次)。"""
+        with self._lock:
+            callbacks = self._callbacks.pop(request, None)
+            if callbacks is None or request.finished:
+                return
+            request.finished = True
+            if kind == "complete":
+                self.stats["completed"] += 1
+            elif isinstance(payload, AIRequestTimeout):
+                self.stats["timed_out"] += 1
+            else:
+                self.stats["failed"] += 1
+        callback = callbacks[1] if kind == "complete" else callbacks[2]
+        if callback:
+            self._safe_call(callback, payload)
+
+    @staticmethod
+    def _safe_call(callback, payload):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"AI 請求回呼中發生錯誤: {e}")
+
+    def has_pending(self):
+        """是否還有尚未完成的請求。"""
+        with self._lock:
+            return any(not r.finished for r in self._callbacks)
+
+    def cancel_all(self):
+        with self._lock:
+            for request in self._callbacks:
+                request.cancel()
+            self._callbacks.clear()
+
+    def shutdown(self):
+        """取消所有請求並關閉執行緒池 (不等待進行中的網路請求)。"""
+        self.cancel_all()
+        self._pool.shutdown(wait=False)
@@ -1,129 +1,123 @@
 # ar_overlay.py
 import cv2
 import numpy as np
-from PIL import Image # Pillow 用於處理PNG透明度
 import os # 新增os模組用於路徑操作
+import time
+
+from startup import lazy_import
+from image_blend import BlendScratch, clamp_position, blend_premultiplied
+from sprite_cache import SpriteCache
+
+Image = lazy_import("PIL.Image") # Pillow 用於處理PNG透明度 (需要時才載入)
 
 class AROverlay:
-    def __init__(self, overlay_image_path, target_height=None):
+    def __init__(self, overlay_image_path, target_height=None, sprite_cache=None):
         """
         初始化疊加圖像。
         :param overlay_image_path: 要疊加的圖像檔案路徑 (建議PNG格式)。
         :param target_height: 期望疊加圖像的高度 (像素)。圖像會按比例縮放。
+        :param sprite_cache: (可選) 共用的 SpriteCache。狀態圖像預先載入到快取後，切換圖像只需字典查詢。
         """
+        self.sprite_cache = sprite_cache if sprite_cache is not None else SpriteCache(max_entries=8)
+        self._initial_target_height = target_height
+        self._current_target_height = target_height
+        self._blend_scratch = BlendScratch() # 混合用的暫存緩衝區，每幀重複使用
+        self._animation = None # 目前播放中的 SpriteAnimation (None 表示顯示靜態圖像)
         try:
-            # 使用Pillow載入圖像，以更好地處理PNG的Alpha通道
-            # 先載入原始圖像
-            original_pil_image = Image.open(overlay_image_path).convert("RGBA")
-            self.overlay_image_pil = original_pil_image.copy() # 操作副本
+            # 使用Pillow載入圖像 (經由快取)，以更好地處理PNG的Alpha通道，並預先轉為預乘 alpha 的 BGR 陣列
+            self._use_cached_sprite(self.sprite_cache.get(overlay_image_path, target_height))
             self._current_image_path = overlay_image_path # 追蹤目前圖片路徑
-
-            if target_height is not None and target_height > 0:
-                original_width, original_height = self.overlay_image_pil.size
-                if original_height == 0: # 避免除以零
-                    print(f"警告：疊加圖像 '{overlay_image_path}' 原始高度為0，無法調整大小。")
-                else:
-                    aspect_ratio = original_width / original_height
-                    new_height = int(target_height)
-                    new_width = int(new_height * aspect_ratio)
-
-                    if new_width > 0 and new_height > 0:
-                        print(f"將疊加圖像 '{overlay_image_path}' 從 {original_width}x{original_height} 調整為 {new_width}x{new_height}")
-                        self.overlay_image_pil = self.overlay_image_pil.resize((new_width, new_height), Image.LANCZOS) # 使用高品質縮放
-                    else:
-                        print(f"警告：計算出的疊加圖像新尺寸 ({new_width}x{new_height}) 無效，不進行調整大小。")
-
-            # 將Pillow圖像轉換為OpenCV格式
-            # OpenCV 的 BGRA 順序與 Pillow 的 RGBA 不同，但 alpha_composite 會處理
-            # self.overlay_image_cv = cv2.cvtColor(np.array(self.overlay_image_pil), cv2.COLOR_RGBA2BGRA) 
-            
-            # 保持Pillow格式以利用其alpha合成能力
-            self.overlay_width, self.overlay_height = self.overlay_image_pil.size
             print(f"疊加圖像 '{overlay_image_path}' 已成功載入並處理。最終顯示尺寸: {self.overlay_width}x{self.overlay_height}")
         except FileNotFoundError:
             raise IOError(f"疊加圖像檔案未找到: {overlay_image_path}")
         except Exception as e:
             raise IOError(f"載入疊加圖像時發生錯誤 ({overlay_image_path}): {e}")
 
+    def _use_cached_sprite(self, cached_sprite):
+        """切換為快取中的疊加圖 (不複製影像資料)。"""
+        self.overlay_image_pil = cached_sprite.image_pil
+        self.sprite = cached_sprite.sprite
+        self.overlay_width, self.overlay_height = cached_sprite.width, cached_sprite.height
+
     def update_overlay_image(self, new_image_path, target_height=None):
         """
-        更新疊加的圖像。
+        更新疊加的圖像。若圖像已在快取中，則不需讀檔或重新縮放。
         :param new_image_path: 新的圖像檔案路徑。
         :param target_height: (可選) 期望新圖像的高度，如果為None，則使用初始化時的高度。
         """
-        if hasattr(self, '_current_image_path') and self._current_image_path == new_image_path:
-            # print(f"DEBUG: 疊加圖像 '{new_image_path}' 已載入，無需更新。") # 可選的除錯訊息
-            return # 如果路徑相同，則不執行任何操作
+        current_target_height = target_height if target_height is not None else self._initial_target_height
+        if self._animation is not None:
+            self.stop_animation() # 切換回靜態圖像
+        if self._current_image_path == new_image_path and self._current_target_height == current_target_height:
+            return # 如果路徑與高度相同，則不執行任何操作
 
         try:
-            original_pil_image = Image.open(new_image_path).convert("RGBA")
-            self.overlay_image_pil = original_pil_image.copy()
-
-            # 如果未提供 target_height，則嘗試使用初始化時的 target_height (如果有的話)
-            # 這裡簡化處理，直接使用傳入的 target_height 或不縮放
-            # 更完善的做法是保存初始化時的 target_height
-            current_target_height = target_height if target_height is not None else getattr(self, '_initial_target_height', None)
-            if current_target_height is None and hasattr(self, 'overlay_height') and self.overlay_image_pil.height != self.overlay_height:
-                 # 如果沒有明確的 target_height，但新圖片高度與當前不同，可能需要重新計算以保持一致性
-                 # 為了MVP簡化，這裡我們先假設如果提供了 target_height 就用它，否則用原始尺寸
-                 pass
-
-            if current_target_height is not None and current_target_height > 0:
-                original_width, original_height = self.overlay_image_pil.size
-                if original_height > 0:
-                    aspect_ratio = original_width / original_height
-                    new_height = int(current_target_height)
-                    new_width = int(new_height * aspect_ratio)
-                    if new_width > 0 and new_height > 0:
-                        self.overlay_image_pil = self.overlay_image_pil.resize((new_width, new_height), Image.LANCZOS)
-            
-            self.overlay_width, self.overlay_height = self.overlay_image_pil.size
-            print(f"疊加圖像已更新為 '{new_image_path}'。顯示尺寸: {self.overlay_width}x{self.overlay_height}")
+            self._use_cached_sprite(self.sprite_cache.get(new_image_path, current_target_height))
             self._current_image_path = new_image_path # 更新追蹤的路徑
+            self._current_target_height = current_target_height
+            print(f"疊加圖像已更新為 '{new_image_path}'。顯示尺寸: {self.overlay_width}x{self.overlay_height}")
         except FileNotFoundError:
             print(f"警告：無法找到新的疊加圖像檔案 '{new_image_path}'。疊加圖像未改變。")
         except Exception as e:
             print(f"警告：更新疊加圖像時發生錯誤 ({new_image_path}): {e}。疊加圖像未改變。")
 
+    def play_animation(self, animation):
+        """
+        改為播放動畫 (SpriteAnimation)。若已在播放同一個動畫則不重新開始。
+        :param animation: sprite_animation.SpriteAnimation 實例。
+        """
+        if self._animation is animation:
+            return
+        self._animation = animation
+        animation.restart()
+        self.overlay_width, self.overlay_height = animation.width, animation.height
+
+    def stop_animation(self):
+        """停止播放動畫，恢復顯示目前的靜態圖像。"""
+        if self._animation is None:
+            return
+        self._animation = None
+        self.overlay_width, self.overlay_height = self.overlay_image_pil.size
+
+    def current_sprite(self):
+        """回傳目前應顯示的 PreparedSprite (播放動畫時依牆上時間挑選幀)。"""
+        return self._animation.sprite_at(time.monotonic()) if self._animation is not None else self.sprite
+
+    def update_layer(self, layer, frame_shape, position=(50, 50)):
+        """
+        將目前的角色圖像設定到合成器圖層上 (不直接修改幀)。
+        :param layer: compositor.Layer。
+        :param frame_shape: 背景幀的 shape，用於邊界調整。
+        :param position: 疊加圖像左上角的期望 (x, y) 座標。
+        :return: 實際使用的左上角 (x, y) 座標。
+        """
+        actual_position = clamp_position(frame_shape, (self.overlay_width, self.overlay_height), position)
+        layer.set_sprite(self.current_sprite(), actual_position)
+        return actual_position
+
+    def apply_overlay(self, frame_cv, position=(50, 50)):
+        """
+        將疊加圖像就地混合到背景幀上，只處理疊加圖覆蓋的像素。
+        :param frame_cv: 背景影像幀 (OpenCV BGR格式)，會被就地修改。
+        :param position: 疊加圖像左上角在背景幀上的 (x, y) 座標。超出畫面時的調整方式與 apply_overlay_pil 相同。
+        :return: 實際使用的左上角 (x, y) 座標。
+        """
+        actual_position = clamp_position(frame_cv.shape, (self.overlay_width, self.overlay_height), position)
+        # 播放動畫時依牆上時間挑選目前的幀 (連續陣列的視圖，不需配置記憶體)
+        blend_premultiplied(frame_cv, self.current_sprite(), actual_position, self._blend_scratch)
+        return actual_position
+
     def apply_overlay_pil(self, background_frame_cv, position=(50, 50)):
         """
-        使用Pillow將帶有Alpha通道的圖像疊加到背景幀上。
+        將帶有Alpha通道的圖像疊加到背景幀的副本上 (保留原介面；不修改原始幀)。
         :param background_frame_cv: 背景影像幀 (OpenCV BGR格式)。
         :param position: 疊加圖像左上角在背景幀上的 (x, y) 座標。
         :return: 疊加後的影像幀 (OpenCV BGR格式)。
         """
         try:
-            # 將OpenCV BGR幀轉換為Pillow RGBA幀 (Alpha設為不透明)
-            background_pil = Image.fromarray(cv2.cvtColor(background_frame_cv, cv2.COLOR_BGR2RGBA)).convert("RGBA")
-            
-            # 創建一個與背景相同大小的透明畫布，用於粘貼疊加圖
-            # 確保疊加圖像不會超出背景邊界
-            paste_x, paste_y = position
-            
-            # 如果疊加圖像超出右邊界
-            if paste_x + self.overlay_width > background_pil.width:
-                paste_x = background_pil.width - self.overlay_width
-            # 如果疊加圖像超出下邊界
-            if paste_y + self.overlay_height > background_pil.height:
-                paste_y = background_pil.height - self.overlay_height
-            # 如果疊加圖像超出左邊界 (通常 position[0] >= 0)
-            if paste_x < 0:
-                paste_x = 0
-            # 如果疊加圖像超出上邊界 (通常 position[1] >= 0)
-            if paste_y < 0:
-                paste_y = 0
-            
-            actual_position = (paste_x, paste_y)
-
-            # 直接在背景上粘貼，利用Pillow的alpha混合
-            # 複製一份背景以避免修改原始背景 (如果背景PIL物件會被重用)
-            background_copy_pil = background_pil.copy()
-            background_copy_pil.paste(self.overlay_image_pil, actual_position, self.overlay_image_pil) # 第三個參數是mask
-
-            # 將Pillow RGBA圖像轉換回OpenCV BGR格式
-            composited_cv = cv2.cvtColor(np.array(background_copy_pil), cv2.COLOR_RGBA2BGR)
+            composited_cv = background_frame_cv.copy()
+            self.apply_overlay(composited_cv, position)
             return composited_cv
-            
         except Exception as e:
             print(f"應用疊加時發生錯誤: {e}")
             return background_frame_cv # 出錯時返回原圖
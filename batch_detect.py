@@ -0,0 +1,256 @@
+# batch_detect.py
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from object_detector import MediaPipeObjectDetector, MODEL_FILE
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# 每個工作行程各自擁有一個偵測器 (由 _init_worker 建立)
+_worker_detector = None
+_worker_target_objects = None
+
+
+def _init_worker(detector_kwargs, target_objects):
+    """行程池的初始化函式：在每個工作行程中建立一個偵測器。"""
+    global _worker_detector, _worker_target_objects
+    # 平行度由行程數提供：每個行程只用一個 OpenCV 執行緒，避免執行緒數超過核心數
+    cv2.setNumThreads(1)
+    _worker_detector = MediaPipeObjectDetector(**detector_kwargs)
+    _worker_target_objects = _worker_detector.compile_label_filter(target_objects)
+
+
+def _result_to_record(source, frame_index, timestamp_ms, result):
+    """將 DetectionResult 轉為可序列化的紀錄字典。"""
+    detections = []
+    for i in range(len(result)):
+        detections.append({
+            "label": result.label(i),
+            "score": round(float(result.scores[i]), 4),
+            "box": [round(float(v), 1) for v in result.boxes[i]], # (x1, y1, x2, y2) 像素座標
+        })
+    return {
+        "source": source,
+        "frame_index": frame_index,
+        "timestamp_ms": timestamp_ms,
+        "detections": detections,
+    }
+
+
+def _process_video_segment(task):
+    """
+    (工作行程) 處理影片中的一段連續幀。
+    每個工作行程自行開啟影片並跳到片段起點，讓解碼也能平行進行。
+    :param task: (影片路徑, 起始幀, 結束幀 (不含), 取樣間隔, 影片 FPS)
+    :return: 此片段的紀錄列表 (依幀順序)。
+    """
+    video_path, start_frame, end_frame, stride, fps = task
+    cap = cv2.VideoCapture(video_path)
+    records = []
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_index = start_frame
+        while frame_index < end_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if (frame_index - start_frame) % stride == 0:
+                result = _worker_detector.detect(frame, target_objects=_worker_target_objects)
+                timestamp_ms = int(frame_index * 1000 / fps) if fps else None
+                records.append(_result_to_record(video_path, frame_index, timestamp_ms, result))
+            frame_index += 1
+    finally:
+        cap.release()
+    return records
+
+
+def _process_image_chunk(image_paths):
+    """
+    (工作行程) 處理一批影像檔案。影像由工作行程自行讀取，避免在行程間傳遞影像資料。
+    :param image_paths: [(幀索引, 影像路徑), ...]
+    :return: 此批次的紀錄列表 (依輸入順序)。
+    """
+    records = []
+    for frame_index, image_path in image_paths:
+        frame = cv2.imread(image_path)
+        if frame is None:
+            print(f"警告：無法讀取影像 '{image_path}'，已略過。")
+            continue
+        result = _worker_detector.detect(frame, target_objects=_worker_target_objects)
+        records.append(_result_to_record(image_path, frame_index, None, result))
+    return records
+
+
+def _list_images(directory):
+    """列出資料夾中的影像檔案 (依檔名排序)。"""
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, name) for name in names]
+
+
+def _build_tasks(input_path, chunk_size, stride):
+    """
+    將輸入切分為工作任務。
+    :return: (工作函式, 任務列表, 預估處理的幀數)
+    """
+    if os.path.isdir(input_path):
+        # 先編號再取樣，與影片相同，frame_index 是原始序列中的位置
+        indexed = list(enumerate(_list_images(input_path)))[::stride]
+        tasks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+        return _process_image_chunk, tasks, len(indexed)
+
+    if not os.path.isfile(input_path):
+        raise FileNotFoundError(f"找不到輸入的影片或影像資料夾: {input_path}")
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise IOError(f"無法開啟影片: {input_path}")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    cap.release()
+    if total_frames <= 0:
+        raise IOError(f"無法取得影片的總幀數: {input_path}")
+
+    # 片段長度為取樣間隔的倍數，讓每個片段內的取樣位置與整體一致
+    segment_length = chunk_size * stride
+    tasks = [(input_path, start, min(start + segment_length, total_frames), stride, fps)
+             for start in range(0, total_frames, segment_length)]
+    return _process_video_segment, tasks, (total_frames + stride - 1) // stride
+
+
+class JsonlResultWriter:
+    """將每幀的偵測結果逐行寫入 JSONL 檔案。"""
+
+    def __init__(self, output_path):
+        self._file = open(output_path, "w", encoding="utf-8")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """將每幀的偵測結果分批 (row group) 寫入 Parquet 檔案。需要安裝 pyarrow。"""
+
+    def __init__(self, output_path, batch_size=1024):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("輸出 Parquet 需要安裝 pyarrow (pip install pyarrow)，或改用 --format jsonl。")
+        self._pa = pa
+        detection_type = pa.struct([("label", pa.string()), ("score", pa.float32()), ("box", pa.list_(pa.float32()))])
+        self._schema = pa.schema([
+            ("source", pa.string()),
+            ("frame_index", pa.int64()),
+            ("timestamp_ms", pa.int64()),
+            ("detections", pa.list_(detection_type)),
+        ])
+        self._writer = pq.ParquetWriter(output_path, self._schema)
+        self._batch_size = batch_size
+        self._buffer = []
+
+    def write(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._writer.write_table(self._pa.Table.from_pylist(self._buffer, schema=self._schema))
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def run_batch_detection(input_path, output_path, output_format="jsonl", workers=None, chunk_size=32,
+                        stride=1, target_objects=None, detector_kwargs=None):
+    """
+    以行程池對影片或影像資料夾進行離線物件偵測，並依幀順序將結果串流寫入檔案。
+    :param input_path: 影片檔案路徑，或影像資料夾路徑。
+    :param output_path: 輸出檔案路徑。
+    :param output_format: "jsonl" 或 "parquet"。
+    :param workers: 工作行程數量，None 表示使用 CPU 核心數。
+    :param chunk_size: 每個任務處理的幀數 (越大則排程開銷越低，但記憶體用量與延遲越高)。
+    :param stride: 每隔幾幀取樣一次 (1 表示每幀都處理)。
+    :param target_objects: (可選) 目標物件名稱列表。
+    :param detector_kwargs: (可選) 傳給 MediaPipeObjectDetector 的參數 (僅支援 image 模式)。
+    :return: 統計資訊字典 (處理幀數、耗時秒數、每秒幀數)。
+    """
+    detector_kwargs = dict(detector_kwargs or {})
+    detector_kwargs["running_mode"] = "image"
+    workers = workers or os.cpu_count() or 1
+    stride = max(1, int(stride))
+    process_fn, tasks, expected_frames = _build_tasks(input_path, max(1, int(chunk_size)), stride)
+
+    if output_format == "jsonl":
+        writer = JsonlResultWriter(output_path)
+    elif output_format == "parquet":
+        writer = ParquetResultWriter(output_path)
+    else:
+        raise ValueError(f"不支援的輸出格式: {output_format} (可用: jsonl, parquet)")
+
+    print(f"開始批次偵測: {input_path} (約 {expected_frames} 幀，{len(tasks)} 個任務，{workers} 個工作行程)")
+    frames_done = 0
+    start_time = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(detector_kwargs, target_objects)) as executor:
+            # executor.map 依任務順序回傳結果，因此輸出檔案中的幀順序與輸入一致
+            for records in executor.map(process_fn, tasks):
+                for record in records:
+                    writer.write(record)
+                frames_done += len(records)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start_time
+
+    stats = {
+        "frames": frames_done,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames_done / elapsed, 2) if elapsed > 0 else 0.0,
+        "workers": workers,
+    }
+    print(f"批次偵測完成: {frames_done} 幀，耗時 {stats['seconds']} 秒，吞吐量 {stats['fps']} FPS。結果已寫入 {output_path}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="對影片或影像資料夾進行離線批次物件偵測。")
+    parser.add_argument("input", help="影片檔案或影像資料夾路徑")
+    parser.add_argument("-o", "--output", required=True, help="輸出檔案路徑 (.jsonl 或 .parquet)")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default=None, help="輸出格式 (預設依副檔名判斷)")
+    parser.add_argument("--workers", type=int, default=None, help="工作行程數量 (預設為 CPU 核心數)")
+    parser.add_argument("--chunk-size", type=int, default=32, help="每個任務處理的幀數")
+    parser.add_argument("--stride", type=int, default=1, help="每隔幾幀取樣一次")
+    parser.add_argument("--targets", nargs="*", default=None, help="只輸出這些物件 (例如 person cup book)")
+    parser.add_argument("--model", default=MODEL_FILE, help="TFLite 模型檔案路徑")
+    parser.add_argument("--min-confidence", type=float, default=0.4, help="最小偵測信賴度")
+    parser.add_argument("--max-results", type=int, default=5, help="每幀最大偵測數量")
+    parser.add_argument("--inference-max-side", type=int, default=None, help="推論解析度的最長邊 (像素)")
+    args = parser.parse_args()
+
+    output_format = args.format or ("parquet" if args.output.lower().endswith(".parquet") else "jsonl")
+    detector_kwargs = {
+        "model_path": args.model,
+        "min_detection_confidence": args.min_confidence,
+        "max_results": args.max_results,
+        "inference_max_side": args.inference_max_side,
+    }
+    try:
+        run_batch_detection(args.input, args.output, output_format=output_format, workers=args.workers,
+                            chunk_size=args.chunk_size, stride=args.stride,
+                            target_objects=args.targets, detector_kwargs=detector_kwargs)
+    except (IOError, ValueError, ImportError) as e:
+        print(f"批次偵測失敗: {e}")
+
+
+if __name__ == '__main__':
+    main()
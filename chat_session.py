@@ -0,0 +1,124 @@
+# chat_session.py
+import re
+import threading
+
+_CJK_CHARS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+
+def estimate_tokens(text):
+    """
+    粗估文字的 token 數 (不需呼叫 API)：CJK 字元約一個 token，其他文字約每 4 個字元一個 token。
+    用於控制每次請求的提示大小，偏高估比偏低估安全。
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_CHARS.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def _first_sentence(text, max_chars):
+    """取出文字的第一句 (最多 max_chars 個字元)，用於產生摘要。"""
+    text = " ".join(text.split())
+    match = _SENTENCE_END.search(text)
+    sentence = text[:match.end()] if match else text
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars] + "…"
+
+
+class ChatTurn:
+    __slots__ = ("role", "text", "tokens")
+
+    def __init__(self, role, text):
+        self.role = role # "user" 或 "model"
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+
+class ChatSession:
+    def __init__(self, name, max_history_tokens=1200, max_turns=12, digest_max_tokens=200,
+                 digest_chars_per_turn=40, summarizer=None):
+        """
+        有 token 預算的多輪對話紀錄。只保留最近的對話 (滾動視窗)，較舊的對話會被壓縮成一段簡短的摘要，
+        因此無論對話多長，每次請求的提示大小都有上限：摘要 + 視窗內的對話 + 目前的提問。
+        :param name: 對話名稱 (通常為個性名稱)。
+        :param max_history_tokens: 視窗內歷史對話的 token 上限 (估計值)。
+        :param max_turns: 視窗內最多保留的往返次數 (一問一答為一次)。
+        :param digest_max_tokens: 摘要的 token 上限，超過時捨棄最舊的摘要項目。
+        :param digest_chars_per_turn: 每次往返在摘要中保留的字元數 (使用預設摘要方式時)。
+        :param summarizer: (可選) summarizer(user_text, model_text) -> 摘要字串，取代預設的擷取式摘要。
+        """
+        self.name = name
+        self.max_history_tokens = max(1, int(max_history_tokens))
+        self.max_turns = max(1, int(max_turns))
+        self.digest_max_tokens = max(0, int(digest_max_tokens))
+        self.digest_chars_per_turn = max(8, int(digest_chars_per_turn))
+        self.summarizer = summarizer
+        self.turns = [] # ChatTurn 列表，依時間排列 (user/model 交替)
+        self.digest_items = [] # 被壓縮的舊對話摘要，依時間排列
+        self.compacted_turns = 0
+        self._lock = threading.Lock()
+
+    @property
+    def history_tokens(self):
+        return sum(turn.tokens for turn in self.turns)
+
+    @property
+    def digest(self):
+        return "；".join(self.digest_items)
+
+    def build_contents(self, user_text):
+        """
+        組合送給模型的多輪對話內容 (google.generativeai 的 contents 格式)。
+        摘要附加在目前的提問之前，讓 user/model 的角色維持交替。
+        :param user_text: 目前的提問 (可包含環境資訊)。
+        :return: [{"role": ..., "parts": [...]}, ...]
+        """
+        with self._lock:
+            contents = [{"role": turn.role, "parts": [turn.text]} for turn in self.turns]
+            digest = self.digest
+        if digest:
+            user_text = f"[先前對話摘要：{digest}]\n{user_text}"
+        contents.append({"role": "user", "parts": [user_text]})
+        return contents
+
+    def add_exchange(self, user_text, model_text):
+        """記錄一次完整的問答，並在超出預算時壓縮較舊的對話。"""
+        with self._lock:
+            self.turns.append(ChatTurn("user", user_text))
+            self.turns.append(ChatTurn("model", model_text))
+            self._compact()
+
+    def _compact(self):
+        """(需持有鎖) 將最舊的往返移入摘要，直到視窗符合 token 與次數上限 (至少保留最近一次往返)。"""
+        while len(self.turns) > 2 and (len(self.turns) > 2 * self.max_turns or self.history_tokens > self.max_history_tokens):
+            user_turn, model_turn = self.turns[0], self.turns[1]
+            del self.turns[:2]
+            self.compacted_turns += 1
+            if self.digest_max_tokens == 0:
+                continue
+            if self.summarizer is not None:
+                item = self.summarizer(user_turn.text, model_turn.text)
+            else:
+                item = (f"使用者問「{_first_sentence(user_turn.text, self.digest_chars_per_turn)}」，"
+                        f"你答「{_first_sentence(model_turn.text, self.digest_chars_per_turn)}」")
+            if item:
+                self.digest_items.append(item)
+            while self.digest_items and estimate_tokens(self.digest) > self.digest_max_tokens:
+                self.digest_items.pop(0) # 摘要也有上限：捨棄最舊的項目
+
+    def prompt_tokens(self, user_text=""):
+        """估計下一次請求的提示 token 數 (摘要 + 視窗內的對話 + 目前的提問)。"""
+        with self._lock:
+            return estimate_tokens(self.digest) + self.history_tokens + estimate_tokens(user_text)
+
+    def reset(self):
+        with self._lock:
+            self.turns = []
+            self.digest_items = []
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {"turns": len(self.turns) // 2, "history_tokens": self.history_tokens,
+                    "digest_tokens": estimate_tokens(self.digest), "compacted_turns": self.compacted_turns}
@@ -0,0 +1,156 @@
+# compositor.py
+import cv2
+import numpy as np
+
+from image_blend import BlendScratch, PreparedSprite, blend_premultiplied
+
+
+class Layer:
+    """
+    合成器中的一個圖層：預乘 alpha 的點陣圖 (PreparedSprite)、在幀上的位置與是否顯示。
+    內容可以直接指定 (set_sprite)，或以內容鍵與建立函式延後產生 (set_content)：
+    內容鍵改變時圖層被標記為 dirty，下次合成時才重新建立點陣圖。
+    """
+    __slots__ = ("name", "sprite", "position", "visible", "dirty", "_content_key", "_builder")
+
+    def __init__(self, name):
+        self.name = name
+        self.sprite = None
+        self.position = (0, 0)
+        self.visible = False
+        self.dirty = False
+        self._content_key = None
+        self._builder = None
+
+    def set_sprite(self, sprite, position):
+        """直接指定點陣圖與位置並顯示圖層。"""
+        self.sprite = sprite
+        self.position = position
+        self.visible = sprite is not None
+        self.dirty = False
+        self._content_key = None
+        self._builder = None
+
+    def set_content(self, content_key, builder):
+        """
+        以內容鍵描述圖層內容；只有內容鍵改變時才標記為 dirty。
+        :param content_key: 可比較的內容描述 (例如框的座標與標籤)。
+        :param builder: 無參數函式，回傳 (PreparedSprite 或 None, 位置 (x, y))，在合成時才呼叫。
+        """
+        self.visible = True
+        if content_key == self._content_key and self._builder is not None:
+            return
+        self._content_key = content_key
+        self._builder = builder
+        self.dirty = True
+
+    def hide(self):
+        self.visible = False
+
+    def refresh(self):
+        """若圖層為 dirty，重新建立點陣圖。"""
+        if self.dirty:
+            self.sprite, self.position = self._builder()
+            self.dirty = False
+
+
+class Compositor:
+    def __init__(self, layer_names=()):
+        """
+        依序將多個圖層一次混合到相機幀上。每個圖層只處理它覆蓋的像素 (ROI)，
+        整個過程都是 NumPy 整數運算，每幀不需要轉換成 Pillow 影像。
+        :param layer_names: 依繪製順序 (由下到上) 的圖層名稱。
+        """
+        self.layers = []
+        self._layers_by_name = {}
+        self._blend_scratch = BlendScratch()
+        for name in layer_names:
+            self.add_layer(name)
+
+    def add_layer(self, name):
+        """在最上層新增一個圖層並回傳。"""
+        if name in self._layers_by_name:
+            raise ValueError(f"圖層 '{name}' 已存在。")
+        layer = Layer(name)
+        self.layers.append(layer)
+        self._layers_by_name[name] = layer
+        return layer
+
+    def layer(self, name):
+        return self._layers_by_name[name]
+
+    def compose(self, frame):
+        """
+        將所有顯示中的圖層依序就地混合到幀上。
+        :param frame: OpenCV BGR uint8 幀 (會被就地修改)。
+        :return: 被修改的區域列表 [(x, y, w, h), ...]。
+        """
+        changed_rects = []
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            layer.refresh()
+            if layer.sprite is None:
+                continue
+            rect = blend_premultiplied(frame, layer.sprite, layer.position, self._blend_scratch)
+            if rect is not None:
+                changed_rects.append(rect)
+        return changed_rects
+
+
+def build_box_overlay(boxes, frame_shape, color=(0, 255, 0), thickness=2, show_labels=True):
+    """
+    將偵測/追蹤框畫成一張只涵蓋所有框範圍的透明點陣圖 (供除錯圖層使用)。
+    :param boxes: [(標籤, (x1, y1, x2, y2)), ...] 像素座標。
+    :param frame_shape: 幀的 shape，用於裁切範圍。
+    :param color: BGR 顏色。
+    :return: (PreparedSprite 或 None, 左上角位置 (x, y))
+    """
+    frame_h, frame_w = frame_shape[:2]
+    if not boxes:
+        return None, (0, 0)
+    font_scale = 0.5
+    label_margin = 18 if show_labels else 0 # 標籤文字畫在框的上方
+    x_min = max(0, min(int(box[0]) for _, box in boxes) - thickness)
+    y_min = max(0, min(int(box[1]) for _, box in boxes) - thickness - label_margin)
+    x_max = min(frame_w, max(int(box[2]) for _, box in boxes) + thickness + 1)
+    y_max = min(frame_h, max(int(box[3]) for _, box in boxes) + thickness + 1)
+    if x_max <= x_min or y_max <= y_min:
+        return None, (0, 0)
+
+    rgba = np.zeros((y_max - y_min, x_max - x_min, 4), dtype=np.uint8)
+    rgba_color = (color[2], color[1], color[0], 255) # 點陣圖為 RGBA 順序
+    for label, box in boxes:
+        x1, y1, x2, y2 = (int(v) for v in box)
+        cv2.rectangle(rgba, (x1 - x_min, y1 - y_min), (x2 - x_min, y2 - y_min), rgba_color, thickness)
+        if show_labels and label:
+            text_origin = (x1 - x_min, max(12, y1 - y_min - 5))
+            cv2.putText(rgba, label, text_origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, rgba_color, 1)
+    return PreparedSprite.from_rgba(rgba), (x_min, y_min)
+
+
+def build_status_overlay(lines, frame_shape, origin=(10, 10), color=(255, 255, 255), background_alpha=160):
+    """
+    將幾行狀態文字 (例如啟動時各元件的載入狀態) 畫成左上角的半透明點陣圖。
+    文字以 cv2.putText 繪製，只支援 ASCII。
+    :param lines: 文字行列表。
+    :param frame_shape: 幀的 shape，用於裁切範圍。
+    :param origin: 左上角位置 (x, y)。
+    :param color: BGR 文字顏色。
+    :return: (PreparedSprite 或 None, 左上角位置 (x, y))
+    """
+    if not lines:
+        return None, (0, 0)
+    font_scale, line_height, padding = 0.5, 20, 6
+    text_width = max(cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)[0][0] for line in lines)
+    frame_h, frame_w = frame_shape[:2]
+    width = min(text_width + padding * 2, frame_w - origin[0])
+    height = min(line_height * len(lines) + padding, frame_h - origin[1])
+    if width <= 0 or height <= 0:
+        return None, (0, 0)
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    rgba[..., 3] = background_alpha # 黑色半透明背景
+    rgba_color = (color[2], color[1], color[0], 255) # 點陣圖為 RGBA 順序
+    for index, line in enumerate(lines):
+        cv2.putText(rgba, line, (padding, line_height * (index + 1) - 4), cv2.FONT_HERSHEY_SIMPLEX, font_scale, rgba_color, 1)
+    return PreparedSprite.from_rgba(rgba), origin
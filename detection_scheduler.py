@@ -0,0 +1,167 @@
+# detection_scheduler.py
+import time
+import threading
+import cv2
+import numpy as np
+
+SCHEDULE_MODES = ("always", "cadence", "motion")
+
+
+class DetectionScheduler:
+    def __init__(self, detector, mode="motion", every_n_frames=5, interval_ms=None,
+                 motion_threshold=4.0, motion_downscale_width=64, max_skip_ms=2000):
+        """
+        包裝 MediaPipeObjectDetector，決定哪些幀需要真正執行推論。
+        被略過的幀會直接回傳上一次的偵測結果，因此呼叫端介面與 detect()/detect_objects() 完全相同。
+        :param detector: MediaPipeObjectDetector 實例 (或任何具有相同 detect 介面的物件)。
+        :param mode: 排程模式。"always" 每幀都推論；"cadence" 依固定節奏推論；"motion" 畫面有變化時才推論。
+        :param every_n_frames: (cadence 模式) 每 N 幀推論一次。
+        :param interval_ms: (cadence 模式，可選) 每隔 T 毫秒推論一次。若有設定則優先於 every_n_frames。
+        :param motion_threshold: (motion 模式) 縮小後灰階圖的平均絕對差異門檻 (0~255)，超過才視為場景有變化。
+        :param motion_downscale_width: (motion 模式) 變化偵測用的縮小寬度 (像素)。
+        :param max_skip_ms: (motion 模式) 即使畫面沒有變化，最多隔多久也要強制推論一次，避免結果過時。None 表示不強制。
+        """
+        if mode not in SCHEDULE_MODES:
+            raise ValueError(f"不支援的偵測排程模式: {mode} (可用: {', '.join(SCHEDULE_MODES)})")
+        self.detector = detector
+        self.mode = mode
+        self.every_n_frames = max(1, int(every_n_frames))
+        self.interval_ms = interval_ms
+        self.motion_threshold = motion_threshold
+        self.motion_downscale_width = max(8, int(motion_downscale_width))
+        self.max_skip_ms = max_skip_ms
+
+        self._lock = threading.Lock()
+        self._frames_seen = 0
+        self._inferences_run = 0
+        self._inferences_skipped = 0
+        self._frames_since_inference = 0
+        self._last_inference_time = None # time.monotonic() 秒
+        self._reference_thumbnail = None # 上次推論時的縮小灰階圖 (motion 模式)
+        self._last_result = None # 上一次推論的 DetectionResult
+
+    @classmethod
+    def from_config(cls, detector, detection_settings):
+        """
+        依 config.json 中的 detection_settings 區塊建立排程器。
+        :param detector: 要包裝的偵測器實例。
+        :param detection_settings: 設定字典，例如 {"schedule_mode": "motion", "every_n_frames": 5, ...}。
+        """
+        settings = detection_settings or {}
+        return cls(
+            detector,
+            mode=settings.get("schedule_mode", "motion"),
+            every_n_frames=settings.get("every_n_frames", 5),
+            interval_ms=settings.get("interval_ms"),
+            motion_threshold=settings.get("motion_threshold", 4.0),
+            motion_downscale_width=settings.get("motion_downscale_width", 64),
+            max_skip_ms=settings.get("max_skip_ms", 2000))
+
+    def _make_thumbnail(self, frame_cv):
+        """將幀縮小並轉為灰階，用於低成本的幀差比較。"""
+        height, width = frame_cv.shape[:2]
+        thumb_width = min(self.motion_downscale_width, width)
+        thumb_height = max(1, int(round(height * thumb_width / width)))
+        small = cv2.resize(frame_cv, (thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_run(self, frame_cv):
+        """
+        判斷這一幀是否需要執行推論，並更新內部計數。
+        :param frame_cv: OpenCV BGR 格式的影像幀。
+        :return: True 表示應該執行推論。
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._frames_seen += 1
+            self._frames_since_inference += 1
+            first_run = self._last_inference_time is None
+            elapsed_ms = 0.0 if first_run else (now - self._last_inference_time) * 1000.0
+            frames_since_inference = self._frames_since_inference
+            reference_thumbnail = self._reference_thumbnail
+
+        thumbnail = None
+        if self.mode == "always" or first_run:
+            run = True
+        elif self.mode == "cadence":
+            if self.interval_ms is not None:
+                run = elapsed_ms >= self.interval_ms
+            else:
+                run = frames_since_inference >= self.every_n_frames
+        else: # motion
+            thumbnail = self._make_thumbnail(frame_cv)
+            if self.max_skip_ms is not None and elapsed_ms >= self.max_skip_ms:
+                run = True # 強制刷新，避免結果過時
+            elif reference_thumbnail is None or reference_thumbnail.shape != thumbnail.shape:
+                run = True
+            else:
+                # 與上次推論時的畫面比較 (而非上一幀)，讓緩慢的累積變化也能被偵測到
+                motion_score = float(np.mean(cv2.absdiff(thumbnail, reference_thumbnail)))
+                run = motion_score >= self.motion_threshold
+
+        with self._lock:
+            if run:
+                self._frames_since_inference = 0
+                self._last_inference_time = now
+                self._inferences_run += 1
+                if self.mode == "motion":
+                    self._reference_thumbnail = thumbnail if thumbnail is not None else self._make_thumbnail(frame_cv)
+            else:
+                self._inferences_skipped += 1
+        return run
+
+    def detect(self, frame_cv, target_objects=None):
+        """
+        與 MediaPipeObjectDetector.detect() 相同的介面。
+        若排程決定略過推論，則回傳上一次的 DetectionResult。
+        :return: DetectionResult (首次推論前略過時為 None)
+        """
+        if not self.should_run(frame_cv):
+            with self._lock:
+                return self._last_result
+
+        result = self.detector.detect(frame_cv, target_objects=target_objects)
+        with self._lock:
+            self._last_result = result
+        return result
+
+    def detect_objects(self, frame_cv, target_objects=None, draw_boxes=False, show_confidence=False):
+        """
+        與 MediaPipeObjectDetector.detect_objects() 相同的介面。
+        若排程決定略過推論，則回傳上一次偵測到的物件名稱。
+        :return: (偵測到的物件名稱列表 (小寫, 不重複), 處理後的影像幀)
+        """
+        result = self.detect(frame_cv, target_objects=target_objects)
+        detected_names = result.names() if result is not None else []
+        if not draw_boxes or result is None:
+            return detected_names, frame_cv
+        annotated_image = self.detector.draw_detections(frame_cv.copy(), result, show_confidence=show_confidence)
+        return detected_names, annotated_image
+
+    @property
+    def stats(self):
+        """回傳排程統計：看過的幀數、實際推論次數、略過的推論次數與略過比例。"""
+        with self._lock:
+            frames_seen = self._frames_seen
+            inferences_run = self._inferences_run
+            inferences_skipped = self._inferences_skipped
+        return {
+            "mode": self.mode,
+            "frames_seen": frames_seen,
+            "inferences_run": inferences_run,
+            "inferences_skipped": inferences_skipped,
+            "skip_ratio": (inferences_skipped / frames_seen) if frames_seen else 0.0,
+        }
+
+    def reset(self):
+        """清除排程狀態，下一幀必定執行推論。"""
+        with self._lock:
+            self._frames_since_inference = 0
+            self._last_inference_time = None
+            self._reference_thumbnail = None
+
+    def close(self):
+        """關閉被包裝的偵測器。"""
+        self.detector.close()
@@ -0,0 +1,130 @@
+# detection_worker.py
+import threading
+import time
+
+
+class DetectionWorker:
+    def __init__(self, detector, target_objects=None, name="DetectionWorker"):
+        """
+        在背景執行緒中執行物件偵測，與畫面繪製迴圈解耦。
+        主迴圈透過 submit_frame() 將最新的幀放入單一槽位的「最新幀信箱」，
+        若偵測器尚未處理完上一幀，舊的幀會直接被新的幀覆蓋 (丟棄過時的幀)。
+        :param detector: 具有 detect(frame, target_objects=...) 方法的偵測器實例
+                         (MediaPipeObjectDetector 或 DetectionScheduler)。
+        :param target_objects: (可選) 目標物件名稱列表，會傳遞給偵測器。
+        :param name: 背景執行緒的名稱 (方便除錯)。
+        """
+        self.detector = detector
+        self.target_objects = target_objects
+        self._name = name
+
+        # 單一槽位的最新幀信箱
+        self._mailbox_lock = threading.Lock()
+        self._mailbox_event = threading.Event()
+        self._pending_frame = None
+        self._dropped_frames = 0 # 被較新幀覆蓋而未處理的幀數
+
+        # 偵測結果 (以鎖保護，供主迴圈讀取)
+        self._result_lock = threading.Lock()
+        self._latest_result = None # 最近一次的 DetectionResult
+        self._result_seq = 0 # 每發布一次結果就遞增，讓讀取端判斷是否有新結果
+        self._last_inference_ms = 0.0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """啟動背景偵測執行緒。"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True # 守護執行緒，主程式結束時一併結束
+        self._thread.start()
+        print(f"背景物件偵測執行緒 '{self._name}' 已啟動。")
+
+    def submit_frame(self, frame):
+        """
+        將最新的幀放入信箱 (不會阻塞)。
+        若信箱中仍有尚未處理的幀，該幀會被丟棄並由新幀取代。
+        注意：背景執行緒只會讀取此幀，呼叫端在提交後不應就地修改它。
+        :param frame: OpenCV BGR 格式的影像幀。
+        """
+        with self._mailbox_lock:
+            if self._pending_frame is not None:
+                self._dropped_frames += 1
+            self._pending_frame = frame
+        self._mailbox_event.set()
+
+    def _take_frame(self):
+        """從信箱取出最新的幀 (取出後信箱清空)。"""
+        with self._mailbox_lock:
+            frame = self._pending_frame
+            self._pending_frame = None
+            self._mailbox_event.clear()
+        return frame
+
+    def _run(self):
+        """背景執行緒主迴圈：等待新幀、執行偵測並發布結果。"""
+        while not self._stop_event.is_set():
+            if not self._mailbox_event.wait(timeout=0.1):
+                continue
+            frame = self._take_frame()
+            if frame is None:
+                continue
+            try:
+                start_time = time.perf_counter()
+                result = self.detector.detect(frame, target_objects=self.target_objects)
+                elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+            except Exception as e:
+                print(f"背景物件偵測時發生錯誤: {e}")
+                continue
+
+            if result is None or result is self._latest_result:
+                continue # 排程器略過了推論 (回傳的是上一次的結果)，不需要重新發布
+            with self._result_lock:
+                self._latest_result = result
+                self._result_seq += 1
+                self._last_inference_ms = elapsed_ms
+
+    def get_latest(self):
+        """
+        取得最近一次發布的偵測物件名稱 (執行緒安全)。
+        :return: (偵測到的物件名稱列表, 結果序號)。序號改變代表有新的偵測結果。
+        """
+        result, result_seq = self.get_latest_result()
+        return (result.names() if result is not None else []), result_seq
+
+    def get_latest_result(self):
+        """
+        取得最近一次發布的 DetectionResult (執行緒安全)。
+        :return: (DetectionResult 或 None, 結果序號)。
+        """
+        with self._result_lock:
+            return self._latest_result, self._result_seq
+
+    @property
+    def stats(self):
+        """回傳偵測執行緒的統計資訊 (結果序號、丟棄的幀數、最近一次推論耗時)。"""
+        with self._result_lock:
+            result_seq = self._result_seq
+            last_inference_ms = self._last_inference_ms
+        with self._mailbox_lock:
+            dropped_frames = self._dropped_frames
+        return {
+            "results_published": result_seq,
+            "dropped_frames": dropped_frames,
+            "last_inference_ms": last_inference_ms,
+        }
+
+    def stop(self, timeout=1.0):
+        """
+        停止背景偵測執行緒。
+        :param timeout: 等待執行緒結束的最長秒數。
+        """
+        self._stop_event.set()
+        self._mailbox_event.set() # 喚醒可能正在等待的執行緒
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+            print(f"背景物件偵測執行緒 '{self._name}' 已停止。")
@@ -0,0 +1,115 @@
+# fake_gemini_backend.py
+import time
+
+
+class _FakeContent:
+    def __init__(self, parts):
+        self.parts = parts
+
+
+class _FakeCandidate:
+    def __init__(self, parts, finish_reason=None):
+        self.content = _FakeContent(parts)
+        self.finish_reason = finish_reason
+
+
+class FakeResponse:
+    """模仿 google.generativeai 回應 (或串流片段) 中 GeminiClient 會用到的屬性。"""
+
+    def __init__(self, text, finish_reason=None):
+        self.parts = [text] if text else []
+        self.candidates = [_FakeCandidate(self.parts, finish_reason)]
+        self.prompt_feedback = None
+        self._text = text
+
+    @property
+    def text(self):
+        if not self.parts:
+            raise ValueError("回應沒有文字部分。")
+        return self._text
+
+    def __repr__(self):
+        return f"FakeResponse(text={self._text!r}, finish_reason={self.candidates[0].finish_reason!r})"
+
+
+class FakeGenerativeModel:
+    def __init__(self, responses=None, default_reply=None, first_chunk_delay_s=0.4, chunk_delay_s=0.05,
+                 chunk_chars=6, blocked_keywords=()):
+        """
+        本機的假 Gemini 模型，可直接傳給 GeminiClient(model=...)，不需網路即可測試串流與一般請求。
+        :param responses: (可選) {提示詞: 回應文字}，未列出的提示使用 default_reply。
+        :param default_reply: (可選) 預設回應，可包含 {prompt}；未指定時使用內建的多句回應。
+        :param first_chunk_delay_s: 第一個片段前的延遲 (模擬首字延遲)。
+        :param chunk_delay_s: 之後每個片段之間的延遲 (模擬生成速度)。
+        :param chunk_chars: 每個片段的字元數。
+        :param blocked_keywords: 提示詞包含這些字時，模擬被安全機制阻擋的回應。
+        """
+        self.responses = dict(responses or {})
+        self.default_reply = default_reply or "你好！我是測試用的AI夥伴。你剛剛說的是「{prompt}」。這段回應會分成好幾個片段送出。最後一句也會被朗讀。"
+        self.first_chunk_delay_s = first_chunk_delay_s
+        self.chunk_delay_s = chunk_delay_s
+        self.chunk_chars = max(1, int(chunk_chars))
+        self.blocked_keywords = tuple(blocked_keywords)
+        self.call_count = 0
+        self.last_contents = None # 最近一次收到的完整內容 (用於檢查多輪對話的提示大小)
+
+    @staticmethod
+    def prompt_text(contents):
+        """取出最後一則使用者訊息的文字 (contents 可以是字串或多輪對話的內容列表)。"""
+        if isinstance(contents, str):
+            return contents
+        return "".join(str(part) for part in contents[-1]["parts"])
+
+    def reply_for(self, prompt):
+        if prompt in self.responses:
+            return self.responses[prompt]
+        return self.default_reply.format(prompt=prompt)
+
+    def generate_content(self, prompt, stream=False):
+        """與 genai.GenerativeModel.generate_content 相同的呼叫方式。"""
+        self.call_count += 1
+        self.last_contents = prompt
+        prompt = self.prompt_text(prompt)
+        if any(keyword in prompt for keyword in self.blocked_keywords):
+            time.sleep(self.first_chunk_delay_s)
+            blocked = FakeResponse("", finish_reason='SAFETY')
+            return iter([blocked]) if stream else blocked
+        text = self.reply_for(prompt)
+        if stream:
+            return self._stream(text)
+        time.sleep(self.first_chunk_delay_s + self.chunk_delay_s * (len(text) // self.chunk_chars))
+        return FakeResponse(text)
+
+    def _stream(self, text):
+        time.sleep(self.first_chunk_delay_s)
+        for i in range(0, len(text), self.chunk_chars):
+            if i > 0:
+                time.sleep(self.chunk_delay_s)
+            yield FakeResponse(text[i:i + self.chunk_chars])
+
+
+if __name__ == '__main__':
+    # 以假模型比較一般請求與串流的「第一句可朗讀時間」
+    from gemini_client import GeminiClient
+    from sentence_stream import SentenceSplitter
+
+    client = GeminiClient(api_key=None, model=FakeGenerativeModel())
+    prompt = "今天過得如何？"
+
+    start = time.perf_counter()
+    full_text = client.send_message(prompt)
+    print(f"一般請求: {time.perf_counter() - start:.3f} 秒後取得完整回應: {full_text}")
+
+    splitter = SentenceSplitter()
+    start = time.perf_counter()
+    first_sentence_time = None
+    for chunk in client.stream_message(prompt):
+        for sentence in splitter.feed(chunk):
+            if first_sentence_time is None:
+                first_sentence_time = time.perf_counter() - start
+            print(f"  [{time.perf_counter() - start:.3f} 秒] 句子: {sentence}")
+    remainder = splitter.flush()
+    if remainder:
+        print(f"  [{time.perf_counter() - start:.3f} 秒] 句子: {remainder}")
+    if first_sentence_time is not None:
+        print(f"串流請求: 第一句在 {first_sentence_time:.3f} 秒時即可交給 TTS，全部完成於 {time.perf_counter() - start:.3f} 秒。")
@@ -0,0 +1,379 @@
+# frame_sources.py
+import os
+import time
+import cv2
+import numpy as np
+
+# 擷取後端名稱 -> OpenCV 常數名稱 (以 getattr 取得，未編譯該後端的 OpenCV 版本會自動略過)
+CAPTURE_BACKENDS = {
+    "any": "CAP_ANY",
+    "v4l2": "CAP_V4L2",
+    "ffmpeg": "CAP_FFMPEG",
+    "gstreamer": "CAP_GSTREAMER",
+    "dshow": "CAP_DSHOW",
+    "msmf": "CAP_MSMF",
+    "avfoundation": "CAP_AVFOUNDATION",
+}
+
+PACING_MODES = ("fast", "realtime")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _decode_fourcc(value):
+    """將 CAP_PROP_FOURCC 回傳的整數轉為四字元字串 (例如 'MJPG')。"""
+    code = int(value)
+    if code <= 0:
+        return ""
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+class FrameSource:
+    """
+    影像幀來源的共同介面：get_frame() 回傳 (ret, frame)，release() 釋放資源。
+    非攝影機的來源可選擇節奏：「fast」盡快輸出，「realtime」依 fps 以實際時間輸出。
+    """
+    name = "source"
+
+    def __init__(self, fps=30.0, pacing="fast"):
+        if pacing not in PACING_MODES:
+            raise ValueError(f"不支援的節奏模式: {pacing} (可用: {', '.join(PACING_MODES)})")
+        self.fps = float(fps) if fps else 0.0
+        self.pacing = pacing
+        self.capture_info = {}
+        self._frames_emitted = 0
+        self._pacing_start = None
+
+    def _pace(self):
+        """realtime 模式下，等到這一幀應該出現的時間點。"""
+        if self.pacing != "realtime" or self.fps <= 0:
+            return
+        now = time.monotonic()
+        if self._pacing_start is None:
+            self._pacing_start = now
+        due = self._pacing_start + self._frames_emitted / self.fps
+        if due > now:
+            time.sleep(due - now)
+
+    def _read(self):
+        """子類別實作：讀取下一幀，回傳 (ret, frame)。"""
+        raise NotImplementedError
+
+    def get_frame(self):
+        """
+        取得下一幀。
+        :return: (ret, frame) ret為True表示成功擷取，frame為影像幀。
+        """
+        self._pace()
+        ret, frame = self._read()
+        if ret:
+            self._frames_emitted += 1
+        return ret, frame
+
+    def release(self):
+        """釋放來源資源。"""
+        pass
+
+
+class CameraSource(FrameSource):
+    """即時攝影機來源，支援擷取格式協商 (後端/FOURCC/解析度/FPS)。攝影機自行控制節奏。"""
+    name = "camera"
+
+    def __init__(self, camera_index=0, backend="any", width=None, height=None, fps=None,
+                 fourcc=None, driver_buffer_size=None):
+        """
+        :param camera_index: 攝影機的索引，通常0是預設攝影機。
+        :param backend: 後端名稱或依偏好排序的名稱列表，例如 "v4l2" 或 ["v4l2", "ffmpeg", "any"]。
+        :param width: (可選) 要求的寬度。
+        :param height: (可選) 要求的高度。
+        :param fps: (可選) 要求的幀率。
+        :param fourcc: (可選) 要求的像素格式，例如 "MJPG"。
+        :param driver_buffer_size: (可選) 驅動程式緩衝區大小 (並非所有後端都支援)。
+        """
+        super().__init__(fps=fps, pacing="fast")
+        self.camera_index = camera_index
+        self.cap, self.backend_name = self._open_capture(camera_index, backend)
+        if self.cap is None:
+            raise IOError(f"無法開啟攝影機，索引: {self.camera_index}")
+        # 套用擷取格式並讀回裝置實際接受的設定
+        self.capture_info = self._apply_capture_settings(width, height, fps, fourcc, driver_buffer_size)
+        print(f"攝影機 {self.camera_index} 已成功開啟 (後端: {self.backend_name})。"
+              f"實際格式: {self.capture_info['width']}x{self.capture_info['height']} "
+              f"@ {self.capture_info['fps']:.1f} FPS, FOURCC: {self.capture_info['fourcc'] or '未知'}")
+
+    @staticmethod
+    def _open_capture(camera_index, backend_preference):
+        """
+        依偏好順序嘗試以不同後端開啟攝影機。
+        :return: (cv2.VideoCapture, 後端名稱)，全部失敗時為 (None, None)。
+        """
+        backends = [backend_preference] if isinstance(backend_preference, str) else list(backend_preference or ["any"])
+        for backend_name in backends:
+            api_name = CAPTURE_BACKENDS.get(str(backend_name).lower())
+            api_preference = getattr(cv2, api_name, None) if api_name else None
+            if api_preference is None:
+                print(f"警告：此 OpenCV 版本不支援擷取後端 '{backend_name}'，已略過。")
+                continue
+            cap = cv2.VideoCapture(camera_index, api_preference)
+            if cap.isOpened():
+                return cap, str(backend_name).lower()
+            cap.release()
+            print(f"警告：無法以後端 '{backend_name}' 開啟攝影機 {camera_index}，嘗試下一個後端。")
+        return None, None
+
+    def _apply_capture_settings(self, width, height, fps, fourcc, driver_buffer_size):
+        """
+        套用擷取格式並讀回裝置實際接受的值。
+        FOURCC 需在解析度之前設定：許多 UVC 攝影機只有在 MJPG 下才提供高解析度的高幀率模式。
+        :return: 實際格式字典 {"width", "height", "fps", "fourcc", "backend"}。
+        """
+        requested = {}
+        if fourcc:
+            if len(fourcc) != 4:
+                print(f"警告：無效的 FOURCC '{fourcc}' (需為四個字元)，已略過。")
+            else:
+                requested["fourcc"] = fourcc.upper()
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc.upper()))
+        if width and height:
+            requested["width"], requested["height"] = int(width), int(height)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, requested["width"])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, requested["height"])
+        if fps:
+            requested["fps"] = float(fps)
+            self.cap.set(cv2.CAP_PROP_FPS, requested["fps"])
+        if driver_buffer_size:
+            # 縮小驅動程式的緩衝區可降低延遲
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, int(driver_buffer_size))
+
+        actual = {
+            "width": int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": float(self.cap.get(cv2.CAP_PROP_FPS) or 0.0),
+            "fourcc": _decode_fourcc(self.cap.get(cv2.CAP_PROP_FOURCC)),
+            "backend": self.backend_name,
+        }
+        for key, value in requested.items():
+            if key == "fps":
+                mismatch = actual["fps"] > 0 and abs(actual["fps"] - value) > 0.5
+            else:
+                mismatch = actual[key] != value
+            if mismatch:
+                print(f"警告：攝影機未接受要求的 {key}={value}，實際為 {actual[key]}。")
+        self.fps = actual["fps"]
+        return actual
+
+    def _read(self):
+        return self.cap.read()
+
+    def release(self):
+        if self.cap.isOpened():
+            self.cap.release()
+            print(f"攝影機 {self.camera_index} 已釋放。")
+
+
+class VideoFileSource(FrameSource):
+    """影片檔案來源。"""
+    name = "video"
+
+    def __init__(self, path, pacing="fast", loop=False):
+        """
+        :param path: 影片檔案路徑。
+        :param pacing: "fast" 盡快解碼輸出；"realtime" 依影片 FPS 輸出。
+        :param loop: 播放完畢後是否從頭重播。
+        """
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"無法開啟影片: {path}")
+        super().__init__(fps=self.cap.get(cv2.CAP_PROP_FPS) or 30.0, pacing=pacing)
+        self.loop = loop
+        self.capture_info = {
+            "width": int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": self.fps,
+            "frame_count": int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "backend": "video",
+        }
+        print(f"影片來源已開啟: {path} ({self.capture_info['width']}x{self.capture_info['height']} @ {self.fps:.1f} FPS)")
+
+    def _read(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        if self.cap.isOpened():
+            self.cap.release()
+            print(f"影片來源已釋放: {self.path}")
+
+
+class ImageSequenceSource(FrameSource):
+    """影像序列來源 (資料夾中的影像檔案，依檔名排序)。"""
+    name = "images"
+
+    def __init__(self, directory, fps=30.0, pacing="fast", loop=False, preload=False):
+        """
+        :param directory: 影像資料夾路徑。
+        :param fps: realtime 節奏使用的幀率。
+        :param pacing: "fast" 或 "realtime"。
+        :param loop: 播放完畢後是否從頭重播。
+        :param preload: 是否預先解碼所有影像到記憶體 (排除解碼成本，適合效能量測)。
+        """
+        super().__init__(fps=fps, pacing=pacing)
+        if not os.path.isdir(directory):
+            raise IOError(f"找不到影像資料夾: {directory}")
+        names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not names:
+            raise IOError(f"影像資料夾中沒有影像檔案: {directory}")
+        self.paths = [os.path.join(directory, name) for name in names]
+        self.loop = loop
+        self._index = 0
+        self._frames = [cv2.imread(path) for path in self.paths] if preload else None
+        self.capture_info = {"frame_count": len(self.paths), "fps": self.fps, "backend": "images"}
+        print(f"影像序列來源已開啟: {directory} ({len(self.paths)} 張影像)")
+
+    def _read(self):
+        if self._index >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self._index = 0
+        index = self._index
+        self._index += 1
+        frame = self._frames[index] if self._frames is not None else cv2.imread(self.paths[index])
+        return frame is not None, frame
+
+
+class RawDumpSource(FrameSource):
+    """
+    記憶體映射的原始幀檔案來源 (連續的 uint8 BGR 幀，無檔頭)，重播時不需要解碼。
+    回傳的幀是映射檔案的唯讀視圖，呼叫端不可就地修改。
+    """
+    name = "raw"
+
+    def __init__(self, path, width, height, channels=3, fps=30.0, pacing="fast", loop=False):
+        """
+        :param path: 原始幀檔案路徑 (可由 write_raw_dump() 產生)。
+        :param width: 幀寬度。
+        :param height: 幀高度。
+        :param channels: 每個像素的通道數。
+        :param fps: realtime 節奏使用的幀率。
+        :param pacing: "fast" 或 "realtime"。
+        :param loop: 播放完畢後是否從頭重播。
+        """
+        super().__init__(fps=fps, pacing=pacing)
+        frame_bytes = int(width) * int(height) * int(channels)
+        file_size = os.path.getsize(path)
+        if frame_bytes <= 0 or file_size < frame_bytes:
+            raise IOError(f"原始幀檔案 '{path}' 的大小 ({file_size} 位元組) 不足一幀 ({frame_bytes} 位元組)。")
+        frame_count = file_size // frame_bytes
+        self._frames = np.memmap(path, dtype=np.uint8, mode="r", shape=(frame_count, int(height), int(width), int(channels)))
+        self.loop = loop
+        self._index = 0
+        self.capture_info = {"width": int(width), "height": int(height), "frame_count": frame_count, "fps": self.fps, "backend": "raw"}
+        print(f"原始幀來源已開啟: {path} ({frame_count} 幀, {width}x{height})")
+
+    def _read(self):
+        if self._frames is None: # 已釋放
+            return False, None
+        if self._index >= self._frames.shape[0]:
+            if not self.loop:
+                return False, None
+            self._index = 0
+        frame = self._frames[self._index]
+        self._index += 1
+        return True, frame
+
+    def release(self):
+        # 切片 (例如 self._frames[:0]) 仍是同一個映射的視圖，必須放開參考才會關閉映射與檔案；
+        # 呼叫端仍持有的幀也是映射的視圖，因此不直接關閉 mmap，而是在最後一個視圖釋放時由 numpy 關閉
+        self._frames = None
+
+
+def write_raw_dump(frames, path):
+    """
+    將一系列相同尺寸的 BGR 幀寫成原始幀檔案，供 RawDumpSource 重播。
+    :param frames: 可迭代的幀 (numpy uint8 陣列)。
+    :param path: 輸出檔案路徑。
+    :return: (寫入的幀數, (height, width, channels))
+    """
+    count, shape = 0, None
+    with open(path, "wb") as f:
+        for frame in frames:
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+            if shape is None:
+                shape = frame.shape
+            elif frame.shape != shape:
+                raise ValueError(f"所有幀的尺寸必須相同 (第 {count} 幀為 {frame.shape}，預期 {shape})")
+            f.write(frame.tobytes())
+            count += 1
+    return count, shape
+
+
+class SyntheticSource(FrameSource):
+    """
+    可重現的合成幀來源：固定亂數種子的背景雜訊加上一個移動的方塊。
+    適合在沒有攝影機的 CI 環境量測效能與回歸測試。
+    """
+    name = "synthetic"
+
+    def __init__(self, width=640, height=480, fps=30.0, pacing="fast", num_frames=None, seed=0, noise_level=8):
+        """
+        :param width: 幀寬度。
+        :param height: 幀高度。
+        :param fps: realtime 節奏使用的幀率。
+        :param pacing: "fast" 或 "realtime"。
+        :param num_frames: (可選) 產生的總幀數，None 表示無限。
+        :param seed: 亂數種子。
+        :param noise_level: 背景雜訊強度 (0 表示完全靜態的背景)。
+        """
+        super().__init__(fps=fps, pacing=pacing)
+        self.width, self.height = int(width), int(height)
+        self.num_frames = num_frames
+        rng = np.random.default_rng(seed)
+        base = np.full((self.height, self.width, 3), 96, dtype=np.uint8)
+        # 預先產生少量雜訊圖並循環使用，避免每幀產生亂數的成本影響量測
+        self._noise_frames = [
+            np.clip(base.astype(np.int16) + rng.integers(-noise_level, noise_level + 1, base.shape), 0, 255).astype(np.uint8)
+            if noise_level else base
+            for _ in range(4)
+        ]
+        self._box_size = max(8, min(self.width, self.height) // 6)
+        self.capture_info = {"width": self.width, "height": self.height, "fps": self.fps, "backend": "synthetic"}
+
+    def _read(self):
+        index = self._frames_emitted
+        if self.num_frames is not None and index >= self.num_frames:
+            return False, None
+        frame = self._noise_frames[index % len(self._noise_frames)].copy()
+        span_x = max(1, self.width - self._box_size)
+        span_y = max(1, self.height - self._box_size)
+        x = (index * 7) % (2 * span_x)
+        x = x if x < span_x else 2 * span_x - x # 來回移動
+        y = (index * 3) % (2 * span_y)
+        y = y if y < span_y else 2 * span_y - y
+        frame[y:y + self._box_size, x:x + self._box_size] = (40, 160, 230)
+        return True, frame
+
+
+def create_frame_source(source_settings, camera_index=0):
+    """
+    依設定建立影像幀來源。
+    :param source_settings: 設定字典，"type" 為 camera / video / images / raw / synthetic，其餘為該來源的參數。
+    :param camera_index: type 為 camera 且未指定索引時使用的攝影機索引。
+    :return: FrameSource 實例。
+    """
+    settings = dict(source_settings or {})
+    source_type = settings.pop("type", "camera")
+    if source_type == "camera":
+        settings.setdefault("camera_index", camera_index)
+        return CameraSource(**settings)
+    if source_type == "video":
+        return VideoFileSource(**settings)
+    if source_type == "images":
+        return ImageSequenceSource(**settings)
+    if source_type == "raw":
+        return RawDumpSource(**settings)
+    if source_type == "synthetic":
+        return SyntheticSource(**settings)
+    raise ValueError(f"不支援的影像來源類型: {source_type} (可用: camera, video, images, raw, synthetic)")
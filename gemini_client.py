@@ -1,69 +1,242 @@
 # gemini_client.py
-import google.generativeai as genai
 import os
 
+from response_cache import make_cache_key
+from chat_session import ChatSession
+from llm_backends import create_llm_backend
+from llm_resilience import LLMDeadlineExceeded, ResilientBackend
+
+SAFETY_BLOCKED_MESSAGE = "AI回應被安全機制阻擋，請嘗試修改提示詞。"
+EMPTY_RESPONSE_MESSAGE = "AI無法生成有效回應（可能為空內容）。"
+INVALID_RESPONSE_MESSAGE = "AI無法生成有效回應。"
+TIMEOUT_MESSAGE = "AI回應逾時，請稍後再試。"
+
+
+class GeminiResponseError(Exception):
+    """串流回應無法產生有效文字 (被安全機制阻擋、空內容或 API 錯誤)。display_text 為可顯示給使用者的訊息 (API 錯誤時為 None)。"""
+
+    def __init__(self, message, display_text=None):
+        super().__init__(message)
+        self.display_text = display_text
+
+
+def _is_safety_block(candidate):
+    """候選回應是否因安全原因被阻擋 (finish_reason 可能是字串或列舉)。"""
+    finish_reason = getattr(candidate, "finish_reason", None)
+    return finish_reason == 'SAFETY' or getattr(finish_reason, "name", None) == 'SAFETY'
+
+
 class GeminiClient:
-    def __init__(self, api_key, system_prompt=None):
+    def __init__(self, api_key, system_prompt=None, model=None, response_cache=None,
+                 personality="default", chat_settings=None, backend_settings=None, resilience_settings=None):
         """
         初始化Gemini客戶端。
         :param api_key: 您的Gemini API金鑰。
         :param system_prompt: (可選) 給模型的系統級指令。
+        :param model: (可選) 取代 genai.GenerativeModel 的模型物件 (需提供 generate_content(prompt, stream=...))，
+                      例如 fake_gemini_backend.FakeGenerativeModel，用於離線測試。此時不需要 API 金鑰。
+        :param response_cache: (可選) response_cache.ResponseCache。命中時直接回傳，不經過網路。
+        :param personality: 目前的個性名稱，每個個性各自擁有一段對話紀錄。
+        :param chat_settings: (可選) 多輪對話設定 {"enabled", "max_history_tokens", "max_turns", "digest_max_tokens"}。
+                              未啟用時每次請求都是獨立的 (不帶歷史)。
+        :param backend_settings: (可選) 語言模型後端設定 (config.json 的 llm_settings.backend)，
+                                 例如 {"type": "http", "url": "http://127.0.0.1:8765"}；預設為 Gemini API。
+        :param resilience_settings: (可選) 期限/重試/對沖/斷路器設定 (llm_resilience.ResilientBackend 的參數，
+                                    加上 "enabled")。啟用時後端會以 ResilientBackend 包裝。
         """
-        if not api_key:
-            raise ValueError("API金鑰未提供。請設定GEMINI_API_KEY環境變數或直接傳入。")
-        genai.configure(api_key=api_key)
-
-        generation_config = None # 可以根據需要設定，例如溫度等
-        safety_settings = None # 可以根據需要設定安全等級
-
-        # 您可以根據需求選擇 'gemini-1.5-flash', 'gemini-1.5-pro', 'gemini-pro' 等模型
-        self.model = genai.GenerativeModel(
-            'gemini-1.5-flash',
-            system_instruction=system_prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-            )
-        print("Gemini AI 模型已成功初始化。")
-        if system_prompt:
+        self.system_prompt = system_prompt
+        self.response_cache = response_cache
+        self.personality = personality
+        self.chat_settings = dict(chat_settings or {})
+        self.chat_enabled = bool(self.chat_settings.pop("enabled", False))
+        self.sessions = {} # 個性名稱 -> ChatSession
+        if model is not None:
+            self.model = model
+            print(f"Gemini 客戶端使用自訂模型: {type(model).__name__}")
+        else:
+            # 後端可替換：Gemini API、本機 HTTP 替身伺服器 (llm_standin_server.py) 或假模型
+            self.model = create_llm_backend(backend_settings, api_key=api_key, system_prompt=system_prompt)
+        self.resilience = None
+        resilience_settings = dict(resilience_settings or {})
+        if resilience_settings.pop("enabled", False):
+            self.resilience = ResilientBackend(self.model, **resilience_settings)
+            self.model = self.resilience
+        self.model_name = getattr(self.model, "model_name", type(self.model).__name__)
+        if system_prompt and model is None:
             print(f"使用系統提示: {system_prompt[:100]}...") # 只印出前100個字元
 
-    def send_message(self, text_prompt, is_new_chat=False):
+    @staticmethod
+    def build_prompt(text_prompt, context=None):
+        """將使用者提示與環境資訊 (例如 "[環境感知：...]") 組合成實際送出的提示。"""
+        return f"{text_prompt} {context}" if context else text_prompt
+
+    def cache_key(self, text_prompt, context=None):
+        """回應快取的鍵：(模型, 系統提示, 正規化的提示, 正規化的環境資訊)。"""
+        return make_cache_key(self.model_name, self.system_prompt, text_prompt, context)
+
+    def _use_cache(self):
+        """
+        是否查詢/寫入回應快取。快取鍵不包含對話紀錄，因此啟用多輪對話時只在對話開頭使用快取，
+        避免同一句話在不同的對話脈絡中得到相同的 (可能不合時宜的) 回應。
+        """
+        if self.response_cache is None:
+            return False
+        return not self.chat_enabled or not self.chat_session().turns
+
+    def chat_session(self, personality=None):
+        """取得 (必要時建立) 指定個性的對話紀錄，預設為目前的個性。"""
+        name = personality or self.personality
+        session = self.sessions.get(name)
+        if session is None:
+            session = ChatSession(name, **self.chat_settings)
+            self.sessions[name] = session
+        return session
+
+    def _request_contents(self, text_prompt, context):
+        """
+        組合實際送出的內容。啟用多輪對話時為「摘要 + 最近的對話 + 目前的提問」，
+        提示大小受 token 預算限制，不會隨對話長度無限成長；否則只有目前的提問。
+        """
+        final_prompt = self.build_prompt(text_prompt, context)
+        if not self.chat_enabled:
+            return final_prompt, final_prompt
+        return self.chat_session().build_contents(final_prompt), final_prompt
+
+    def _record_exchange(self, text_prompt, response_text, should_stop=None):
+        """
+        將完成的問答記入對話紀錄 (只記錄使用者原本的提問，不含當下的環境資訊)。
+        :param should_stop: (可選) 例如 AIRequest.should_stop；請求已被取代或逾時 (使用者看不到這個回答) 時不記錄。
+        """
+        if should_stop is not None and should_stop():
+            return
+        if self.chat_enabled:
+            self.chat_session().add_exchange(text_prompt, response_text)
+
+    def _generate(self, contents, stream=False, deadline=None):
+        """送出請求；後端支援期限時 (ResilientBackend) 一併傳入。"""
+        if deadline is not None and getattr(self.model, "supports_deadline", False):
+            return self.model.generate_content(contents, stream=stream, deadline=deadline)
+        return self.model.generate_content(contents, stream=stream)
+
+    def send_message(self, text_prompt, is_new_chat=False, context=None, deadline=None, should_stop=None):
         """
         向Gemini模型發送文字提示並獲取回應。
         :param text_prompt: 要發送的文字提示。
+        :param is_new_chat: 是否清除目前個性的對話紀錄，開始新的對話。
+        :param context: (可選) 附加在提示後的環境資訊，與提示分開作為快取鍵的一部分。
+        :param deadline: (可選) 絕對期限 (time.monotonic() 的時間)，例如 AIRequest.deadline。
+        :param should_stop: (可選) 例如 AIRequest.should_stop，請求已被取代或逾時時回答不記入對話紀錄。
         :return: Gemini模型的回應文字，若失敗則返回None。
+                 斷路器斷開時為本機的備用回應 (不會被快取，也不記入對話紀錄)。
         """
+        if is_new_chat and self.chat_enabled:
+            self.chat_session().reset()
+        cache_key = None
+        if self._use_cache():
+            cache_key = self.cache_key(text_prompt, context)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self._record_exchange(text_prompt, cached, should_stop)
+                return cached
+        contents, final_prompt = self._request_contents(text_prompt, context)
         try:
-            # 對於有 system_instruction 的模型，通常建議使用 start_chat 進行多輪對話
-            # 但如果每次都是獨立請求，直接 generate_content 也可以
-            # 為了簡化 MVP1，我們先假設每次都是獨立請求，但保留 chat 的可能性
-            # if is_new_chat or not hasattr(self, 'chat_session'):
-            #     self.chat_session = self.model.start_chat(history=[])
-            # response = self.chat_session.send_message(text_prompt)
-            response = self.model.generate_content(text_prompt) # 保持簡單
+            # 多輪對話的歷史由 ChatSession 管理 (有 token 預算)，每次請求都以 generate_content 送出完整內容
+            response = self._generate(contents, deadline=deadline)
             # 處理 API 回應的各種情況
             if response.parts:
-                return response.text
-            elif response.candidates and response.candidates[0].finish_reason == 'SAFETY':
-                # 如果是因為安全原因被阻擋
-                safety_ratings_info = response.prompt_feedback.safety_ratings if response.prompt_feedback else "無安全評級資訊"
-                print(f"Gemini API 回應因安全設定被阻擋。提示詞: '{text_prompt}'. 安全評級: {safety_ratings_info}")
-                return "AI回應被安全機制阻擋，請嘗試修改提示詞。"
-            elif response.candidates and not response.candidates[0].content.parts:
-                 # 候選內容為空，但不是因為安全原因 (可能是其他內部錯誤或空回應)
-                 print(f"Gemini API 回應為空 (非安全原因)。提示詞: '{text_prompt}'.")
-                 print(f"詳細回應資訊: {response}")
-                 return "AI無法生成有效回應（可能為空內容）。"
-            else:
-                # 其他未知原因導致 parts 為空
-                print(f"Gemini API 回應中沒有有效的文字部分。提示詞: '{text_prompt}'.")
-                print(f"詳細回應資訊: {response}")
-                return "AI無法生成有效回應。"
+                text = response.text
+                if getattr(response, "is_fallback", False):
+                    return text
+                if cache_key is not None and text:
+                    self.response_cache.put(cache_key, text) # 只快取有效的文字回應
+                if text:
+                    self._record_exchange(text_prompt, text, should_stop)
+                return text
+            return self._describe_empty_response(response, final_prompt)
 
+        except LLMDeadlineExceeded as e:
+            print(f"Gemini API 請求超過期限: {e}")
+            return None
         except Exception as e:
             print(f"與Gemini API互動時發生錯誤: {e}")
             return None
 
+    def _describe_empty_response(self, response, text_prompt):
+        """回應 (或串流片段) 沒有文字時，印出原因並回傳對應的顯示訊息。"""
+        if response.candidates and _is_safety_block(response.candidates[0]):
+            # 如果是因為安全原因被阻擋
+            safety_ratings_info = response.prompt_feedback.safety_ratings if response.prompt_feedback else "無安全評級資訊"
+            print(f"Gemini API 回應因安全設定被阻擋。提示詞: '{text_prompt}'. 安全評級: {safety_ratings_info}")
+            return SAFETY_BLOCKED_MESSAGE
+        elif response.candidates and not response.candidates[0].content.parts:
+            # 候選內容為空，但不是因為安全原因 (可能是其他內部錯誤或空回應)
+            print(f"Gemini API 回應為空 (非安全原因)。提示詞: '{text_prompt}'.")
+            print(f"詳細回應資訊: {response}")
+            return EMPTY_RESPONSE_MESSAGE
+        else:
+            # 其他未知原因導致 parts 為空
+            print(f"Gemini API 回應中沒有有效的文字部分。提示詞: '{text_prompt}'.")
+            print(f"詳細回應資訊: {response}")
+            return INVALID_RESPONSE_MESSAGE
+
+    def stream_message(self, text_prompt, context=None, deadline=None, should_stop=None):
+        """
+        以串流方式 (stream=True) 向Gemini模型發送提示，文字片段一到達就逐段產生。
+        呼叫端可以一邊把片段加到畫面上的對話泡泡，一邊把完成的句子交給 TTS。
+        快取命中時一次產生完整回應；只有完整讀完且沒有被阻擋的串流才會存入快取。
+        :param text_prompt: 要發送的文字提示。
+        :param context: (可選) 附加在提示後的環境資訊。
+        :param deadline: (可選) 絕對期限 (time.monotonic() 的時間)，第一個片段必須在期限前到達。
+        :param should_stop: (可選) 例如 AIRequest.should_stop，讀完串流時請求已被取代或逾時則不記入對話紀錄。
+        :return: 產生文字片段 (str) 的產生器。
+        :raises GeminiResponseError: 回應被安全機制阻擋、沒有任何文字或 API 發生錯誤。
+                                     若已經產生過部分文字，被阻擋的其餘內容會直接結束串流。
+        """
+        cache_key = None
+        if self._use_cache():
+            cache_key = self.cache_key(text_prompt, context)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                self._record_exchange(text_prompt, cached, should_stop) # 呼叫端讀完後才記錄
+                return
+        contents, final_prompt = self._request_contents(text_prompt, context)
+        produced_text = False
+        is_fallback = False
+        streamed_parts = []
+        try:
+            response = self._generate(contents, stream=True, deadline=deadline)
+            for chunk in response:
+                is_fallback = is_fallback or getattr(chunk, "is_fallback", False)
+                if chunk.parts:
+                    text = chunk.text
+                    if text:
+                        produced_text = True
+                        streamed_parts.append(text)
+                        yield text
+                elif chunk.candidates and _is_safety_block(chunk.candidates[0]):
+                    message = self._describe_empty_response(chunk, final_prompt)
+                    if produced_text:
+                        return # 已顯示的部分保留，其餘被阻擋的內容不再產生 (也不記入對話紀錄)
+                    raise GeminiResponseError("回應被安全機制阻擋", display_text=message)
+        except GeminiResponseError:
+            raise
+        except LLMDeadlineExceeded as e:
+            print(f"Gemini API 串流請求超過期限: {e}")
+            raise GeminiResponseError(str(e), display_text=None if produced_text else TIMEOUT_MESSAGE) from e
+        except Exception as e:
+            print(f"與Gemini API串流互動時發生錯誤: {e}")
+            raise GeminiResponseError(str(e)) from e
+        if not produced_text:
+            print(f"Gemini API 串流回應為空。提示詞: '{final_prompt}'.")
+            raise GeminiResponseError("串流回應沒有任何文字", display_text=EMPTY_RESPONSE_MESSAGE)
+        if is_fallback:
+            return
+        full_text = "".join(streamed_parts)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, full_text)
+        self._record_exchange(text_prompt, full_text, should_stop)
+
 if __name__ == '__main__':
     # 測試 GeminiClient
     # 需要在環境變數中設定 GEMINI_API_KEY，或從 .env 檔案載入
@@ -0,0 +1,128 @@
+# image_blend.py
+import numpy as np
+
+
+class PreparedSprite:
+    """
+    預先處理好、可直接混合的疊加圖。
+    顏色以預乘 alpha 的 BGR (uint16，值為 color * alpha) 儲存，並另存 (255 - alpha)。
+    完全透明的外框會在準備時裁掉 (混合結果不變)，offset_x/offset_y 為內容區域在原圖中的位置。
+    """
+    __slots__ = ("premul_bgr", "inv_alpha", "width", "height", "offset_x", "offset_y")
+
+    def __init__(self, premul_bgr, inv_alpha, width, height, offset_x=0, offset_y=0):
+        self.premul_bgr = premul_bgr # (h, w, 3) uint16
+        self.inv_alpha = inv_alpha # (h, w, 1) uint16
+        self.width = width # 原圖 (含透明外框) 的寬度
+        self.height = height # 原圖 (含透明外框) 的高度
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    @classmethod
+    def from_rgba(cls, rgba_array, trim_transparent=True):
+        """
+        由 RGBA (Pillow 的順序) uint8 陣列建立 PreparedSprite。
+        :param rgba_array: (h, w, 4) uint8 陣列。
+        :param trim_transparent: 是否裁掉完全透明的外框以減少混合的像素數。
+        """
+        height, width = rgba_array.shape[:2]
+        offset_x, offset_y = 0, 0
+        if trim_transparent:
+            alpha_mask = rgba_array[:, :, 3] > 0
+            rows = np.flatnonzero(alpha_mask.any(axis=1))
+            cols = np.flatnonzero(alpha_mask.any(axis=0))
+            if rows.size == 0: # 整張圖都是透明的
+                rgba_array = rgba_array[:0, :0]
+            else:
+                offset_y, offset_x = int(rows[0]), int(cols[0])
+                rgba_array = rgba_array[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        alpha = rgba_array[:, :, 3:4].astype(np.uint16)
+        premul_bgr = np.ascontiguousarray(rgba_array[:, :, 2::-1], dtype=np.uint16) # RGB -> BGR
+        premul_bgr *= alpha
+        inv_alpha = 255 - alpha
+        return cls(premul_bgr, inv_alpha, width, height, offset_x, offset_y)
+
+    @property
+    def content_shape(self):
+        """裁切後實際需要混合的區域大小 (h, w)。"""
+        return self.premul_bgr.shape[:2]
+
+
+class BlendScratch:
+    """混合時使用的暫存緩衝區，依需要成長並重複使用，讓每幀的混合不需要配置記憶體。"""
+    __slots__ = ("_accum", "_shifted")
+
+    def __init__(self):
+        self._accum = np.empty((0, 0, 3), dtype=np.uint16)
+        self._shifted = np.empty((0, 0, 3), dtype=np.uint16)
+
+    def views(self, height, width):
+        """取得至少 (height, width, 3) 大小的兩個暫存視圖。"""
+        if self._accum.shape[0] < height or self._accum.shape[1] < width:
+            new_h = max(height, self._accum.shape[0])
+            new_w = max(width, self._accum.shape[1])
+            self._accum = np.empty((new_h, new_w, 3), dtype=np.uint16)
+            self._shifted = np.empty((new_h, new_w, 3), dtype=np.uint16)
+        return self._accum[:height, :width], self._shifted[:height, :width]
+
+
+def clamp_position(frame_shape, size, position):
+    """
+    將疊加位置限制在畫面內 (與 AROverlay 原本以 Pillow 貼上時的邊界處理相同)：
+    先避免超出右/下邊界，再避免超出左/上邊界。
+    :param frame_shape: 背景幀的 shape。
+    :param size: 疊加圖的 (寬, 高)。
+    :param position: 期望的左上角 (x, y)。
+    :return: 調整後的 (x, y)。
+    """
+    frame_h, frame_w = frame_shape[:2]
+    width, height = size
+    x, y = position
+    if x + width > frame_w:
+        x = frame_w - width
+    if y + height > frame_h:
+        y = frame_h - height
+    if x < 0:
+        x = 0
+    if y < 0:
+        y = 0
+    return int(x), int(y)
+
+
+def blend_premultiplied(frame, sprite, position, scratch):
+    """
+    將 PreparedSprite 就地混合到 BGR 幀上，只處理疊加圖覆蓋的區域。
+    使用整數運算：out = round((dst * (255 - a) + color * a) / 255)，結果與 Pillow 的 alpha 貼上一致。
+    :param frame: OpenCV BGR uint8 幀 (會被就地修改)。
+    :param sprite: PreparedSprite。
+    :param position: 原圖 (含透明外框) 左上角在幀上的 (x, y)，可超出畫面 (超出部分會被裁掉)。
+    :param scratch: BlendScratch，重複使用的暫存緩衝區。
+    :return: 實際被修改的區域 (x, y, w, h)，若完全沒有重疊則為 None。
+    """
+    content_h, content_w = sprite.content_shape
+    frame_h, frame_w = frame.shape[:2]
+    x0 = position[0] + sprite.offset_x
+    y0 = position[1] + sprite.offset_y
+    # 與畫面求交集
+    src_x, src_y = max(0, -x0), max(0, -y0)
+    dst_x, dst_y = max(0, x0), max(0, y0)
+    width = min(content_w - src_x, frame_w - dst_x)
+    height = min(content_h - src_y, frame_h - dst_y)
+    if width <= 0 or height <= 0:
+        return None
+
+    roi = frame[dst_y:dst_y + height, dst_x:dst_x + width]
+    premul = sprite.premul_bgr[src_y:src_y + height, src_x:src_x + width]
+    inv_alpha = sprite.inv_alpha[src_y:src_y + height, src_x:src_x + width]
+    accum, shifted = scratch.views(height, width)
+
+    np.multiply(roi, inv_alpha, out=accum) # dst * (255 - a)，最大 65025，不會溢位
+    np.add(accum, premul, out=accum)
+    np.add(accum, 128, out=accum)
+    # 以 (t + (t >> 8)) >> 8 計算四捨五入的除以 255
+    np.right_shift(accum, 8, out=shifted)
+    np.add(accum, shifted, out=accum)
+    np.right_shift(accum, 8, out=accum)
+    np.copyto(roi, accum, casting="unsafe")
+    return dst_x, dst_y, width, height
@@ -0,0 +1,168 @@
+# llm_backends.py
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from startup import lazy_import
+from fake_gemini_backend import FakeResponse, FakeGenerativeModel
+from response_cache import normalize_text
+
+genai = lazy_import("google.generativeai") # 只有使用 Gemini 後端時才載入 (匯入約需一秒)
+DEFAULT_GEMINI_MODEL = 'gemini-1.5-flash'
+
+
+class LLMBackend:
+    """
+    GeminiClient 底下的語言模型後端介面。後端只需提供與 genai.GenerativeModel 相同的
+    generate_content(contents, stream=False)：非串流時回傳一個回應物件，串流時回傳回應片段的可迭代物件。
+    回應物件需有 parts、candidates (含 finish_reason 與 content.parts)、prompt_feedback 與 text。
+    """
+    model_name = "unknown"
+
+    def generate_content(self, contents, stream=False):
+        """子類別實作：送出請求。"""
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, api_key, system_prompt=None, model_name=DEFAULT_GEMINI_MODEL,
+                 generation_config=None, safety_settings=None):
+        """
+        Google Gemini API 後端。
+        :param api_key: Gemini API 金鑰。
+        :param system_prompt: (可選) 給模型的系統級指令。
+        :param model_name: 模型名稱，例如 'gemini-1.5-flash'、'gemini-1.5-pro'。
+        """
+        if not api_key:
+            raise ValueError("API金鑰未提供。請設定GEMINI_API_KEY環境變數或直接傳入。")
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(
+            model_name,
+            system_instruction=system_prompt,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+            )
+        print(f"Gemini AI 模型已成功初始化 ({model_name})。")
+
+    def generate_content(self, contents, stream=False):
+        return self._model.generate_content(contents, stream=stream)
+
+
+class HttpStandInBackend(LLMBackend):
+    def __init__(self, url="http://127.0.0.1:8765", model_name="standin", timeout_s=30.0, system_prompt=None):
+        """
+        本機 HTTP 替身伺服器 (llm_standin_server.py) 的後端，用於離線執行與負載測試。
+        :param url: 替身伺服器的位址。
+        :param model_name: 回報的模型名稱 (也是回應快取鍵的一部分)。
+        :param timeout_s: 連線與讀取的逾時 (秒)。
+        :param system_prompt: (可選) 系統提示，隨請求一併送出。
+        """
+        self.url = url.rstrip("/")
+        self.model_name = model_name
+        self.timeout_s = timeout_s
+        self.system_prompt = system_prompt
+
+    def _open(self, contents, stream):
+        if isinstance(contents, str):
+            contents = [{"role": "user", "parts": [contents]}]
+        body = json.dumps({"contents": contents, "system_prompt": self.system_prompt, "stream": stream},
+                          ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(f"{self.url}/generate", data=body,
+                                         headers={"Content-Type": "application/json; charset=utf-8"})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout_s)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"替身伺服器回應錯誤 {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+
+    @staticmethod
+    def _to_response(payload):
+        if "error" in payload:
+            raise RuntimeError(f"替身伺服器回應錯誤: {payload['error']}")
+        return FakeResponse(payload.get("text", ""), finish_reason=payload.get("finish_reason"))
+
+    def generate_content(self, contents, stream=False):
+        response = self._open(contents, stream)
+        if not stream:
+            with response:
+                return self._to_response(json.loads(response.read().decode("utf-8")))
+        return self._stream(response)
+
+    def _stream(self, response):
+        """逐行讀取 NDJSON 片段；呼叫端提前結束 (close) 時關閉連線。"""
+        with response:
+            for line in response:
+                line = line.strip()
+                if line:
+                    yield self._to_response(json.loads(line.decode("utf-8")))
+
+
+class RecordingBackend(LLMBackend):
+    def __init__(self, backend, path):
+        """
+        包裝任一後端，將完整的回應記錄到 JSONL 檔，之後可由替身伺服器重播 (llm_standin_server.py --replay)。
+        只記錄有文字的回應；被阻擋或失敗的請求不記錄。
+        :param backend: 被包裝的後端。
+        :param path: 記錄檔路徑 (附加寫入)。
+        """
+        self.backend = backend
+        self.model_name = getattr(backend, "model_name", type(backend).__name__)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False):
+        prompt = FakeGenerativeModel.prompt_text(contents)
+        start = time.perf_counter()
+        response = self.backend.generate_content(contents, stream=stream)
+        if not stream:
+            if response.parts:
+                self._record(prompt, response.text, time.perf_counter() - start)
+            return response
+        return self._record_stream(prompt, response, start)
+
+    def _record_stream(self, prompt, response, start):
+        parts = []
+        first_chunk_s = None
+        for chunk in response:
+            if chunk.parts:
+                if first_chunk_s is None:
+                    first_chunk_s = time.perf_counter() - start
+                parts.append(chunk.text)
+            yield chunk
+        if parts: # 只有完整讀完的串流才會執行到這裡
+            self._record(prompt, "".join(parts), time.perf_counter() - start, first_chunk_s)
+
+    def _record(self, prompt, text, total_s, first_chunk_s=None):
+        entry = {"prompt": prompt, "key": normalize_text(prompt), "response": text,
+                 "total_s": round(total_s, 4), "first_chunk_s": None if first_chunk_s is None else round(first_chunk_s, 4)}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def create_llm_backend(backend_settings, api_key=None, system_prompt=None):
+    """
+    依 config.json 中 llm_settings.backend 的設定建立語言模型後端。
+    :param backend_settings: 設定字典，"type" 為 gemini / http / fake，其餘為該後端的參數；
+                             "record_path" (可選) 會以 RecordingBackend 包裝並記錄回應。
+    :param api_key: type 為 gemini 時使用的 API 金鑰。
+    :param system_prompt: (可選) 系統提示。
+    :return: LLMBackend (或具有相同介面的模型物件)。
+    """
+    settings = dict(backend_settings or {})
+    backend_type = settings.pop("type", "gemini")
+    record_path = settings.pop("record_path", None)
+    if backend_type == "gemini":
+        backend = GeminiBackend(api_key, system_prompt=system_prompt, **settings)
+    elif backend_type == "http":
+        backend = HttpStandInBackend(system_prompt=system_prompt, **settings)
+    elif backend_type == "fake":
+        backend = FakeGenerativeModel(**settings)
+    else:
+        raise ValueError(f"不支援的語言模型後端類型: {backend_type} (可用: gemini, http, fake)")
+    if record_path:
+        print(f"AI 回應將記錄到 '{record_path}'。")
+        backend = RecordingBackend(backend, record_path)
+    return backend
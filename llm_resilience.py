@@ -0,0 +1,306 @@
+# llm_resilience.py
+import collections
+import math
+import random
+import threading
+import time
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from fake_gemini_backend import FakeResponse
+from llm_backends import LLMBackend
+
+DEFAULT_FALLBACK_REPLY = "我現在有點連不上線，等一下再聊好嗎？"
+# 值得重試的 HTTP 狀態碼 (請求逾時、請求過多與伺服器錯誤)
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def percentile(values, p):
+    """回傳 values 的第 p 百分位數 (最近秩法)，沒有資料時為 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(math.ceil(p / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def is_transient_error(error):
+    """
+    是否為值得重試的暫時性錯誤：逾時、連線錯誤，以及 HTTP 408/429/5xx
+    (包含帶有 code 屬性的 google.api_core 例外，與以 raise ... from 包裝的 HTTPError)。
+    驗證、權限、錯誤的請求或被安全機制阻擋等錯誤重試也不會成功。
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS_CODES or code >= 500
+    if isinstance(error, urllib.error.URLError): # 沒有狀態碼的 URLError 為連線層級的錯誤
+        return True
+    cause = error.__cause__
+    return cause is not None and is_transient_error(cause)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """請求在期限內沒有完成 (包含所有重試與對沖請求)。"""
+
+
+class LatencyTracker:
+    def __init__(self, window=200):
+        """保留最近 window 次成功請求的延遲 (秒)，用於計算百分位數。"""
+        self._samples = collections.deque(maxlen=max(1, int(window)))
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = list(self._samples)
+        return percentile(samples, p)
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout_s=30.0):
+        """
+        斷路器：連續失敗達 failure_threshold 次後「斷開」，期間的請求直接使用本機的備用回應，不再等待失敗的 API；
+        經過 reset_timeout_s 後進入「半開」，只放行一個試探請求，成功則恢復，失敗則再次斷開。
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.open_count = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行請求 (斷開時回傳 False)。"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.open_count += 1
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        """(需持有鎖) 切換狀態並輸出紀錄。"""
+        print(f"AI 斷路器: {self.state} -> {state} (連續失敗 {self.consecutive_failures} 次)")
+        self.state = state
+
+
+class ResilientBackend(LLMBackend):
+    supports_deadline = True
+
+    def __init__(self, backend, deadline_s=20.0, max_retries=2, backoff_base_s=0.5, backoff_max_s=4.0,
+                 hedge=True, hedge_percentile=95, hedge_min_samples=20, failure_threshold=5, reset_timeout_s=30.0,
+                 fallback_reply=DEFAULT_FALLBACK_REPLY, latency_window=200, max_workers=8):
+        """
+        包裝任一後端，提供：每次呼叫的期限、在期限內的指數退避重試 (含隨機抖動)、
+        超過 p95 延遲仍未回應時送出一個對沖 (重複) 請求並採用先回來的結果，
+        以及在 API 持續失敗時立即回傳本機備用回應的斷路器。
+        串流請求只在第一個片段到達前重試或對沖 (之後的內容已經顯示給使用者)。
+        被安全機制阻擋或空的回應是有效的回應，不會重試，也不算失敗；
+        非暫時性的錯誤 (驗證、權限、錯誤的請求等，見 is_transient_error) 直接拋出，也不算斷路器的失敗。
+        :param backend: 被包裝的後端。
+        :param deadline_s: 呼叫端沒有指定期限時的預設期限 (秒)。
+        :param max_retries: 失敗後最多重試的次數。
+        :param backoff_base_s: 第一次重試前的退避時間上限，之後每次加倍 (實際等待為 0 到上限之間的隨機值)。
+        :param backoff_max_s: 退避時間上限的最大值。
+        :param hedge: 是否啟用對沖請求。
+        :param hedge_percentile: 等待超過這個延遲百分位數時送出對沖請求。
+        :param hedge_min_samples: 累積這麼多次成功請求的延遲後才開始對沖 (百分位數才有意義)。
+        :param failure_threshold: 連續失敗幾次後斷開。
+        :param reset_timeout_s: 斷開多久後放行試探請求。
+        :param fallback_reply: 斷開時回傳的本機備用回應。
+        :param max_workers: 執行請求的執行緒數量 (逾時被放棄的請求會在背景繼續直到網路呼叫返回)。
+        """
+        self.backend = backend
+        self.model_name = getattr(backend, "model_name", type(backend).__name__)
+        self.deadline_s = deadline_s
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = max(1, int(hedge_min_samples))
+        self.fallback_reply = fallback_reply
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout_s=reset_timeout_s)
+        # 非串流請求記錄完成時間，串流請求記錄第一個片段的延遲：兩者分開計算，對沖延遲才不會互相影響
+        self.latency = LatencyTracker(latency_window)
+        self.stream_latency = LatencyTracker(latency_window)
+        self._pool = ThreadPoolExecutor(max_workers=max(2, int(max_workers)), thread_name_prefix="LLMAttempt")
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                         "failures": 0, "non_retryable": 0, "deadline_exceeded": 0, "fallbacks": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _fallback(self, stream):
+        self._count("fallbacks")
+        response = FakeResponse(self.fallback_reply, finish_reason="STOP")
+        response.is_fallback = True # GeminiClient 不會快取或記錄備用回應
+        return iter([response]) if stream else response
+
+    def generate_content(self, contents, stream=False, deadline=None):
+        """
+        :param deadline: (可選) 絕對期限 (time.monotonic() 的時間)，例如 AIRequest.deadline；預設為現在加上 deadline_s。
+        :raises LLMDeadlineExceeded: 期限內沒有成功的回應。
+        其他例外為最後一次嘗試的錯誤。
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            return self._fallback(stream)
+        if deadline is None and self.deadline_s:
+            deadline = time.monotonic() + self.deadline_s
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                # 指數退避 + 完全隨機抖動，避免許多用戶端同時重試；等待後剩餘時間不足一次請求的典型延遲就不再重試
+                delay = self._rng.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** (attempt - 1))))
+                typical = self._latency(stream).percentile(50) or 0.0
+                if deadline is not None and time.monotonic() + delay + typical >= deadline:
+                    break
+                self._count("retries")
+                time.sleep(delay)
+            try:
+                response = self._hedged_attempt(contents, stream, deadline)
+            except LLMDeadlineExceeded as e:
+                last_error = e
+                break
+            except Exception as e:
+                if not is_transient_error(e):
+                    # 服務有回應，只是拒絕了這個請求 (例如 API 金鑰錯誤)：重試不會成功，也不代表服務中斷
+                    self._count("non_retryable")
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                continue
+            self.breaker.record_success()
+            return response
+        if isinstance(last_error, LLMDeadlineExceeded):
+            self._count("deadline_exceeded")
+        self.breaker.record_failure()
+        raise last_error if last_error is not None else LLMDeadlineExceeded("期限內沒有時間重試。")
+
+    def _latency(self, stream):
+        return self.stream_latency if stream else self.latency
+
+    def _attempt(self, contents, stream):
+        """(請求執行緒) 單次請求。串流時取得第一個片段為止，回傳 (延遲, 回應或 (第一個片段, 其餘片段))。"""
+        self._count("attempts")
+        start = time.monotonic()
+        try:
+            if not stream:
+                response = self.backend.generate_content(contents, stream=False)
+            else:
+                chunks = iter(self.backend.generate_content(contents, stream=True))
+                response = (next(chunks, None), chunks)
+        except Exception:
+            self._count("failures")
+            raise
+        return time.monotonic() - start, response
+
+    def _hedged_attempt(self, contents, stream, deadline):
+        """送出請求，超過 p95 延遲仍未完成時再送出一個對沖請求，採用先成功的結果。"""
+        primary = self._pool.submit(self._attempt, contents, stream)
+        futures = [primary]
+        hedge_delay = None
+        latency_tracker = self._latency(stream)
+        if self.hedge and len(latency_tracker) >= self.hedge_min_samples:
+            hedge_delay = latency_tracker.percentile(self.hedge_percentile)
+        errors = []
+        winner = None
+        while futures and winner is None:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            timeout = remaining
+            if hedge_delay is not None:
+                timeout = hedge_delay if remaining is None else min(hedge_delay, remaining)
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_delay is not None: # 超過 p95 仍未回應：送出一個對沖請求 (每次呼叫最多一個)
+                    hedge_delay = None
+                    self._count("hedges")
+                    futures.append(self._pool.submit(self._attempt, contents, stream))
+                continue
+            for future in done:
+                futures.remove(future)
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                elif winner is None:
+                    winner = future
+        for loser in futures: # 較慢的請求無法中斷網路呼叫，完成後關閉其串流
+            loser.add_done_callback(self._close_abandoned)
+        if winner is None:
+            if errors and not futures:
+                raise errors[-1]
+            raise LLMDeadlineExceeded("AI 請求超過期限。")
+        if winner is not primary:
+            self._count("hedge_wins")
+        latency, response = winner.result()
+        latency_tracker.record(latency)
+        if not stream:
+            return response
+        return self._resume_stream(*response)
+
+    @staticmethod
+    def _close_abandoned(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, response = future.result()
+        if isinstance(response, tuple):
+            close = getattr(response[1], "close", None)
+            if close:
+                close()
+
+    @staticmethod
+    def _resume_stream(first_chunk, chunks):
+        if first_chunk is None:
+            return
+        yield first_chunk
+        yield from chunks
+
+    @property
+    def stats(self):
+        """監控用統計：斷路器狀態、延遲百分位數 (秒，非串流為完成時間，first_chunk_ 為串流的第一個片段) 與各項計數。"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_opens"] = self.breaker.open_count
+        for p in (50, 95, 99):
+            stats[f"p{p}_s"] = self.latency.percentile(p)
+            stats[f"first_chunk_p{p}_s"] = self.stream_latency.percentile(p)
+        return stats
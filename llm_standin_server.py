@@ -0,0 +1,345 @@
+# llm_standin_server.py
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chat_session import estimate_tokens
+from fake_gemini_backend import FakeGenerativeModel
+from llm_resilience import LatencyTracker, percentile
+from response_cache import normalize_text
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+FAILURE_KINDS = ("error", "timeout", "safety", "empty", "midstream_error")
+DEFAULT_REPLY = "你好！我是本機的替身模型。你剛剛說的是「{prompt}」。這段回應會依設定的速度分段送出。最後一句也會被朗讀。"
+
+
+class LatencyModel:
+    def __init__(self, dist="lognormal", median_s=0.6, sigma=0.4, low_s=None, high_s=None, max_s=None):
+        """
+        延遲分布 (例如首字延遲)。
+        :param dist: fixed (固定為 median_s) / uniform (low_s ~ high_s) / normal (平均 median_s，標準差 sigma 秒) /
+                     lognormal (中位數 median_s，對數標準差 sigma，具有真實 API 常見的長尾)。
+        :param max_s: (可選) 取樣結果的上限。
+        """
+        if dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支援的延遲分布: {dist} (可用: {', '.join(LATENCY_DISTRIBUTIONS)})")
+        self.dist = dist
+        self.median_s = float(median_s)
+        self.sigma = float(sigma)
+        self.low_s = self.median_s * 0.5 if low_s is None else float(low_s)
+        self.high_s = self.median_s * 1.5 if high_s is None else float(high_s)
+        self.max_s = max_s
+
+    def sample(self, rng):
+        if self.dist == "fixed":
+            value = self.median_s
+        elif self.dist == "uniform":
+            value = rng.uniform(self.low_s, self.high_s)
+        elif self.dist == "normal":
+            value = rng.gauss(self.median_s, self.sigma)
+        else:
+            value = self.median_s * math.exp(rng.gauss(0.0, self.sigma))
+        value = max(0.0, value)
+        return min(value, self.max_s) if self.max_s is not None else value
+
+
+class StandInModel:
+    def __init__(self, first_chunk_latency=None, tokens_per_s=40.0, chunk_chars=6, failures=None,
+                 timeout_hang_s=60.0, replay_path=None, default_reply=DEFAULT_REPLY, seed=None, latency_window=10000):
+        """
+        替身伺服器的回應模型：決定每個請求的回應文字、首字延遲、生成速度與注入的失敗。
+        :param first_chunk_latency: 首字延遲分布的設定 (LatencyModel 的參數)。
+        :param tokens_per_s: 首字之後的生成速度 (token/秒，以 chat_session.estimate_tokens 估計)。
+        :param chunk_chars: 串流時每個片段的字元數。
+        :param failures: {失敗種類: 機率}，種類為 error (HTTP 500)、timeout (不回應)、safety (被安全機制阻擋)、
+                         empty (空回應)、midstream_error (串流到一半中斷)。
+        :param timeout_hang_s: 注入 timeout 時保持連線不回應的秒數。
+        :param replay_path: (可選) llm_backends.RecordingBackend 產生的記錄檔，相同提示會重播記錄的回應。
+        :param default_reply: 沒有記錄時的回應，可包含 {prompt}。
+        :param seed: (可選) 亂數種子，讓延遲與失敗可以重現。
+        :param latency_window: 統計首字延遲百分位數時保留的最近請求數 (長時間執行時記憶體用量固定)。
+        """
+        self.first_chunk_latency = LatencyModel(**(first_chunk_latency or {}))
+        self.tokens_per_s = max(0.1, float(tokens_per_s))
+        self.chunk_chars = max(1, int(chunk_chars))
+        self.failures = dict(failures or {})
+        unknown = set(self.failures) - set(FAILURE_KINDS)
+        if unknown:
+            raise ValueError(f"不支援的失敗種類: {', '.join(sorted(unknown))} (可用: {', '.join(FAILURE_KINDS)})")
+        self.timeout_hang_s = timeout_hang_s
+        self.default_reply = default_reply
+        self.replay = self._load_replay(replay_path) if replay_path else {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "replayed": 0, **{kind: 0 for kind in FAILURE_KINDS}}
+        self.first_chunk_s = LatencyTracker(latency_window)
+
+    @staticmethod
+    def _load_replay(path):
+        replay = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    replay[entry.get("key") or normalize_text(entry["prompt"])] = entry["response"]
+        print(f"已從 '{path}' 載入 {len(replay)} 筆可重播的回應。")
+        return replay
+
+    def plan(self, contents):
+        """
+        決定一個請求的回應。
+        :return: (失敗種類或 None, 回應文字, 首字延遲秒數)。
+        """
+        prompt = FakeGenerativeModel.prompt_text(contents)
+        with self._lock: # 共用的亂數產生器，加鎖讓設定種子時結果可重現
+            self.stats["requests"] += 1
+            failure = None
+            roll = self._rng.random()
+            for kind in FAILURE_KINDS:
+                roll -= self.failures.get(kind, 0.0)
+                if roll < 0:
+                    failure = kind
+                    self.stats[kind] += 1
+                    break
+            first_chunk_s = self.first_chunk_latency.sample(self._rng)
+            self.first_chunk_s.record(first_chunk_s)
+            text = self.replay.get(normalize_text(prompt))
+            if text is not None:
+                self.stats["replayed"] += 1
+        if text is None:
+            text = self.default_reply.format(prompt=prompt)
+        return failure, text, first_chunk_s
+
+    def chunk_delay(self, text):
+        """生成一段文字所需的時間 (依 tokens_per_s)。"""
+        return estimate_tokens(text) / self.tokens_per_s
+
+    def summary(self):
+        with self._lock:
+            summary = dict(self.stats)
+        summary["first_chunk_p50_s"] = self.first_chunk_s.percentile(50)
+        summary["first_chunk_p95_s"] = self.first_chunk_s.percentile(95)
+        return summary
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_version = "LLMStandIn/1.0"
+    model = None # 由 create_standin_server 設定
+
+    def log_message(self, format, *args):
+        pass # 負載測試時不逐筆輸出請求紀錄
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, self.model.summary())
+        else:
+            self._send_json(404, {"error": f"找不到路徑: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"error": f"找不到路徑: {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            contents = request["contents"]
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": f"無效的請求: {e}"})
+            return
+        failure, text, first_chunk_s = self.model.plan(contents)
+        if failure == "timeout":
+            time.sleep(self.model.timeout_hang_s)
+            return # 不回應，直接關閉連線
+        time.sleep(first_chunk_s)
+        if failure == "error":
+            self._send_json(500, {"error": "注入的伺服器錯誤"})
+            return
+        if failure in ("safety", "empty"):
+            payload = {"text": "", "finish_reason": "SAFETY" if failure == "safety" else "STOP"}
+            if request.get("stream"):
+                self._send_stream([payload])
+            else:
+                self._send_json(200, payload)
+            return
+        if not request.get("stream"):
+            time.sleep(self.model.chunk_delay(text))
+            self._send_json(200, {"text": text, "finish_reason": "STOP"})
+            return
+        chunks = [text[i:i + self.model.chunk_chars] for i in range(0, len(text), self.model.chunk_chars)]
+        if failure == "midstream_error":
+            chunks = chunks[:max(1, len(chunks) // 2)] + [None]
+        self._send_stream(({"text": chunk} if chunk is not None else {"error": "注入的串流中斷"}) for chunk in chunks)
+
+    def _send_stream(self, payloads):
+        """以 NDJSON 逐行送出片段 (HTTP/1.0，送完即關閉連線)，每個片段依生成速度延遲。"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
+        try:
+            for index, payload in enumerate(payloads):
+                if index > 0:
+                    time.sleep(self.model.chunk_delay(payload.get("text", "")))
+                self.wfile.write((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # 用戶端提前結束 (例如請求被取代)
+
+
+def create_standin_server(settings=None, host="127.0.0.1", port=8765):
+    """
+    建立替身伺服器 (尚未開始服務)。
+    :param settings: StandInModel 的參數 (config.json 中的 llm_settings.standin_server，不含 host/port)。
+    :return: (ThreadingHTTPServer, StandInModel)
+    """
+    model = StandInModel(**(settings or {}))
+    handler = type("StandInHandler", (_StandInHandler,), {"model": model})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, model
+
+
+def start_standin_server(settings=None, host="127.0.0.1", port=8765):
+    """在背景執行緒中啟動替身伺服器 (port 為 0 時自動選擇)，回傳 (server, model)。用 server.shutdown() 停止。"""
+    server, model = create_standin_server(settings, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="LLMStandInServer")
+    thread.daemon = True
+    thread.start()
+    return server, model
+
+
+def run_benchmark(url, num_requests=20, concurrency=4, timeout_s=30.0, resilience_settings=None):
+    """
+    不經過網路，以替身伺服器端對端測量互動流程 (與 main_app 的串流流程相同：
+    AIRequestExecutor 背景請求 -> GeminiClient.stream_message -> SentenceSplitter -> 主執行緒 poll())。
+    以封閉迴圈送出請求：同時保持 concurrency 個請求進行中，一個結束才送出下一個，延遲不包含排隊時間。
+    :param resilience_settings: (可選) llm_settings.resilience，測試重試/對沖/斷路器在注入失敗時的效果。
+    :return: 統計字典 (秒)。
+    """
+    from ai_executor import AIRequestExecutor
+    from gemini_client import GeminiClient
+    from llm_backends import HttpStandInBackend
+    from sentence_stream import SentenceSplitter
+
+    client = GeminiClient(api_key=None, model=HttpStandInBackend(url=url, timeout_s=timeout_s),
+                          resilience_settings=resilience_settings)
+    executor = AIRequestExecutor(max_workers=concurrency, max_in_flight=num_requests, default_timeout_s=timeout_s)
+    first_chunk, first_sentence, total, errors = [], [], [], []
+    in_flight = [0]
+
+    def on_finished():
+        in_flight[0] -= 1
+
+    def submit(index):
+        in_flight[0] += 1
+        splitter = SentenceSplitter()
+        start = time.perf_counter()
+        state = {"first_chunk": False, "first_sentence": False}
+
+        def consume_stream(request):
+            for chunk in client.stream_message(f"第{index}個測試問題", deadline=request.deadline):
+                if request.should_stop():
+                    break
+                request.report_progress(chunk)
+
+        def on_chunk(chunk):
+            now = time.perf_counter() - start
+            if not state["first_chunk"]:
+                state["first_chunk"] = True
+                first_chunk.append(now)
+            if splitter.feed(chunk) and not state["first_sentence"]:
+                state["first_sentence"] = True
+                first_sentence.append(now)
+
+        def on_complete(_):
+            total.append(time.perf_counter() - start)
+            on_finished()
+
+        def on_error(error):
+            errors.append(type(error).__name__)
+            on_finished()
+
+        executor.submit(consume_stream, on_complete=on_complete, on_error=on_error, on_progress=on_chunk, supersede=False)
+
+    next_index = 0
+    while next_index < num_requests or in_flight[0] > 0:
+        while next_index < num_requests and in_flight[0] < concurrency:
+            submit(next_index)
+            next_index += 1
+        executor.poll() # 回呼都在這個執行緒中執行，因此 in_flight 不需要加鎖
+        time.sleep(0.002)
+    executor.shutdown()
+
+    def describe(values):
+        return {"p50": percentile(values, 50), "p95": percentile(values, 95), "n": len(values)}
+    return {"first_chunk_s": describe(first_chunk), "first_sentence_s": describe(first_sentence),
+            "total_s": describe(total), "errors": errors,
+            "resilience": client.resilience.stats if client.resilience else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本機的語言模型替身伺服器 (離線執行與負載測試用)")
+    parser.add_argument("--config", default="config.json", help="讀取 llm_settings.standin_server 的設定檔")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--replay", default=None, help="重播 RecordingBackend 記錄的回應 (JSONL)")
+    parser.add_argument("--benchmark", type=int, default=0, metavar="N", help="啟動伺服器後送出 N 個請求並輸出延遲統計")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--resilience", action="store_true", help="測試時啟用設定檔中的 llm_settings.resilience")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, "r", encoding="utf-8") as f:
+            llm_settings = json.load(f).get("llm_settings", {})
+    except FileNotFoundError:
+        llm_settings = {}
+    server_settings = dict(llm_settings.get("standin_server", {}))
+    host = args.host or server_settings.pop("host", "127.0.0.1")
+    port = args.port if args.port is not None else server_settings.pop("port", 8765)
+    server_settings.pop("host", None)
+    server_settings.pop("port", None)
+    if args.replay:
+        server_settings["replay_path"] = args.replay
+
+    if args.benchmark:
+        server, model = start_standin_server(server_settings, host, 0) # 自動選擇可用的埠
+        url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+        start = time.perf_counter()
+        resilience_settings = dict(llm_settings.get("resilience", {}), enabled=True) if args.resilience else None
+        result = run_benchmark(url, num_requests=args.benchmark, concurrency=args.concurrency,
+                               resilience_settings=resilience_settings)
+        elapsed = time.perf_counter() - start
+        server_summary = model.summary()
+        server.shutdown()
+        print(f"{args.benchmark} 個請求 (並行 {args.concurrency}) 完成於 {elapsed:.2f} 秒")
+        for name in ("first_chunk_s", "first_sentence_s", "total_s"):
+            print(f"  {name}: {result[name]}")
+        print(f"  錯誤: {result['errors'] or '無'}")
+        if result["resilience"]:
+            print(f"  穩定性: {result['resilience']}")
+        print(f"  伺服器端: {server_summary}")
+        if result["first_chunk_s"]["p50"] is not None and server_summary["first_chunk_p50_s"] is not None:
+            overhead_ms = (result["first_chunk_s"]["p50"] - server_summary["first_chunk_p50_s"]) * 1000
+            print(f"  用戶端管線額外延遲 (首字 p50 差): {overhead_ms:.1f} ms")
+    else:
+        server, model = create_standin_server(server_settings, host, port)
+        print(f"替身伺服器已啟動: http://{host}:{server.server_address[1]} (Ctrl+C 結束)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f"替身伺服器統計: {model.summary()}")
@@ -1,78 +1,378 @@
 import cv2
+import numpy as np
 import mediapipe as mp
 from mediapipe.tasks import python
-from mediapipe.tasks.python.vision import ObjectDetector, ObjectDetectorOptions
+from mediapipe.tasks.python.vision import ObjectDetector, ObjectDetectorOptions, RunningMode
 import os
+import threading
+import time
 
 # 確保模型檔案存在，或者替換成您的模型路徑
 MODEL_FILE = os.path.join(os.path.dirname(__file__), "efficientdet_lite0.tflite") # 使用相對路徑，假設模型在同一目錄
 
+class DetectionResult:
+    """
+    以 NumPy 陣列儲存的精簡偵測結果。
+    boxes 為 (N, 4) float32，格式為影像幀像素座標的 (x1, y1, x2, y2)；
+    scores 為 (N,) float32；label_ids 為 (N,) int32，對應偵測器的標籤表 label_names。
+    """
+    __slots__ = ("boxes", "scores", "label_ids", "label_names", "frame_shape")
+
+    def __init__(self, boxes, scores, label_ids, label_names, frame_shape=None):
+        self.boxes = boxes
+        self.scores = scores
+        self.label_ids = label_ids
+        self.label_names = label_names # 標籤 id -> 名稱 (小寫) 的序列，與偵測器共用
+        self.frame_shape = frame_shape
+
+    @classmethod
+    def empty(cls, label_names=(), frame_shape=None):
+        """建立沒有任何偵測的結果。"""
+        return cls(np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32),
+                   np.zeros((0,), dtype=np.int32), label_names, frame_shape)
+
+    def __len__(self):
+        return int(self.label_ids.shape[0])
+
+    def label(self, i):
+        """回傳第 i 個偵測的物件名稱 (小寫)。"""
+        return self.label_names[int(self.label_ids[i])]
+
+    def names(self):
+        """回傳偵測到的物件名稱列表 (小寫, 不重複, 依首次出現順序)。"""
+        seen_ids = dict.fromkeys(self.label_ids.tolist())
+        return [self.label_names[label_id] for label_id in seen_ids]
+
+
+class LabelFilter:
+    """
+    預先編譯的標籤過濾器。
+    目標名稱只在建立時轉為小寫一次，之後每個標籤 id 的判斷結果會被快取，
+    因此逐一檢查偵測結果時只需要一次字典查詢。
+    """
+    __slots__ = ("target_names", "_accepts_by_id")
+
+    def __init__(self, target_objects):
+        self.target_names = frozenset(obj.lower() for obj in target_objects)
+        self._accepts_by_id = {}
+
+    def accepts(self, label_id, label_name):
+        accepted = self._accepts_by_id.get(label_id)
+        if accepted is None:
+            accepted = label_name in self.target_names
+            self._accepts_by_id[label_id] = accepted
+        return accepted
+
+
 class MediaPipeObjectDetector:
-    def __init__(self, model_path=MODEL_FILE, min_detection_confidence=0.5, max_results=5):
+    def __init__(self, model_path=MODEL_FILE, min_detection_confidence=0.5, max_results=5,
+                 inference_max_side=None, roi=None, running_mode="image", result_callback=None):
         """
         初始化 MediaPipe 物件偵測器 (使用 Tasks API)。
         :param model_path: TFLite 模型檔案的路徑。
         :param min_detection_confidence: 最小偵測信賴度 (0.0 到 1.0)。
         :param max_results: 最大偵測到的物件數量。
+        :param inference_max_side: (可選) 推論解析度的最長邊 (像素)，例如 320。
+                                   設定後會先將幀等比例縮小再轉換色彩，偵測框會映射回原始幀座標。None 表示使用原始解析度。
+        :param roi: (可選) 感興趣區域 (x, y, w, h)，以原始幀像素座標表示。只有此區域會被處理。
+        :param running_mode: "image" 使用阻塞式的 detect()；"live_stream" 使用 detect_async()，結果透過回呼函式傳回。
+        :param result_callback: (可選，live_stream 模式) 收到結果時呼叫的函式，參數為 (DetectionResult, timestamp_ms)。
         """
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"模型檔案未找到: {model_path}")
-        
+        if running_mode not in ("image", "live_stream"):
+            raise ValueError(f"不支援的執行模式: {running_mode} (可用: image, live_stream)")
+        self.running_mode = running_mode
+
+        # LIVE_STREAM 模式的狀態：送出的幀的處理參數 (以時間戳記為鍵) 與最新結果
+        self._stream_lock = threading.Lock()
+        self._pending_contexts = {}
+        self._last_timestamp_ms = -1
+        self._latest_result = None
+        self._result_seq = 0
+        self._result_listeners = [result_callback] if result_callback else []
+        self._closed = False
+
         base_options = python.BaseOptions(model_asset_path=model_path)
-        options = ObjectDetectorOptions(base_options=base_options,
-                                        max_results=max_results,
-                                        score_threshold=min_detection_confidence)
+        if running_mode == "live_stream":
+            options = ObjectDetectorOptions(base_options=base_options,
+                                            running_mode=RunningMode.LIVE_STREAM,
+                                            max_results=max_results,
+                                            score_threshold=min_detection_confidence,
+                                            result_callback=self._on_stream_result)
+        else:
+            options = ObjectDetectorOptions(base_options=base_options,
+                                            max_results=max_results,
+                                            score_threshold=min_detection_confidence)
         self.detector = ObjectDetector.create_from_options(options)
-        print(f"MediaPipe 物件偵測器 (Tasks API) 已初始化，使用模型: {model_path}")
+
+        # 標籤表：模型類別索引 -> 內部標籤 id，內部標籤 id -> 名稱 (小寫)
+        self.label_names = []
+        self._label_ids_by_name = {}
+        self._label_ids_by_index = {}
+        self._label_filters = {} # 以目標物件 tuple 為鍵的已編譯過濾器
+        self._rgb_buffer = None # 重複使用的 BGR->RGB 轉換緩衝區
+        self._resize_buffer = None # 重複使用的縮小緩衝區
+        self.inference_max_side = int(inference_max_side) if inference_max_side else None
+        self.roi = None
+        self.set_roi(roi)
+        print(f"MediaPipe 物件偵測器 (Tasks API) 已初始化，使用模型: {model_path} (模式: {running_mode})")
+
+    def _label_id_for(self, category):
+        """將 MediaPipe 類別轉為內部標籤 id (每個類別只做一次字串處理)。"""
+        index = category.index
+        if index is not None and index >= 0:
+            label_id = self._label_ids_by_index.get(index)
+            if label_id is not None:
+                return label_id
+        name = category.category_name.lower()
+        label_id = self._label_ids_by_name.get(name)
+        if label_id is None:
+            label_id = len(self.label_names)
+            self.label_names.append(name)
+            self._label_ids_by_name[name] = label_id
+        if index is not None and index >= 0:
+            self._label_ids_by_index[index] = label_id
+        return label_id
+
+    def compile_label_filter(self, target_objects):
+        """
+        取得 (或建立) 目標物件的已編譯過濾器。
+        :param target_objects: 目標物件名稱列表；None 表示不過濾。
+        :return: LabelFilter 實例，或 None。
+        """
+        if target_objects is None:
+            return None
+        key = tuple(target_objects)
+        label_filter = self._label_filters.get(key)
+        if label_filter is None:
+            label_filter = LabelFilter(target_objects)
+            self._label_filters[key] = label_filter
+        return label_filter
+
+    def _to_rgb(self, frame_cv):
+        """將 BGR 幀轉為 RGB，並重複使用相同尺寸的轉換緩衝區。"""
+        if self._rgb_buffer is None or self._rgb_buffer.shape != frame_cv.shape:
+            self._rgb_buffer = np.empty(frame_cv.shape, dtype=np.uint8)
+        cv2.cvtColor(frame_cv, cv2.COLOR_BGR2RGB, dst=self._rgb_buffer)
+        return self._rgb_buffer
+
+    def set_roi(self, roi):
+        """
+        設定 (或清除) 感興趣區域。
+        :param roi: (x, y, w, h) 原始幀像素座標，None 表示處理整個幀。
+        """
+        if roi is None:
+            self.roi = None
+            return
+        x, y, w, h = (int(v) for v in roi)
+        # 超出左/上邊界的部分裁掉 (與幀取交集)，而不是把整個區域平移進幀內
+        w += min(0, x)
+        h += min(0, y)
+        if w <= 0 or h <= 0:
+            raise ValueError(f"無效的感興趣區域: {roi}")
+        self.roi = (max(0, x), max(0, y), w, h)
+
+    def _prepare_input(self, frame_cv):
+        """
+        依感興趣區域裁切 (使用視圖，不複製) 並縮小到推論解析度，最後只在小圖上轉換色彩。
+        :return: (RGB 影像, (x 縮放倒數, y 縮放倒數, x 偏移, y 偏移))，用於將偵測框映射回原始幀座標。
+        """
+        view = frame_cv
+        offset_x, offset_y = 0, 0
+        if self.roi is not None:
+            frame_h, frame_w = frame_cv.shape[:2]
+            x, y, w, h = self.roi
+            x2, y2 = min(frame_w, x + w), min(frame_h, y + h)
+            if x < x2 and y < y2: # 感興趣區域完全在幀外時退回處理整個幀
+                view = frame_cv[y:y2, x:x2]
+                offset_x, offset_y = x, y
+
+        view_h, view_w = view.shape[:2]
+        inv_scale_x, inv_scale_y = 1.0, 1.0
+        if self.inference_max_side and max(view_h, view_w) > self.inference_max_side:
+            scale = self.inference_max_side / max(view_h, view_w)
+            target_w = max(1, int(round(view_w * scale)))
+            target_h = max(1, int(round(view_h * scale)))
+            if self._resize_buffer is None or self._resize_buffer.shape[:2] != (target_h, target_w):
+                self._resize_buffer = np.empty((target_h, target_w) + view.shape[2:], dtype=np.uint8)
+            view = cv2.resize(view, (target_w, target_h), dst=self._resize_buffer, interpolation=cv2.INTER_AREA)
+            inv_scale_x, inv_scale_y = view_w / target_w, view_h / target_h
+
+        return self._to_rgb(view), (inv_scale_x, inv_scale_y, offset_x, offset_y)
+
+    def _build_result(self, detection_result, label_filter, transform, frame_shape):
+        """將 MediaPipe 的偵測結果轉為 DetectionResult，並把偵測框映射回原始幀座標。"""
+        detections = detection_result.detections
+        if not detections:
+            return DetectionResult.empty(self.label_names, frame_shape)
+
+        boxes = np.empty((len(detections), 4), dtype=np.float32)
+        scores = np.empty((len(detections),), dtype=np.float32)
+        label_ids = np.empty((len(detections),), dtype=np.int32)
+        count = 0
+        for detection in detections:
+            category = detection.categories[0] # 取第一個類別
+            label_id = self._label_id_for(category)
+            if label_filter is not None and not label_filter.accepts(label_id, self.label_names[label_id]):
+                continue
+            bbox = detection.bounding_box
+            boxes[count] = (bbox.origin_x, bbox.origin_y, bbox.origin_x + bbox.width, bbox.origin_y + bbox.height)
+            scores[count] = category.score
+            label_ids[count] = label_id
+            count += 1
+
+        boxes = boxes[:count]
+        inv_scale_x, inv_scale_y, offset_x, offset_y = transform
+        if inv_scale_x != 1.0 or inv_scale_y != 1.0 or offset_x or offset_y:
+            boxes[:, 0::2] = boxes[:, 0::2] * inv_scale_x + offset_x
+            boxes[:, 1::2] = boxes[:, 1::2] * inv_scale_y + offset_y
+        if frame_shape is not None:
+            np.clip(boxes[:, 0::2], 0, frame_shape[1], out=boxes[:, 0::2])
+            np.clip(boxes[:, 1::2], 0, frame_shape[0], out=boxes[:, 1::2])
+        return DetectionResult(boxes, scores[:count], label_ids[:count], self.label_names, frame_shape)
+
+    def detect(self, frame_cv, target_objects=None):
+        """
+        在影像幀中偵測物件，不複製影像幀。
+        :param frame_cv: OpenCV BGR 格式的影像幀 (不會被修改)。
+        :param target_objects: (可選) 目標物件名稱列表，或 compile_label_filter() 回傳的 LabelFilter。
+        :return: DetectionResult (偵測框為原始幀像素座標)
+        """
+        if self.running_mode != "image":
+            raise RuntimeError("detect() 只能在 image 模式下使用，live_stream 模式請改用 detect_async()。")
+        label_filter = target_objects if isinstance(target_objects, LabelFilter) else self.compile_label_filter(target_objects)
+
+        # MediaPipe Tasks API 使用 RGB 格式
+        rgb_input, transform = self._prepare_input(frame_cv)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_input)
+        detection_result = self.detector.detect(mp_image)
+        return self._build_result(detection_result, label_filter, transform, frame_cv.shape)
+
+    def _next_timestamp_ms(self):
+        """產生單調遞增的毫秒時間戳記 (LIVE_STREAM 模式要求時間戳記嚴格遞增)。"""
+        timestamp_ms = int(time.monotonic() * 1000)
+        if timestamp_ms <= self._last_timestamp_ms:
+            timestamp_ms = self._last_timestamp_ms + 1
+        self._last_timestamp_ms = timestamp_ms
+        return timestamp_ms
+
+    def detect_async(self, frame_cv, target_objects=None):
+        """
+        (live_stream 模式) 非阻塞地送出一幀進行偵測。
+        MediaPipe 在忙碌時會自行丟棄幀，結果會透過回呼函式與 get_latest_result() 取得。
+        :param frame_cv: OpenCV BGR 格式的影像幀 (不會被修改)。
+        :param target_objects: (可選) 目標物件名稱列表，或 LabelFilter。
+        :return: 此幀的時間戳記 (毫秒)；若偵測器已關閉則為 None。
+        """
+        if self.running_mode != "live_stream":
+            raise RuntimeError("detect_async() 只能在 live_stream 模式下使用，請改用 detect()。")
+        label_filter = target_objects if isinstance(target_objects, LabelFilter) else self.compile_label_filter(target_objects)
+        rgb_input, transform = self._prepare_input(frame_cv)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_input)
+
+        with self._stream_lock:
+            if self._closed:
+                return None
+            timestamp_ms = self._next_timestamp_ms()
+            self._pending_contexts[timestamp_ms] = (label_filter, transform, frame_cv.shape)
+        self.detector.detect_async(mp_image, timestamp_ms)
+        return timestamp_ms
+
+    def _on_stream_result(self, detection_result, output_image, timestamp_ms):
+        """MediaPipe LIVE_STREAM 模式的結果回呼 (在 MediaPipe 的執行緒中執行)。"""
+        with self._stream_lock:
+            context = self._pending_contexts.pop(timestamp_ms, None)
+            # 較早送出但被 MediaPipe 丟棄的幀不會再有回呼，一併清除
+            for stale_timestamp in [ts for ts in self._pending_contexts if ts < timestamp_ms]:
+                del self._pending_contexts[stale_timestamp]
+        if context is None:
+            return
+        label_filter, transform, frame_shape = context
+        try:
+            result = self._build_result(detection_result, label_filter, transform, frame_shape)
+        except Exception as e:
+            print(f"處理串流偵測結果時發生錯誤: {e}")
+            return
+
+        with self._stream_lock:
+            self._latest_result = result
+            self._result_seq += 1
+            listeners = list(self._result_listeners)
+        for listener in listeners:
+            try:
+                listener(result, timestamp_ms)
+            except Exception as e:
+                print(f"偵測結果回呼函式發生錯誤: {e}")
+
+    def add_result_listener(self, callback):
+        """
+        (live_stream 模式) 註冊結果回呼函式。
+        :param callback: 參數為 (DetectionResult, timestamp_ms) 的函式，在 MediaPipe 的執行緒中被呼叫。
+        """
+        with self._stream_lock:
+            self._result_listeners.append(callback)
+
+    def get_latest_result(self):
+        """
+        (live_stream 模式) 取得最近一次的偵測結果 (執行緒安全)。
+        :return: (DetectionResult 或 None, 結果序號)。序號改變代表有新的偵測結果。
+        """
+        with self._stream_lock:
+            return self._latest_result, self._result_seq
+
+    def draw_detections(self, frame_cv, result, show_confidence=False):
+        """
+        在影像幀上 (就地) 繪製偵測框。
+        :param frame_cv: OpenCV BGR 格式的影像幀。
+        :param result: detect() 回傳的 DetectionResult。
+        :param show_confidence: (可選) 是否在邊界框上顯示信賴度。
+        :return: 繪製後的影像幀 (與 frame_cv 為同一物件)。
+        """
+        for i in range(len(result)):
+            x1, y1, x2, y2 = result.boxes[i]
+            start_point = int(x1), int(y1)
+            end_point = int(x2), int(y2)
+            cv2.rectangle(frame_cv, start_point, end_point, (0, 255, 0), 2)  # 綠色框
+
+            # (可選) 顯示物件名稱和信賴度
+            if show_confidence:
+                confidence = int(round(float(result.scores[i]), 2) * 100)
+                label_text = f"{result.label(i)} ({confidence}%)"
+                text_origin = start_point[0], start_point[1] - 10  # 框上方
+                cv2.putText(frame_cv, label_text, text_origin, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        return frame_cv
 
     def detect_objects(self, frame_cv, target_objects=None, draw_boxes=False, show_confidence=False):
         """
-        在影像幀中偵測物件。
+        在影像幀中偵測物件 (僅需物件名稱的舊介面，內部使用 detect())。
         :param frame_cv: OpenCV BGR 格式的影像幀。
         :param target_objects: (可選) 目標物件名稱列表 (小寫)。如果提供，則僅返回這些物件。
-        :param draw_boxes: (可選) 是否在影像上繪製邊界框。
+        :param draw_boxes: (可選) 是否在影像上繪製邊界框。只有在繪製時才會複製影像幀。
         :param show_confidence: (可選) 是否在邊界框上顯示信賴度。
         :return: (偵測到的物件名稱列表 (小寫, 不重複), 處理後的影像幀)
         """
-        # MediaPipe Tasks API 使用 RGB 格式
-        rgb_frame = cv2.cvtColor(frame_cv, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-        
-        detection_result = self.detector.detect(mp_image)
-        
-        detected_object_names = []
-        annotated_image = frame_cv.copy() # 複製一份，避免修改原始影像
-
-        if detection_result.detections:
-            for detection in detection_result.detections:
-                category = detection.categories[0] # 取第一個類別
-                object_name = category.category_name.lower() # 轉小寫
-                
-                if target_objects is None or object_name in [obj.lower() for obj in target_objects]:
-                    detected_object_names.append(object_name)
-
-                    if draw_boxes:
-                        # 將 bounding box 轉換為整數座標
-                        bbox = detection.bounding_box
-                        start_point = int(bbox.origin_x), int(bbox.origin_y)
-                        end_point = int(bbox.origin_x + bbox.width), int(bbox.origin_y + bbox.height)
-                        
-                        # 繪製 bounding box
-                        cv2.rectangle(annotated_image, start_point, end_point, (0, 255, 0), 2)  # 綠色框
-
-                        # (可選) 顯示物件名稱和信賴度
-                        if show_confidence:
-                            confidence = int(round(category.score, 2) * 100)
-                            label_text = f"{object_name} ({confidence}%)"
-                            text_origin = start_point[0], start_point[1] - 10  # 框上方
-                            cv2.putText(annotated_image, label_text, text_origin, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-
-        return list(set(detected_object_names)), annotated_image
+        result = self.detect(frame_cv, target_objects=target_objects)
+        if not draw_boxes:
+            return result.names(), frame_cv
+        annotated_image = self.draw_detections(frame_cv.copy(), result, show_confidence=show_confidence) # 複製一份，避免修改原始影像
+        return result.names(), annotated_image
 
     def close(self):
-        """(目前可選) 關閉資源，雖然 Python 的垃圾回收機制會自動處理。"""
-        print("MediaPipe 物件偵測器 (Tasks API) 資源將在物件銷毀時自動釋放。")
-        # MediaPipe Tasks API 的 ObjectDetector 目前沒有顯式的 close() 方法
+        """
+        關閉偵測器並釋放 MediaPipe 資源。
+        live_stream 模式下，關閉後 detect_async() 不再送出新幀，尚未完成的結果會被捨棄。
+        """
+        with self._stream_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending_contexts.clear()
+        try:
+            self.detector.close()
+            print("MediaPipe 物件偵測器 (Tasks API) 已關閉。")
+        except Exception as e:
+            print(f"關閉 MediaPipe 物件偵測器時發生錯誤: {e}")
 
 
 if __name__ == '__main__':
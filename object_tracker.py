@@ -0,0 +1,215 @@
+# object_tracker.py
+import time
+import numpy as np
+
+
+class Track:
+    """單一追蹤目標的狀態。box 為 (x1, y1, x2, y2) 像素座標，velocity 為框中心的移動速度 (像素/秒)。"""
+    __slots__ = ("track_id", "label_id", "label", "box", "velocity", "confidence",
+                 "hits", "misses", "present", "last_update_time")
+
+    def __init__(self, track_id, label_id, label, box, score, timestamp):
+        self.track_id = track_id
+        self.label_id = label_id
+        self.label = label
+        self.box = np.asarray(box, dtype=np.float32).copy()
+        self.velocity = np.zeros(2, dtype=np.float32)
+        self.confidence = float(score)
+        self.hits = 1 # 連續被偵測到的次數
+        self.misses = 0 # 連續在推論中缺席的次數
+        self.present = False
+        self.last_update_time = timestamp
+
+    def predicted_box(self, timestamp, max_extrapolation_s):
+        """依速度外插目前時間的框位置 (外插時間有上限，避免長時間漂移)。"""
+        dt = min(max(0.0, timestamp - self.last_update_time), max_extrapolation_s)
+        if dt == 0.0 or not self.velocity.any():
+            return self.box
+        shift = self.velocity * dt
+        return self.box + np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+
+
+def _iou_matrix(boxes_a, boxes_b):
+    """計算兩組 (x1, y1, x2, y2) 框之間的 IoU 矩陣。"""
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+
+def _centers(boxes):
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) * 0.5, (boxes[:, 1] + boxes[:, 3]) * 0.5], axis=1)
+
+
+class ObjectTracker:
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.15, score_smoothing=0.5,
+                 miss_decay=0.6, enter_hits=2, enter_confidence=0.7, exit_confidence=0.25,
+                 max_extrapolation_s=0.5, velocity_smoothing=0.5):
+        """
+        輕量的多目標追蹤器，在兩次推論之間維持穩定的物件集合與框位置。
+        只有實際執行過的推論結果才應傳入 update()；沒有推論的幀請呼叫 predict()。
+        :param iou_threshold: 以 IoU 關聯偵測與追蹤目標的最低門檻。
+        :param max_centroid_distance: IoU 不足時改用中心點距離關聯的上限 (相對於畫面對角線長度的比例)。
+        :param score_smoothing: 被偵測到時信賴度的平滑係數 (新分數的權重)。
+        :param miss_decay: 在推論中缺席時信賴度的衰減倍率。
+        :param enter_hits: 連續被偵測到幾次後才視為「存在」(遲滯的進入條件)。
+        :param enter_confidence: 單次偵測分數達到此值時可直接視為「存在」。
+        :param exit_confidence: 信賴度低於此值時視為「不存在」並移除追蹤目標 (遲滯的離開條件)。
+        :param max_extrapolation_s: 依速度外插框位置的最長時間 (秒)。
+        :param velocity_smoothing: 速度估計的平滑係數 (新速度的權重)。
+        """
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.score_smoothing = score_smoothing
+        self.miss_decay = miss_decay
+        self.enter_hits = max(1, int(enter_hits))
+        self.enter_confidence = enter_confidence
+        self.exit_confidence = exit_confidence
+        self.max_extrapolation_s = max_extrapolation_s
+        self.velocity_smoothing = velocity_smoothing
+
+        self.tracks = []
+        self._next_track_id = 1
+        self._last_timestamp = None
+
+    def _associate(self, track_boxes, track_labels, det_boxes, det_labels, frame_diagonal):
+        """
+        以貪婪法將偵測指派給追蹤目標：先依 IoU，再以中心點距離補上剩下的配對。只有相同標籤才能配對。
+        :return: [(追蹤索引, 偵測索引), ...]
+        """
+        matches = []
+        if len(track_boxes) == 0 or len(det_boxes) == 0:
+            return matches
+        same_label = track_labels[:, None] == det_labels[None, :]
+        used_tracks, used_dets = set(), set()
+
+        iou = np.where(same_label, _iou_matrix(track_boxes, det_boxes), 0.0)
+        for flat_index in np.argsort(-iou, axis=None):
+            t, d = divmod(int(flat_index), iou.shape[1])
+            if iou[t, d] < self.iou_threshold:
+                break
+            if t in used_tracks or d in used_dets:
+                continue
+            matches.append((t, d))
+            used_tracks.add(t)
+            used_dets.add(d)
+
+        if self.max_centroid_distance and frame_diagonal > 0:
+            distance = np.linalg.norm(_centers(track_boxes)[:, None, :] - _centers(det_boxes)[None, :, :], axis=2) / frame_diagonal
+            distance = np.where(same_label, distance, np.inf)
+            for flat_index in np.argsort(distance, axis=None):
+                t, d = divmod(int(flat_index), distance.shape[1])
+                if distance[t, d] > self.max_centroid_distance:
+                    break
+                if t in used_tracks or d in used_dets:
+                    continue
+                matches.append((t, d))
+                used_tracks.add(t)
+                used_dets.add(d)
+        return matches
+
+    def update(self, result, timestamp=None):
+        """
+        以一次實際推論的結果更新追蹤狀態。
+        :param result: DetectionResult (偵測框為原始幀像素座標)。
+        :param timestamp: (可選) 推論對應的時間 (time.monotonic() 秒)。
+        :return: 目前視為「存在」的追蹤目標列表。
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self._last_timestamp = timestamp
+
+        if self.tracks:
+            track_boxes = np.stack([track.predicted_box(timestamp, self.max_extrapolation_s) for track in self.tracks])
+            track_labels = np.array([track.label_id for track in self.tracks], dtype=np.int32)
+        else:
+            track_boxes = np.zeros((0, 4), dtype=np.float32)
+            track_labels = np.zeros((0,), dtype=np.int32)
+        frame_diagonal = float(np.hypot(result.frame_shape[0], result.frame_shape[1])) if result.frame_shape else 0.0
+
+        matches = self._associate(track_boxes, track_labels, result.boxes, result.label_ids, frame_diagonal)
+        matched_tracks = set()
+        matched_dets = set()
+        for t, d in matches:
+            self._apply_detection(self.tracks[t], result.boxes[d], float(result.scores[d]), timestamp)
+            matched_tracks.add(t)
+            matched_dets.add(d)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.hits = 0
+                track.misses += 1
+                track.confidence *= self.miss_decay
+
+        for d in range(len(result)):
+            if d not in matched_dets:
+                track = Track(self._next_track_id, int(result.label_ids[d]), result.label(d),
+                              result.boxes[d], float(result.scores[d]), timestamp)
+                self._next_track_id += 1
+                self._update_presence(track)
+                self.tracks.append(track)
+
+        # 信賴度衰減到離開門檻以下的目標視為已離開
+        self.tracks = [track for track in self.tracks if track.confidence >= self.exit_confidence]
+        for track in self.tracks:
+            self._update_presence(track)
+        return self.present_tracks()
+
+    def _apply_detection(self, track, box, score, timestamp):
+        """以配對到的偵測更新追蹤目標的框、速度與信賴度。"""
+        dt = timestamp - track.last_update_time
+        if dt > 0:
+            old_center = np.array([(track.box[0] + track.box[2]) * 0.5, (track.box[1] + track.box[3]) * 0.5], dtype=np.float32)
+            new_center = np.array([(box[0] + box[2]) * 0.5, (box[1] + box[3]) * 0.5], dtype=np.float32)
+            measured_velocity = (new_center - old_center) / dt
+            track.velocity = (self.velocity_smoothing * measured_velocity
+                              + (1.0 - self.velocity_smoothing) * track.velocity).astype(np.float32)
+        track.box = np.asarray(box, dtype=np.float32).copy()
+        track.confidence = self.score_smoothing * score + (1.0 - self.score_smoothing) * track.confidence
+        track.hits += 1
+        track.misses = 0
+        track.last_update_time = timestamp
+
+    def _update_presence(self, track):
+        """遲滯判斷：需連續命中 (或高分) 才進入「存在」，信賴度低於離開門檻才會離開。"""
+        if not track.present:
+            if track.hits >= self.enter_hits or track.confidence >= self.enter_confidence:
+                track.present = True
+        elif track.confidence < self.exit_confidence:
+            track.present = False
+
+    def predict(self, timestamp=None):
+        """
+        沒有執行推論的幀：不改變存在與否，只依速度外插框位置。
+        :return: 目前視為「存在」的追蹤目標列表。
+        """
+        self._last_timestamp = time.monotonic() if timestamp is None else timestamp
+        return self.present_tracks()
+
+    def present_tracks(self):
+        """回傳目前視為「存在」的追蹤目標列表。"""
+        return [track for track in self.tracks if track.present]
+
+    def present_names(self):
+        """回傳目前存在的物件名稱列表 (小寫, 不重複, 依追蹤編號排序以保持穩定)。"""
+        return list(dict.fromkeys(track.label for track in sorted(self.present_tracks(), key=lambda t: t.track_id)))
+
+    def present_boxes(self, timestamp=None):
+        """
+        回傳目前存在的物件在指定時間的 (外插) 框位置。
+        :return: [(track_id, label, (x1, y1, x2, y2)), ...]
+        """
+        timestamp = self._last_timestamp if timestamp is None else timestamp
+        if timestamp is None:
+            timestamp = time.monotonic()
+        return [(track.track_id, track.label, tuple(float(v) for v in track.predicted_box(timestamp, self.max_extrapolation_s)))
+                for track in self.present_tracks()]
+
+    def reset(self):
+        """清除所有追蹤目標。"""
+        self.tracks = []
+        self._last_timestamp = None
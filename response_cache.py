@@ -0,0 +1,146 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "。．.！!？?～~…，,、 "
+
+
+def normalize_text(text):
+    """正規化提示文字作為快取鍵：去除前後空白、合併連續空白、忽略大小寫與句尾標點。"""
+    if not text:
+        return ""
+    return _WHITESPACE.sub(" ", text).strip().casefold().rstrip(_TRAILING_PUNCTUATION)
+
+
+def make_cache_key(model_name, system_prompt, prompt, context=None):
+    """
+    以 (模型, 系統提示, 提示, 環境資訊) 的正規化結果產生快取鍵。
+    :return: SHA-256 十六進位字串。
+    """
+    parts = [model_name or "", (system_prompt or "").strip(), normalize_text(prompt), normalize_text(context)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path="response_cache.sqlite3", max_entries=256, ttl_s=24 * 3600):
+        """
+        AI 回應的持久化快取。以 SQLite 儲存 (重新啟動後仍有效)，並在記憶體中保留 LRU 索引，
+        因此命中時只需一次字典查詢，不需存取磁碟或網路。
+        只應存入有效的文字回應；被安全機制阻擋、空回應與錯誤都不應放入快取。
+        :param path: SQLite 檔案路徑 (":memory:" 表示不寫入磁碟)。
+        :param max_entries: 最多保留的回應數量 (超過時淘汰最久未使用的)。
+        :param ttl_s: 回應的有效時間 (秒)，None 表示不過期。
+        """
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # 快取鍵 -> (回應文字, 建立時間)，依最近使用順序排列
+        self._touched = {} # 命中後尚未寫回磁碟的最後使用時間
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(path)) if path != ":memory:" else None
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)")
+        self._load()
+
+    def _load(self):
+        """啟動時刪除過期項目，並將最近使用的項目載入記憶體索引。"""
+        with self._lock:
+            if self.ttl_s is not None:
+                self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_s,))
+            rows = self._db.execute("SELECT key, response, created_at FROM responses ORDER BY last_access DESC LIMIT ?",
+                                    (self.max_entries,)).fetchall()
+            # 超出容量的舊項目直接從磁碟刪除
+            self._db.execute("DELETE FROM responses WHERE key NOT IN "
+                             "(SELECT key FROM responses ORDER BY last_access DESC LIMIT ?)", (self.max_entries,))
+            self._db.commit()
+            for key, response, created_at in reversed(rows): # 由舊到新加入，最近使用的在最後
+                self._entries[key] = (response, created_at)
+        if rows:
+            print(f"已從 '{self.path}' 載入 {len(rows)} 筆快取的 AI 回應。")
+
+    def get(self, key):
+        """
+        查詢快取。
+        :return: 回應文字，未命中或已過期時為 None。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if self.ttl_s is not None and now - entry[1] > self.ttl_s:
+                del self._entries[key]
+                self._touched.pop(key, None)
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._touched[key] = now # 最後使用時間延後到下一次寫入時一併寫回
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        """存入一筆有效的文字回應。"""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (response, now)
+            self._entries.move_to_end(key)
+            self._touched.pop(key, None)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._touched.pop(old_key, None)
+                evicted.append((old_key,))
+                self.evictions += 1
+            self._db.execute("INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                             (key, response, now, now))
+            if evicted:
+                self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self._flush_touched()
+            self._db.commit()
+
+    def _flush_touched(self):
+        """將命中後更新的最後使用時間寫回磁碟 (呼叫端需持有鎖並負責 commit)。"""
+        if self._touched:
+            self._db.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                 [(last_access, key) for key, last_access in self._touched.items()])
+            self._touched.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.commit()
+            self._db.close()
+
+    @property
+    def stats(self):
+        """回傳快取統計：命中、未命中、淘汰次數與目前項目數。"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
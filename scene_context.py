@@ -0,0 +1,160 @@
+# scene_context.py
+import collections
+import re
+import threading
+import time
+
+from chat_session import estimate_tokens
+
+POSITION_NAMES = ("左", "中", "右")
+# 物件標籤的中文名稱，用於判斷使用者的提問是否已經提到該物件 (提示中仍使用較省 token 的英文標籤)
+LABEL_ALIASES = {
+    "person": ("有人", "人們"), "chair": ("椅子",), "cup": ("杯子",), "book": ("書",), "laptop": ("筆電", "電腦"),
+    "keyboard": ("鍵盤",), "mouse": ("滑鼠",), "cell phone": ("手機",), "bottle": ("瓶子", "水瓶"),
+    "tv": ("電視",), "remote": ("遙控器",), "table": ("桌子",), "dining table": ("桌子", "餐桌"), "couch": ("沙發",),
+    "bed": ("床",), "desk": ("書桌",), "bookshelf": ("書架",), "shelf": ("架子",), "speaker": ("喇叭",),
+    "lamp": ("燈",), "fan": ("電風扇", "風扇"), "clock": ("時鐘",), "vase": ("花瓶",), "potted plant": ("盆栽", "植物"),
+    "backpack": ("背包",),
+}
+# 所有中文名稱依長度由長到短組成的樣式：同一位置優先比對較長的名稱 ("書桌" 不會被當成 "書")
+_ALIAS_PATTERN = re.compile("|".join(re.escape(alias) for alias in sorted(
+    {alias for aliases in LABEL_ALIASES.values() for alias in aliases}, key=len, reverse=True)))
+
+
+class SceneContextEncoder:
+    def __init__(self, window_s=5.0, sample_interval_s=0.2, min_stability=0.4, steady_stability=0.8,
+                 max_objects=6, max_tokens=40, position_bands=(1 / 3, 2 / 3)):
+        """
+        將一段時間內的物件追蹤結果彙整成精簡、固定格式的環境描述，取代只看單一幀、列出所有標籤的做法。
+        描述包含數量、位置 (左/中/右) 與穩定度，並受 token 上限限制；相同的場景總是產生相同的文字，
+        因此提示較短，回應快取也更容易命中。
+        :param window_s: 彙整的時間視窗 (秒)。
+        :param sample_interval_s: 取樣間隔 (秒)，observe() 在間隔內的呼叫會被忽略。
+        :param min_stability: 在視窗內出現比例低於此值的物件視為雜訊，不列入描述。
+        :param steady_stability: 出現比例低於此值的物件會標註「偶爾」。
+        :param max_objects: 最多列出幾種物件。
+        :param max_tokens: 描述的 token 上限 (以 chat_session.estimate_tokens 估計)。
+        :param position_bands: 畫面寬度中「左/中」與「中/右」的分界 (比例)。
+        """
+        self.window_s = window_s
+        self.sample_interval_s = sample_interval_s
+        self.min_stability = min_stability
+        self.steady_stability = steady_stability
+        self.max_objects = max(1, int(max_objects))
+        self.max_tokens = max(1, int(max_tokens))
+        self.position_bands = position_bands
+        self._samples = collections.deque() # (時間, ((標籤, 位置索引), ...))
+        self._last_sample_time = None
+        self._lock = threading.Lock()
+
+    def _position(self, box, frame_width):
+        center = (box[0] + box[2]) * 0.5 / frame_width
+        if center < self.position_bands[0]:
+            return 0
+        return 1 if center <= self.position_bands[1] else 2
+
+    def observe(self, present_boxes, frame_width, timestamp=None):
+        """
+        (繪製迴圈每幀呼叫) 記錄目前存在的物件。
+        :param present_boxes: ObjectTracker.present_boxes() 的結果 [(track_id, label, (x1, y1, x2, y2)), ...]。
+        :param frame_width: 畫面寬度 (像素)。
+        :param timestamp: (可選) 目前時間 (time.monotonic() 秒)。
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self._last_sample_time is not None and timestamp - self._last_sample_time < self.sample_interval_s:
+            return
+        self._last_sample_time = timestamp
+        objects = tuple((label, self._position(box, frame_width)) for _, label, box in present_boxes) if frame_width else ()
+        with self._lock:
+            self._samples.append((timestamp, objects))
+            while self._samples and timestamp - self._samples[0][0] > self.window_s:
+                self._samples.popleft()
+
+    def summarize(self):
+        """
+        彙整視窗內的取樣。
+        :return: [(標籤, 數量, 位置索引 tuple, 穩定度), ...]，依穩定度、數量、標籤排序 (結果固定)。
+        """
+        with self._lock:
+            samples = [objects for _, objects in self._samples]
+        if not samples:
+            return []
+        present = collections.Counter() # 標籤 -> 出現的取樣數
+        counts = collections.defaultdict(collections.Counter) # 標籤 -> {數量: 取樣數}
+        positions = collections.defaultdict(collections.Counter) # 標籤 -> {位置: 取樣數}
+        for objects in samples:
+            per_label = collections.defaultdict(set)
+            label_counts = collections.Counter(label for label, _ in objects)
+            for label, position in objects:
+                per_label[label].add(position)
+            for label, bands in per_label.items():
+                present[label] += 1
+                counts[label][label_counts[label]] += 1
+                positions[label].update(bands)
+        summary = []
+        for label, hits in present.items():
+            stability = hits / len(samples)
+            if stability < self.min_stability:
+                continue
+            # 最常見的數量 (相同時取較大者)；位置取在一半以上的出現中都有的區域
+            count = max(counts[label].items(), key=lambda item: (item[1], item[0]))[0]
+            bands = tuple(sorted(band for band, n in positions[label].items() if n * 2 >= hits))
+            summary.append((label, count, bands, round(stability, 2)))
+        summary.sort(key=lambda item: (-item[3], -item[1], item[0]))
+        return summary
+
+    @staticmethod
+    def mentioned(label, text, aliases_found=None):
+        """
+        使用者的提問是否已經提到這個物件。英文標籤以完整單字比對 ("cup" 不會比對到 "cupboard")，
+        中文名稱以最長比對 ("書桌" 只算 desk，不算 book)。
+        :param aliases_found: (可選) mentioned_aliases(text) 的結果，比對多個標籤時可以重複使用。
+        """
+        if not text:
+            return False
+        if re.search(rf"\b{re.escape(label)}(?:s|es)?\b", text.lower()):
+            return True
+        if aliases_found is None:
+            aliases_found = SceneContextEncoder.mentioned_aliases(text)
+        return any(alias in aliases_found for alias in LABEL_ALIASES.get(label, ()))
+
+    @staticmethod
+    def mentioned_aliases(text):
+        """回傳提問中出現的中文名稱集合 (由左到右、較長的名稱優先，不重疊)。"""
+        return set(_ALIAS_PATTERN.findall(text or ""))
+
+    def _describe(self, label, count, bands, stability):
+        text = label if count <= 1 else f"{label}×{count}"
+        details = "、".join(POSITION_NAMES[band] for band in bands)
+        if stability < self.steady_stability:
+            details = f"{details}，偶爾" if details else "偶爾"
+        return f"{text}({details})" if details else text
+
+    def encode(self, user_text=""):
+        """
+        產生附加在提示後的環境描述，例如 "[環境感知：person(中)、cup×2(左)、laptop(右，偶爾)]"。
+        使用者的提問已經提到的物件不再重複列出。
+        :param user_text: 目前的提問。
+        :return: 描述字串，沒有可描述的物件時為 None。
+        """
+        items = []
+        aliases_found = self.mentioned_aliases(user_text)
+        for label, count, bands, stability in self.summarize():
+            if len(items) >= self.max_objects:
+                break
+            if self.mentioned(label, user_text, aliases_found):
+                continue
+            candidate = items + [self._describe(label, count, bands, stability)]
+            if estimate_tokens(self._wrap(candidate)) > self.max_tokens:
+                break
+            items = candidate
+        return self._wrap(items) if items else None
+
+    @staticmethod
+    def _wrap(items):
+        return f"[環境感知：{'、'.join(items)}]"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._last_sample_time = None
@@ -0,0 +1,74 @@
+# sentence_stream.py
+
+# 句子結尾的標點 (半形句點另外處理，避免把小數點或縮寫切開)
+_SENTENCE_ENDINGS = set("。！？!?；;…\n")
+# 可以接在句尾標點後面、仍屬於同一句的收尾符號
+_CLOSING_MARKS = set("」』）)】》\"'”’")
+
+
+class SentenceSplitter:
+    def __init__(self, min_chars=2):
+        """
+        將串流中陸續到達的文字片段切成完整的句子，讓 TTS 可以在每句結束時立即開始朗讀。
+        :param min_chars: 句子的最少字元數，太短的片段 (例如單獨的標點) 會併入下一句。
+        """
+        self.min_chars = max(1, int(min_chars))
+        self._buffer = ""
+        self._scan_from = 0 # 緩衝區中尚未檢查過的位置
+
+    def feed(self, chunk):
+        """
+        加入一段新文字。
+        :param chunk: 串流中收到的文字片段。
+        :return: 因這段文字而完成的句子列表 (可能為空)。
+        """
+        if not chunk:
+            return []
+        self._buffer += chunk
+        sentences = []
+        buffer = self._buffer
+        start = 0
+        i = self._scan_from
+        length = len(buffer)
+        while i < length:
+            char = buffer[i]
+            if char in _SENTENCE_ENDINGS:
+                end = i + 1
+            elif char == '.':
+                # 句點 (與其後的收尾符號，例如 '."') 後面接空白才是句尾
+                after = i + 1
+                while after < length and buffer[after] in _CLOSING_MARKS:
+                    after += 1
+                if after >= length: # 還不知道後面是否為空白 (例如 "3.14")，等下一段文字
+                    break
+                if not buffer[after].isspace():
+                    i += 1
+                    continue
+                end = i + 1
+            else:
+                i += 1
+                continue
+            # 把連續的句尾標點與收尾符號一起包含進來 (例如 "！？」")
+            while end < length and (buffer[end] in _SENTENCE_ENDINGS or buffer[end] in _CLOSING_MARKS):
+                end += 1
+            if end >= length and buffer[end - 1] != '\n':
+                # 句尾標點在緩衝區的最後，後面可能還有收尾符號，等下一段文字 (或 flush) 再決定
+                break
+            sentence = buffer[start:end].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = end
+            i = end
+        self._buffer = buffer[start:]
+        self._scan_from = max(0, i - start)
+        return sentences
+
+    def flush(self):
+        """
+        串流結束時取出剩餘的文字 (最後一句可能沒有句尾標點)。
+        :return: 剩餘的句子，沒有內容時為 None。
+        """
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        self._scan_from = 0
+        return remainder or None
@@ -0,0 +1,288 @@
+# speech_bubble.py
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from startup import lazy_import
+from image_blend import BlendScratch, PreparedSprite, blend_premultiplied
+from text_layout import layout_text
+
+# Pillow 在第一次繪製泡泡時才載入 (縮短程式啟動時間)
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
+
+DEFAULT_FONT_PATH = "assets/fonts/NotoSansTC-Regular.ttf"
+
+
+class BubbleRaster:
+    """
+    已排版並繪製好的對話泡泡 (與滾輪條)，可直接混合到幀上。
+    位置在每幀依角色位置計算，因此不屬於快取內容。
+    """
+    __slots__ = ("bubble", "scrollbar", "bubble_width", "bubble_height",
+                 "scrollbar_offset_x", "scrollbar_offset_y", "total_lines", "lines_displayed")
+
+    def __init__(self, bubble, scrollbar, bubble_width, bubble_height,
+                 scrollbar_offset_x, scrollbar_offset_y, total_lines, lines_displayed):
+        self.bubble = bubble # PreparedSprite 或 None (沒有可顯示的行)
+        self.scrollbar = scrollbar # PreparedSprite 或 None (內容不需要滾動)
+        self.bubble_width = bubble_width
+        self.bubble_height = bubble_height
+        self.scrollbar_offset_x = scrollbar_offset_x # 滾輪條相對於泡泡左上角的位置
+        self.scrollbar_offset_y = scrollbar_offset_y
+        self.total_lines = total_lines
+        self.lines_displayed = lines_displayed
+
+
+class SpeechBubbleRenderer:
+    text_color = (0, 0, 0, 255)  # 黑色文字 (RGBA)
+    bubble_fill_color = (255, 255, 255, 220)  # 白色半透明背景 (RGBA)
+    bubble_outline_color = (50, 50, 50, 255) # 深灰色邊框 (RGBA)
+    padding = 10
+    line_spacing_pil = 5 # Pillow中文字行間的額外間距
+    character_gap = 15 # 泡泡與角色左緣的距離
+    scrollbar_track_width = 8  # 滾輪條軌道的寬度 (像素)
+    scrollbar_margin_from_bubble = 5 # 滾輪條與泡泡右邊緣的間距 (像素)
+    scrollbar_track_color = (200, 200, 200, 180) # 淺灰色半透明軌道
+    scrollbar_thumb_color = (100, 100, 100, 220) # 深灰色半透明滑塊
+    min_thumb_height = 15 # 滑塊的最小高度 (像素)
+
+    def __init__(self, max_entries=32):
+        """
+        AI 回應對話泡泡的繪製器。字型物件、換行結果與繪製好的泡泡點陣圖都會被快取，
+        以 (文字, 字型, 大小, 畫面尺寸, 滾動偏移, 泡泡比例) 為鍵並以 LRU 限制大小。
+        內容沒有變化的幀只需要一次 (或加上滾輪條共兩次) 的 ROI alpha 混合。
+        :param max_entries: 最多保留的泡泡點陣圖數量。
+        """
+        self.max_entries = max(1, int(max_entries))
+        self._rasters = OrderedDict()
+        self._fonts = {} # (字型路徑, 大小) -> ImageFont 或 None (載入失敗)
+        self._lock = threading.Lock()
+        self._blend_scratch = BlendScratch()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_font(self, font_path, font_size):
+        """取得 (快取的) 字型物件。載入失敗時只警告一次並回傳 None。"""
+        key = (font_path, font_size)
+        if key in self._fonts:
+            return self._fonts[key]
+        try:
+            font = ImageFont.truetype(font_path, font_size)
+        except IOError:
+            print(f"警告：無法載入字型 '{font_path}'。AI回應將不會在畫面上顯示。")
+            print(f"請確認字型檔案存在於 '{os.path.abspath(os.path.dirname(font_path))}' 或修改 font_path。")
+            font = None
+        self._fonts[key] = font
+        return font
+
+    def get_raster(self, text, frame_shape, frame_width, scroll_offset=0,
+                   font_path=DEFAULT_FONT_PATH, font_size=18,
+                   max_bubble_height_ratio=0.48, max_bubble_width_ratio=0.45):
+        """
+        取得 (快取的) 泡泡點陣圖，未命中時才排版與繪製。
+        :return: BubbleRaster，若字型無法載入或文字為空則為 None。
+        """
+        key = (text, font_path, font_size, frame_width, frame_shape[0], frame_shape[1], scroll_offset,
+               max_bubble_height_ratio, max_bubble_width_ratio)
+        with self._lock:
+            raster = self._rasters.get(key)
+            if raster is not None:
+                self._rasters.move_to_end(key)
+                self.hits += 1
+                return raster
+            self.misses += 1
+
+        font = self.get_font(font_path, font_size)
+        if font is None:
+            return None
+        raster = self._build_raster(text, font, font_size, frame_shape, frame_width, scroll_offset,
+                                    max_bubble_height_ratio, max_bubble_width_ratio)
+        with self._lock:
+            self._rasters[key] = raster
+            while len(self._rasters) > self.max_entries:
+                self._rasters.popitem(last=False)
+                self.evictions += 1
+        return raster
+
+    def _text_widths(self, font_size, frame_shape, frame_width, max_bubble_width_ratio):
+        """:return: (泡泡畫布的最大寬度, 文字內容區域的最大寬度)"""
+        bubble_canvas_actual_max_width = frame_shape[1] # 預設為畫面寬度
+        if frame_width > 0 and max_bubble_width_ratio > 0:
+            allowed_w = int(frame_width * max_bubble_width_ratio)
+            # 確保限制後的寬度至少能容納基本的邊距和一點內容
+            min_sensible_canvas_width = 2 * self.padding + font_size # 至少能容納一個字符和邊距
+            bubble_canvas_actual_max_width = max(allowed_w, min_sensible_canvas_width)
+
+        text_content_max_width_px = bubble_canvas_actual_max_width - 2 * self.padding
+        if text_content_max_width_px <= 0: # 如果可用寬度過小
+            text_content_max_width_px = font_size # 至少給一點寬度
+        return bubble_canvas_actual_max_width, text_content_max_width_px
+
+    def line_of_offset(self, text, char_offset, frame_shape, frame_width,
+                       font_path=DEFAULT_FONT_PATH, font_size=18, max_bubble_width_ratio=0.45):
+        """
+        回傳 text 中第 char_offset 個字元排版後所在的行號 (與 get_raster 相同的換行)，
+        用於讓對話泡泡跟著 TTS 的朗讀進度滾動。換行時被略去的空白不計入。
+        :return: 行號 (從 0 開始)；字型無法載入時為 None。
+        """
+        font = self.get_font(font_path, font_size)
+        if font is None or not text:
+            return None
+        _, text_width = self._text_widths(font_size, frame_shape, frame_width, max_bubble_width_ratio)
+        lines = layout_text(text, font, text_width).lines
+        remaining = sum(1 for char in text[:max(0, char_offset)] if not char.isspace())
+        for index, line in enumerate(lines):
+            remaining -= sum(1 for char in line if not char.isspace())
+            if remaining < 0:
+                return index
+        return max(0, len(lines) - 1)
+
+    def _build_raster(self, text, font, font_size, frame_shape, frame_width, scroll_offset,
+                      max_bubble_height_ratio, max_bubble_width_ratio):
+        """排版並以 Pillow 繪製泡泡與滾輪條 (只在快取未命中時執行)。"""
+        padding = self.padding
+        line_spacing_pil = self.line_spacing_pil
+
+        # 1. 確定泡泡畫布的最大寬度 (受 frame_width * max_bubble_width_ratio 限制)
+        #    以及文字內容區域的最大寬度
+        bubble_canvas_actual_max_width, text_content_max_width_px = self._text_widths(
+            font_size, frame_shape, frame_width, max_bubble_width_ratio)
+
+        # 2. 進行基於像素寬度的換行 (字元寬度有快取，且只有變動的段落會重新換行)
+        layout = layout_text(text, font, text_content_max_width_px)
+        all_lines = layout.lines
+        line_heights_pil = layout.line_heights
+        total_lines = len(all_lines)
+        if total_lines == 1 and not all_lines[0] and not text.strip(): # 原始文本為空或僅空白
+            return BubbleRaster(None, None, 0, 0, 0, 0, 0, 0) # 返回0行，避免繪製空泡泡
+
+        # 泡泡的寬度由實際換行後的文字最大寬度決定，且不應超過 bubble_canvas_actual_max_width
+        bubble_width_pil = int(round(layout.max_width)) + 2 * padding
+        bubble_width_pil = min(bubble_width_pil, bubble_canvas_actual_max_width)
+        bubble_width_pil = max(bubble_width_pil, 2 * padding + 1) # 至少1像素內容寬
+
+        # 3. 根據最大泡泡高度和滾動偏移量決定實際顯示的行
+        max_bubble_content_height = frame_shape[0] * max_bubble_height_ratio - (2 * padding)
+        start_line_index = max(0, min(scroll_offset, total_lines - 1))
+        current_bubble_content_height = 0
+        num_lines_displayed = 0
+        for i in range(start_line_index, total_lines):
+            potential_height = current_bubble_content_height + line_heights_pil[i]
+            if num_lines_displayed: # 如果不是第一行，加上行距
+                potential_height += line_spacing_pil
+            if potential_height > max_bubble_content_height:
+                break # 超過最大高度，停止加入行
+            current_bubble_content_height = potential_height
+            num_lines_displayed += 1
+
+        if num_lines_displayed == 0: # 有總行數但沒有行可以顯示 (例如泡泡太小)
+            return BubbleRaster(None, None, 0, 0, 0, 0, total_lines, 0)
+        bubble_height_pil = int(current_bubble_content_height + 2 * padding)
+
+        # 4. 繪製泡泡
+        pil_bubble_image = Image.new("RGBA", (bubble_width_pil, bubble_height_pil), (0, 0, 0, 0)) # 透明背景
+        draw = ImageDraw.Draw(pil_bubble_image)
+        draw.rounded_rectangle([(0, 0), (bubble_width_pil - 1, bubble_height_pil - 1)], radius=8,
+                               fill=self.bubble_fill_color, outline=self.bubble_outline_color, width=1)
+        current_y_pil = padding
+        for i in range(start_line_index, start_line_index + num_lines_displayed):
+            draw.text((padding, current_y_pil), all_lines[i], font=font, fill=self.text_color)
+            current_y_pil += line_heights_pil[i] + line_spacing_pil
+        bubble_sprite = PreparedSprite.from_rgba(np.asarray(pil_bubble_image))
+
+        # 5. 繪製滾輪條：只有在總行數大於實際顯示行數時才需要
+        scrollbar_sprite = None
+        if total_lines > num_lines_displayed:
+            track_height = current_bubble_content_height # 軌道高度等於內容高度
+            thumb_height = track_height * (num_lines_displayed / total_lines)
+            thumb_height = max(thumb_height, self.min_thumb_height) # 確保不小於最小高度
+            thumb_height = min(thumb_height, track_height) # 確保不超過軌道高度
+            max_scroll_offset_lines = total_lines - num_lines_displayed
+            scroll_progress_ratio = min(1.0, scroll_offset / max_scroll_offset_lines) if max_scroll_offset_lines > 0 else 0
+            thumb_y = (track_height - thumb_height) * scroll_progress_ratio
+
+            track_w = self.scrollbar_track_width
+            scrollbar_image = Image.new("RGBA", (track_w + 1, int(track_height) + 1), (0, 0, 0, 0))
+            scrollbar_draw = ImageDraw.Draw(scrollbar_image)
+            scrollbar_draw.rectangle([(0, 0), (track_w, track_height)], fill=self.scrollbar_track_color)
+            scrollbar_draw.rectangle([(0, thumb_y), (track_w, thumb_y + thumb_height)], fill=self.scrollbar_thumb_color)
+            scrollbar_sprite = PreparedSprite.from_rgba(np.asarray(scrollbar_image))
+
+        return BubbleRaster(bubble_sprite, scrollbar_sprite, bubble_width_pil, bubble_height_pil,
+                            bubble_width_pil + self.scrollbar_margin_from_bubble, padding,
+                            total_lines, num_lines_displayed)
+
+    def place(self, raster, frame_shape, char_info):
+        """
+        依角色位置計算泡泡 (角色左側) 與滾輪條在幀上的位置。
+        :return: (泡泡左上角 (x, y), 滾輪條左上角 (x, y) 或 None (放不下或不需要))
+        """
+        frame_h, frame_w = frame_shape[:2]
+        char_x_cv, char_y_cv = char_info['pos']
+        bubble_x = char_x_cv - raster.bubble_width - self.character_gap
+        bubble_y = char_y_cv
+        # 邊界檢查與調整
+        bubble_x = min(max(bubble_x, 0), frame_w - raster.bubble_width)
+        bubble_y = min(max(bubble_y, 0), frame_h - raster.bubble_height)
+        bubble_x, bubble_y = max(0, bubble_x), max(0, bubble_y) # 再次確保不超出左/上邊界
+
+        scrollbar_position = None
+        if raster.scrollbar is not None:
+            track_x = bubble_x + raster.scrollbar_offset_x
+            # 只有在滾輪條完整位於畫面內時才繪製
+            if track_x + self.scrollbar_track_width < frame_w:
+                scrollbar_position = (track_x, bubble_y + raster.scrollbar_offset_y)
+        return (bubble_x, bubble_y), scrollbar_position
+
+    def update_layers(self, bubble_layer, scrollbar_layer, text, frame_shape, char_info, frame_width,
+                      scroll_offset=0, **style):
+        """
+        將泡泡與滾輪條設定到合成器的圖層上 (不直接修改幀)，沒有內容時隱藏圖層。
+        :param bubble_layer: 泡泡的 compositor.Layer。
+        :param scrollbar_layer: 滾輪條的 compositor.Layer。
+        :return: (總行數, 當前顯示的行數)
+        """
+        raster = self.get_raster(text, frame_shape, frame_width, scroll_offset, **style) if text and char_info else None
+        if raster is None or raster.bubble is None:
+            bubble_layer.hide()
+            scrollbar_layer.hide()
+            return (raster.total_lines, 0) if raster is not None else (0, 0)
+        bubble_position, scrollbar_position = self.place(raster, frame_shape, char_info)
+        bubble_layer.set_sprite(raster.bubble, bubble_position)
+        if scrollbar_position is not None:
+            scrollbar_layer.set_sprite(raster.scrollbar, scrollbar_position)
+        else:
+            scrollbar_layer.hide()
+        return raster.total_lines, raster.lines_displayed
+
+    def render(self, frame_cv, text, char_info, frame_width, scroll_offset=0, **style):
+        """
+        將對話泡泡就地混合到幀上。
+        :param frame_cv: OpenCV BGR格式的背景幀 (會被就地修改)。
+        :param text: 要顯示的文字。
+        :param char_info: 包含角色位置和大小的字典 {'pos': (x,y), 'size': (w,h)}。
+        :param frame_width: 攝影機幀的寬度。
+        :param scroll_offset: 目前滾動的起始行號。
+        :param style: font_path, font_size, max_bubble_height_ratio, max_bubble_width_ratio。
+        :return: (總行數, 當前顯示的行數)
+        """
+        if not text or not char_info:
+            return 0, 0
+        raster = self.get_raster(text, frame_cv.shape, frame_width, scroll_offset, **style)
+        if raster is None or raster.bubble is None:
+            return (raster.total_lines, 0) if raster is not None else (0, 0)
+        bubble_position, scrollbar_position = self.place(raster, frame_cv.shape, char_info)
+        blend_premultiplied(frame_cv, raster.bubble, bubble_position, self._blend_scratch)
+        if scrollbar_position is not None:
+            blend_premultiplied(frame_cv, raster.scrollbar, scrollbar_position, self._blend_scratch)
+        return raster.total_lines, raster.lines_displayed
+
+    @property
+    def stats(self):
+        """回傳快取統計：命中、未命中、淘汰次數與目前項目數。"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._rasters)}
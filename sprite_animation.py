@@ -0,0 +1,142 @@
+# sprite_animation.py
+import bisect
+import time
+import numpy as np
+
+from startup import lazy_import
+from image_blend import PreparedSprite
+
+Image = lazy_import("PIL.Image") # 第一次解碼圖像時才載入 Pillow
+
+
+class SpriteAnimation:
+    """
+    由 sprite sheet (等距格狀) 或 atlas (任意矩形) 解碼而成的動畫。
+    所有幀在載入時一次解碼並縮放到相同尺寸，存放在連續的陣列中：
+    premul_frames 為 (N, h, w, 3) uint16，inv_alpha_frames 為 (N, h, w, 1) uint16。
+    每一幀的 PreparedSprite 都是這些陣列的視圖，播放時依時間挑選，不需要配置記憶體。
+    """
+
+    def __init__(self, name, rgba_frames, durations_ms, loop=True):
+        """
+        :param name: 動畫名稱 (用於訊息)。
+        :param rgba_frames: (N, h, w, 4) uint8 的 RGBA 幀陣列。
+        :param durations_ms: 每一幀的顯示時間 (毫秒) 列表，長度為 N。
+        :param loop: 是否循環播放。否則停在最後一幀。
+        """
+        if len(rgba_frames) == 0:
+            raise ValueError(f"動畫 '{name}' 沒有任何幀。")
+        if len(durations_ms) != len(rgba_frames):
+            raise ValueError(f"動畫 '{name}' 的幀數 ({len(rgba_frames)}) 與時間設定數量 ({len(durations_ms)}) 不一致。")
+        self.name = name
+        self.loop = loop
+        frame_count, height, width = rgba_frames.shape[:3]
+        self.width, self.height = width, height
+
+        alpha = rgba_frames[:, :, :, 3:4].astype(np.uint16)
+        self.premul_frames = np.ascontiguousarray(rgba_frames[:, :, :, 2::-1], dtype=np.uint16) # RGB -> BGR
+        self.premul_frames *= alpha
+        self.inv_alpha_frames = 255 - alpha
+        self.frames = [PreparedSprite(self.premul_frames[i], self.inv_alpha_frames[i], width, height)
+                       for i in range(frame_count)]
+
+        # 累積結束時間 (毫秒)，用二分搜尋依經過時間找出目前的幀
+        self._frame_end_ms = []
+        total = 0.0
+        for duration in durations_ms:
+            total += max(1.0, float(duration))
+            self._frame_end_ms.append(total)
+        self.total_ms = total
+        self._start_time = time.monotonic()
+
+    def restart(self, now=None):
+        """從第一幀重新開始播放。"""
+        self._start_time = time.monotonic() if now is None else now
+
+    def frame_index_at(self, now=None):
+        """依牆上時間計算目前應顯示的幀索引。"""
+        now = time.monotonic() if now is None else now
+        elapsed_ms = (now - self._start_time) * 1000.0
+        if self.loop:
+            elapsed_ms %= self.total_ms
+        elif elapsed_ms >= self.total_ms:
+            return len(self.frames) - 1
+        return min(bisect.bisect_right(self._frame_end_ms, elapsed_ms), len(self.frames) - 1)
+
+    def sprite_at(self, now=None):
+        """回傳目前應顯示的幀 (PreparedSprite，為連續陣列的視圖)。"""
+        return self.frames[self.frame_index_at(now)]
+
+    @classmethod
+    def from_definition(cls, name, definition, target_height=None):
+        """
+        依 config.json 中的動畫定義建立動畫。
+        格狀 sprite sheet：{"sheet": 路徑, "frame_width": w, "frame_height": h, "columns": c, "frame_count": n, "fps": 8}
+        atlas：{"atlas": 路徑, "frames": [[x, y, w, h], ...], "durations_ms": [120, 80, ...]}
+        時間可用 "fps" (每幀相同) 或 "durations_ms" (每幀各自設定) 指定；"loop" 預設為 true。
+        :param name: 動畫名稱 (通常為狀態名稱，例如 "idle")。
+        :param definition: 動畫定義字典。
+        :param target_height: (可選) 縮放後的幀高度 (像素)。
+        """
+        sheet_path = definition.get("sheet") or definition.get("atlas")
+        if not sheet_path:
+            raise ValueError(f"動畫 '{name}' 缺少 'sheet' 或 'atlas' 設定。")
+        with Image.open(sheet_path) as sheet_image:
+            sheet = sheet_image.convert("RGBA")
+
+        if "frames" in definition: # atlas：任意矩形
+            rects = [tuple(int(v) for v in rect) for rect in definition["frames"]]
+        else: # 等距格狀 sprite sheet
+            frame_w = int(definition["frame_width"])
+            frame_h = int(definition["frame_height"])
+            columns = int(definition.get("columns") or max(1, sheet.width // frame_w))
+            rows = max(1, sheet.height // frame_h)
+            frame_count = int(definition.get("frame_count") or columns * rows)
+            rects = [((i % columns) * frame_w, (i // columns) * frame_h, frame_w, frame_h) for i in range(frame_count)]
+
+        if "durations_ms" in definition:
+            durations_ms = list(definition["durations_ms"])
+        else:
+            fps = float(definition.get("fps", 8))
+            durations_ms = [1000.0 / fps] * len(rects)
+
+        # 以第一幀決定縮放比例，所有幀使用相同比例，並置於共同畫布 (底部置中對齊)
+        scale = 1.0
+        if target_height and rects and rects[0][3] > 0:
+            scale = target_height / rects[0][3]
+        scaled_frames = []
+        for x, y, w, h in rects:
+            frame = sheet.crop((x, y, x + w, y + h))
+            new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            if new_size != frame.size:
+                frame = frame.resize(new_size, Image.LANCZOS)
+            scaled_frames.append(frame)
+        canvas_w = max(frame.width for frame in scaled_frames)
+        canvas_h = max(frame.height for frame in scaled_frames)
+        rgba_frames = np.zeros((len(scaled_frames), canvas_h, canvas_w, 4), dtype=np.uint8)
+        for i, frame in enumerate(scaled_frames):
+            x0 = (canvas_w - frame.width) // 2
+            y0 = canvas_h - frame.height
+            rgba_frames[i, y0:y0 + frame.height, x0:x0 + frame.width] = np.asarray(frame)
+
+        animation = cls(name, rgba_frames, durations_ms, loop=definition.get("loop", True))
+        print(f"動畫 '{name}' 已載入: {len(rects)} 幀, {canvas_w}x{canvas_h}, 總長 {animation.total_ms:.0f} 毫秒")
+        return animation
+
+
+def load_personality_animations(personality, target_height=None):
+    """
+    載入個性設定中 "animations" 區塊定義的所有狀態動畫 (載入失敗的會被略過並警告)。
+    :param personality: config.json 中單一個性的設定字典。
+    :param target_height: 角色的目標高度。
+    :return: {狀態名稱: SpriteAnimation}
+    """
+    animations = {}
+    for state_name, definition in (personality.get("animations") or {}).items():
+        try:
+            animations[state_name] = SpriteAnimation.from_definition(state_name, definition, target_height)
+        except FileNotFoundError:
+            print(f"警告：找不到狀態 '{state_name}' 的動畫圖檔，將使用靜態圖像。")
+        except Exception as e:
+            print(f"警告：載入狀態 '{state_name}' 的動畫時發生錯誤: {e}，將使用靜態圖像。")
+    return animations
@@ -0,0 +1,153 @@
+# sprite_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from startup import lazy_import
+from image_blend import PreparedSprite
+
+Image = lazy_import("PIL.Image") # 第一次解碼圖像時才載入 Pillow
+
+
+class CachedSprite:
+    """已載入並縮放好的疊加圖：保留 Pillow RGBA 圖像與可直接混合的 PreparedSprite。"""
+    __slots__ = ("image_path", "image_pil", "sprite", "width", "height")
+
+    def __init__(self, image_path, image_pil, sprite):
+        self.image_path = image_path
+        self.image_pil = image_pil
+        self.sprite = sprite
+        self.width, self.height = image_pil.size
+
+
+def load_scaled_rgba(image_path, target_height=None):
+    """
+    載入圖像並轉為 RGBA，若指定 target_height 則以 LANCZOS 等比例縮放。
+    :param image_path: 圖像檔案路徑。
+    :param target_height: (可選) 期望的高度 (像素)。
+    :return: Pillow RGBA 圖像。
+    """
+    with Image.open(image_path) as original_pil_image:
+        image_pil = original_pil_image.convert("RGBA")
+    if target_height is not None and target_height > 0:
+        original_width, original_height = image_pil.size
+        if original_height == 0: # 避免除以零
+            print(f"警告：疊加圖像 '{image_path}' 原始高度為0，無法調整大小。")
+        else:
+            aspect_ratio = original_width / original_height
+            new_height = int(target_height)
+            new_width = int(new_height * aspect_ratio)
+            if new_width > 0 and new_height > 0:
+                print(f"將疊加圖像 '{image_path}' 從 {original_width}x{original_height} 調整為 {new_width}x{new_height}")
+                image_pil = image_pil.resize((new_width, new_height), Image.LANCZOS) # 使用高品質縮放
+            else:
+                print(f"警告：計算出的疊加圖像新尺寸 ({new_width}x{new_height}) 無效，不進行調整大小。")
+    return image_pil
+
+
+class SpriteCache:
+    def __init__(self, max_entries=32, revalidate_interval_s=2.0):
+        """
+        以 (路徑, 目標高度, 檔案修改時間) 為鍵、LRU 限制大小的疊加圖快取。
+        命中時只需字典查詢，不需讀檔、解碼或重新縮放。
+        :param max_entries: 最多保留的疊加圖數量。
+        :param revalidate_interval_s: 同一路徑至少隔多久才重新檢查檔案修改時間 (秒)，其間直接使用記住的值。
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.revalidate_interval_s = revalidate_interval_s
+        self._entries = OrderedDict()
+        self._file_states = {} # 絕對路徑 -> (修改時間或 None, 上次檢查的 time.monotonic())
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _file_mtime(self, abs_path):
+        """回傳檔案修改時間 (不存在時為 None)，在 revalidate_interval_s 內重複使用上次的檢查結果。"""
+        now = time.monotonic()
+        state = self._file_states.get(abs_path)
+        if state is not None and now - state[1] < self.revalidate_interval_s:
+            return state[0]
+        try:
+            mtime = os.stat(abs_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        self._file_states[abs_path] = (mtime, now)
+        return mtime
+
+    def is_available(self, image_path):
+        """檢查圖像檔案是否存在 (與快取共用檢查結果，可取代每幀的 os.path.exists)。"""
+        with self._lock:
+            return self._file_mtime(os.path.abspath(image_path)) is not None
+
+    def get(self, image_path, target_height=None):
+        """
+        取得縮放好的疊加圖，未命中時才載入。
+        :param image_path: 圖像檔案路徑。
+        :param target_height: (可選) 期望的高度 (像素)。
+        :return: CachedSprite
+        :raises FileNotFoundError: 檔案不存在。
+        """
+        abs_path = os.path.abspath(image_path)
+        with self._lock:
+            mtime = self._file_mtime(abs_path)
+            if mtime is None:
+                raise FileNotFoundError(f"疊加圖像檔案未找到: {image_path}")
+            key = (abs_path, target_height, mtime)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # 在鎖外載入，避免阻塞其他執行緒的快取命中
+        image_pil = load_scaled_rgba(image_path, target_height)
+        entry = CachedSprite(image_path, image_pil, PreparedSprite.from_rgba(np.asarray(image_pil)))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def preload(self, image_paths, target_height=None):
+        """
+        預先載入並縮放多張圖像 (不存在的檔案會被略過並警告)。
+        :return: 成功載入的數量。
+        """
+        loaded = 0
+        for image_path in dict.fromkeys(image_paths): # 去除重複並保留順序
+            try:
+                self.get(image_path, target_height)
+                loaded += 1
+            except FileNotFoundError:
+                print(f"警告：預先載入時找不到疊加圖像 '{image_path}'，已略過。")
+            except Exception as e:
+                print(f"警告：預先載入疊加圖像 '{image_path}' 時發生錯誤: {e}")
+        return loaded
+
+    def preload_personalities(self, config, target_height=None):
+        """
+        預先載入 config.json 的 personalities 區塊中引用的所有狀態圖像 (*_image)。
+        :param config: 已載入的設定字典。
+        :param target_height: 角色的目標高度。
+        :return: 成功載入的數量。
+        """
+        image_paths = []
+        for personality in (config or {}).get("personalities", {}).values():
+            for key, value in personality.items():
+                if key.endswith("_image") and isinstance(value, str):
+                    image_paths.append(value)
+        loaded = self.preload(image_paths, target_height)
+        print(f"已預先載入 {loaded} 張角色狀態圖像。快取統計: {self.stats}")
+        return loaded
+
+    @property
+    def stats(self):
+        """回傳快取統計：命中、未命中、淘汰次數與目前項目數。"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
@@ -0,0 +1,173 @@
+# startup.py
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class StartupReport:
+    def __init__(self):
+        """記錄啟動過程中各元件 (與延遲匯入的模組) 的開始時間、耗時與結果，用於找出啟動瓶頸。"""
+        self.t0 = time.perf_counter()
+        self.entries = [] # (名稱, 開始時間 (相對 t0), 耗時, 執行緒名稱, 結果)
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, status="ok"):
+        with self._lock:
+            self.entries.append((name, start - self.t0, duration, threading.current_thread().name, status))
+
+    @contextmanager
+    def measure(self, name):
+        """以 with 區塊計時一個步驟，發生例外時記錄為失敗並重新拋出。"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.add(name, start, time.perf_counter() - start, f"失敗: {e}")
+            raise
+        self.add(name, start, time.perf_counter() - start)
+
+    def mark(self, name):
+        """記錄一個時間點 (例如第一幀顯示)。"""
+        now = time.perf_counter()
+        self.add(name, now, 0.0)
+
+    def format(self):
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry[1])
+        lines = ["啟動時間報告 (秒，從 run_app 開始):", f"  {'元件':<24}{'開始':>8}{'耗時':>8}  {'執行緒':<16}結果"]
+        for name, start, duration, thread_name, status in entries:
+            lines.append(f"  {name:<24}{start:>8.3f}{duration:>8.3f}  {thread_name:<16}{status}")
+        return "\n".join(lines)
+
+
+# 延遲匯入的耗時也記錄到目前的啟動報告 (由 ComponentLoader 設定)
+_active_report = None
+
+
+class LazyModule:
+    """
+    延遲匯入的模組代理：第一次存取屬性時才真正匯入 (執行緒安全)，
+    讓 mediapipe、google.generativeai、pyttsx3 等較重的模組不會拖慢程式啟動。
+    用法：sr = lazy_import("speech_recognition")，之後與一般模組相同 (sr.Recognizer())。
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is not None:
+            return module
+        with self.__dict__["_lock"]:
+            module = self.__dict__["_module"]
+            if module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                if _active_report is not None:
+                    _active_report.add(f"import {self._name}", start, time.perf_counter() - start)
+                self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        state = "已載入" if self.__dict__["_module"] is not None else "尚未載入"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_import(name):
+    """回傳延遲匯入的模組代理 (見 LazyModule)。"""
+    return LazyModule(name)
+
+
+class ComponentLoader:
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, report=None, max_workers=4):
+        """
+        在執行緒池中平行初始化彼此獨立的元件 (偵測器、語言模型、TTS 等)，讓主執行緒可以先開啟攝影機並顯示畫面。
+        元件完成後由主執行緒呼叫 poll() 取得，因此元件變數只會在主執行緒中被指定。
+        :param report: (可選) StartupReport，記錄各元件的耗時。
+        :param max_workers: 同時初始化的元件數量。
+        """
+        global _active_report
+        self.report = report or StartupReport()
+        _active_report = self.report
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="Startup")
+        self._futures = {} # 元件名稱 -> Future
+        self._delivered = set() # 已由 poll() 交給主執行緒的元件
+        self.errors = {} # 元件名稱 -> 例外
+
+    def start(self, name, factory, depends_on=()):
+        """
+        開始在背景初始化元件。
+        :param factory: factory(*依賴元件) -> 元件，在背景執行緒中執行。
+        :param depends_on: 依賴的元件名稱 (需先以 start() 提交)，其結果會依序傳給 factory。
+        """
+        dependencies = [self._futures[dependency] for dependency in depends_on]
+
+        def run():
+            values = [future.result() for future in dependencies] # 依賴失敗時這個元件也視為失敗
+            with self.report.measure(name):
+                return factory(*values)
+        self._futures[name] = self._pool.submit(run)
+
+    def status(self, name):
+        future = self._futures.get(name)
+        if future is None or not future.done():
+            return self.LOADING
+        return self.FAILED if future.exception() is not None else self.READY
+
+    def statuses(self):
+        return {name: self.status(name) for name in self._futures}
+
+    def pending(self):
+        return any(not future.done() for future in self._futures.values())
+
+    def poll(self):
+        """
+        (主執行緒) 取得剛完成初始化的元件。失敗的元件只印出一次錯誤，不會回傳。
+        :return: [(名稱, 元件), ...]
+        """
+        finished = []
+        for name, future in self._futures.items():
+            if name in self._delivered or not future.done():
+                continue
+            self._delivered.add(name)
+            error = future.exception()
+            if error is not None:
+                self.errors[name] = error
+                print(f"元件 '{name}' 初始化失敗: {error}")
+            else:
+                finished.append((name, future.result()))
+        return finished
+
+    def shutdown(self, cleanup=None, timeout_s=5.0):
+        """
+        結束時呼叫：等待仍在初始化的元件 (最多 timeout_s 秒)，並對尚未交給主執行緒的元件呼叫 cleanup(名稱, 元件)，
+        避免在程式結束後才完成的元件留下執行緒或裝置。
+        """
+        global _active_report
+        deadline = time.monotonic() + timeout_s
+        for name, future in self._futures.items():
+            if name in self._delivered:
+                continue
+            try:
+                component = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception:
+                continue # 初始化失敗或逾時
+            if cleanup:
+                cleanup(name, component)
+        self._pool.shutdown(wait=False)
+        if _active_report is self.report:
+            _active_report = None
@@ -0,0 +1,261 @@
+# text_layout.py
+import threading
+
+# 不可出現在行首的標點 (行首禁則)：遇到時把上一個字一起帶到下一行
+_NO_LINE_START = set("，。、；：！？）」』】》〉,.;:!?)]}%…・ー々")
+
+_glyph_caches = {}
+_line_breakers = {}
+_glyph_caches_lock = threading.Lock()
+_line_breakers_lock = threading.Lock()
+_MAX_LINE_BREAKERS = 16
+
+
+def _is_cjk(char):
+    """判斷字元是否為可在任意字元間換行的 CJK 字元 (漢字、假名、韓文、全形符號)。"""
+    code = ord(char)
+    return (0x2E80 <= code <= 0x9FFF      # CJK 部首、標點、假名、漢字
+            or 0xAC00 <= code <= 0xD7AF   # 韓文音節
+            or 0xF900 <= code <= 0xFAFF   # CJK 相容漢字
+            or 0xFE30 <= code <= 0xFE4F   # CJK 相容形式
+            or 0xFF00 <= code <= 0xFFEF   # 全形/半形字元
+            or 0x20000 <= code <= 0x3FFFF) # CJK 擴充區
+
+
+class GlyphMetrics:
+    """
+    單一字型的字元度量快取：字元 -> (前進寬度, 墨跡頂端, 墨跡底端)。
+    每個字元只向 FreeType 查詢一次，之後的換行與行高計算只需字典查詢。
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self._metrics = {}
+        self._has_getlength = hasattr(font, "getlength") # Pillow 8+
+
+    def get(self, char):
+        metrics = self._metrics.get(char)
+        if metrics is None:
+            metrics = self._measure(char)
+            self._metrics[char] = metrics
+        return metrics
+
+    def _measure(self, char):
+        font = self.font
+        if self._has_getlength:
+            advance = font.getlength(char)
+        else:
+            advance = font.getsize(char)[0]
+        try: # Pillow 10+
+            bbox = font.getbbox(char)
+            top, bottom = (bbox[1], bbox[3]) if bbox else (0, 0)
+        except AttributeError: # Older Pillow
+            top, bottom = 0, font.getsize(char)[1]
+        if bottom <= top: # 空白等沒有墨跡的字元不影響行高
+            top, bottom = None, None
+        return advance, top, bottom
+
+    def advance(self, char):
+        return self.get(char)[0]
+
+    def line_height(self, line_text):
+        """與 font.getbbox(line) 的高度相同：所有字元墨跡的最低底端減去最高頂端 (沒有墨跡時為 0)。"""
+        top, bottom = None, None
+        for char in line_text:
+            _, char_top, char_bottom = self.get(char)
+            if char_top is None:
+                continue
+            if top is None or char_top < top: top = char_top
+            if bottom is None or char_bottom > bottom: bottom = char_bottom
+        return 0 if top is None else bottom - top
+
+    def __len__(self):
+        return len(self._metrics)
+
+
+def _font_key(font):
+    key = (getattr(font, "path", None), getattr(font, "size", None), getattr(font, "index", 0))
+    if key[0] is None: # 沒有路徑資訊的字型只能以物件本身區分
+        key = id(font)
+    return key
+
+
+def get_glyph_metrics(font):
+    """
+    取得字型的字元度量快取。以 (字型檔路徑, 字型大小) 為鍵，同一字型重新載入後仍可共用。
+    :param font: Pillow 的 FreeTypeFont (或任何有 getbbox/getlength 的字型物件)。
+    :return: GlyphMetrics
+    """
+    key = _font_key(font)
+    with _glyph_caches_lock:
+        metrics = _glyph_caches.get(key)
+        if metrics is None:
+            metrics = GlyphMetrics(font)
+            _glyph_caches[key] = metrics
+        return metrics
+
+
+class TextLayout:
+    """換行結果：每一行的文字、寬度與高度，以及最寬一行的寬度。"""
+    __slots__ = ("lines", "line_widths", "line_heights", "max_width")
+
+    def __init__(self, lines, line_widths, line_heights):
+        self.lines = lines
+        self.line_widths = line_widths
+        self.line_heights = line_heights
+        self.max_width = max(line_widths) if line_widths else 0
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class LineBreaker:
+    def __init__(self, font, max_width):
+        """
+        以字元度量快取進行線性時間的中英文混合換行。
+        英文以空白分隔的單字為單位換行 (單字比整行還寬時才逐字元切開)，CJK 字元之間可任意換行，
+        並套用簡單的行首禁則。文字以 '\\n' 分段，只有內容變動的段落會重新換行，
+        因此串流中逐步變長的回應只需處理最後一段。
+        :param font: Pillow 字型物件。
+        :param max_width: 每行文字的最大寬度 (像素)。
+        """
+        self.metrics = get_glyph_metrics(font)
+        self.max_width = max(1, max_width)
+        self._paragraph_cache = [] # [(段落文字, 行列表, 寬度列表), ...]，依段落順序
+        self.lock = threading.Lock()
+
+    def layout(self, text):
+        """
+        將文字換行。空白段落 (最後一段除外) 會保留為空行。
+        :param text: 要換行的文字。
+        :return: TextLayout (至少包含一行)。
+        """
+        paragraphs = text.split('\n')
+        cache = self._paragraph_cache
+        new_cache = []
+        lines, widths = [], []
+        for para_idx, paragraph in enumerate(paragraphs):
+            if para_idx < len(cache) and cache[para_idx][0] == paragraph:
+                entry = cache[para_idx]
+            else:
+                entry = (paragraph,) + self._break_paragraph(paragraph)
+            new_cache.append(entry)
+            if not paragraph.strip():
+                if para_idx < len(paragraphs) - 1:
+                    lines.append("")
+                    widths.append(0)
+                continue
+            lines.extend(entry[1])
+            widths.extend(entry[2])
+        self._paragraph_cache = new_cache
+
+        if not lines:
+            lines, widths = [""], [0]
+        heights = [self.metrics.line_height(line) for line in lines]
+        return TextLayout(lines, widths, heights)
+
+    def _break_paragraph(self, paragraph):
+        """貪婪換行單一段落。回傳 (行列表, 寬度列表)。"""
+        if not paragraph.strip():
+            return [], []
+        advance = self.metrics.advance
+        max_width = self.max_width
+        space_w = advance(" ")
+        lines, widths = [], []
+        line_chars, line_w = [], 0.0
+        pending_space = False
+
+        def flush():
+            nonlocal line_chars, line_w
+            if line_chars:
+                lines.append("".join(line_chars))
+                widths.append(line_w)
+            line_chars, line_w = [], 0.0
+
+        length = len(paragraph)
+        i = 0
+        while i < length:
+            char = paragraph[i]
+            if char == ' ' or char == '\t':
+                pending_space = bool(line_chars) # 連續空白只保留一個，行首空白捨去
+                i += 1
+                continue
+
+            # 取出下一個不可分割的單位：一個 CJK 字元，或一段連續的非 CJK 單字
+            if _is_cjk(char):
+                unit_end = i + 1
+            else:
+                unit_end = i + 1
+                while unit_end < length and paragraph[unit_end] not in ' \t' and not _is_cjk(paragraph[unit_end]):
+                    unit_end += 1
+            unit = paragraph[i:unit_end]
+            unit_w = 0.0
+            for unit_char in unit:
+                unit_w += advance(unit_char)
+            i = unit_end
+
+            separator_w = space_w if pending_space else 0.0
+            if line_w + separator_w + unit_w <= max_width:
+                if pending_space:
+                    line_chars.append(" ")
+                line_chars.append(unit)
+                line_w += separator_w + unit_w
+                pending_space = False
+                continue
+
+            pending_space = False
+            carried = None
+            if unit[0] in _NO_LINE_START and len(line_chars) > 1 and len(line_chars[-1]) == 1 and _is_cjk(line_chars[-1]):
+                # 行首禁則：標點不能出現在行首，把上一個字一起帶到下一行
+                carried = line_chars.pop()
+                line_w -= advance(carried)
+                if line_chars and line_chars[-1] == " ":
+                    line_chars.pop()
+                    line_w -= space_w
+            flush()
+            if carried is not None:
+                line_chars.append(carried)
+                line_w = advance(carried)
+
+            if line_w + unit_w <= max_width:
+                line_chars.append(unit)
+                line_w += unit_w
+                continue
+            # 單字本身比整行還寬：逐字元切開
+            for unit_char in unit:
+                char_w = advance(unit_char)
+                if line_chars and line_w + char_w > max_width:
+                    flush()
+                line_chars.append(unit_char)
+                line_w += char_w
+        flush()
+        return lines, widths
+
+
+def get_line_breaker(font, max_width):
+    """
+    取得 (字型, 行寬) 共用的 LineBreaker，讓逐步變長的文字可以重複使用未變動段落的換行結果。
+    :return: LineBreaker
+    """
+    key = (_font_key(font), max_width)
+    with _line_breakers_lock:
+        breaker = _line_breakers.get(key)
+        if breaker is None:
+            if len(_line_breakers) >= _MAX_LINE_BREAKERS:
+                _line_breakers.clear()
+            breaker = LineBreaker(font, max_width)
+            _line_breakers[key] = breaker
+        return breaker
+
+
+def layout_text(text, font, max_width):
+    """
+    以字元度量快取換行一段文字。
+    :param text: 要換行的文字。
+    :param font: Pillow 字型物件。
+    :param max_width: 每行文字的最大寬度 (像素)。
+    :return: TextLayout
+    """
+    breaker = get_line_breaker(font, max_width)
+    with breaker.lock:
+        return breaker.layout(text)
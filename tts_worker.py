@@ -0,0 +1,265 @@
+# tts_worker.py
+import itertools
+import queue
+import threading
+
+from sentence_stream import SentenceSplitter
+
+PRIORITY_HIGH = 0 # 系統提示等需要立即播放的內容
+PRIORITY_NORMAL = 1 # AI 回應
+PRIORITY_LOW = 2 # 可以被任何內容打斷的閒聊
+
+
+class Utterance:
+    """
+    一次要朗讀的內容 (例如一則 AI 回應)，由 TTSWorker.begin_utterance() 建立。
+    串流回應可以一邊生成一邊以 add() 加入句子，最後呼叫 close()；cancel() 會跳過尚未朗讀的句子並中斷目前的句子。
+    """
+
+    def __init__(self, worker, utterance_id, priority):
+        self.utterance_id = utterance_id
+        self.priority = priority
+        self.sentences = [] # 已加入的句子 (依序)
+        self.spoken = 0 # 已完整朗讀的句子數
+        self.closed = False # 不會再加入句子
+        self.cancel_reason = None # None 或 "interrupted"、"barge_in"、"shutdown" 等
+        self.finished = False # 已送出 utterance_end 事件
+        self._pending = 0 # 已加入、尚未朗讀或跳過的句子數
+        self._worker = worker
+
+    @property
+    def cancelled(self):
+        return self.cancel_reason is not None
+
+    def add(self, sentence):
+        """加入一個要朗讀的句子；已關閉或已取消時忽略。:return: 是否已加入。"""
+        return self._worker._add(self, sentence)
+
+    def close(self):
+        """不再加入句子：朗讀完已加入的句子後結束。"""
+        self._worker._close(self)
+
+    def cancel(self, reason="cancelled"):
+        """取消：跳過尚未朗讀的句子，正在朗讀的句子會在下一個字中斷。"""
+        self._worker._cancel(self, reason)
+
+
+class TTSWorker:
+    def __init__(self, engine_factory, on_sentence_start=None, on_sentence_end=None, on_utterance_end=None,
+                 ready_timeout_s=10.0):
+        """
+        常駐的 TTS 執行緒：擁有唯一的 pyttsx3 引擎 (在同一個執行緒中建立與使用)，依優先順序朗讀句子佇列。
+        新的內容可以搶先打斷舊的內容 (interrupt)，使用者開始說話時可以立即停止朗讀 (barge_in)。
+        句子開始/結束與整段結束的事件由主執行緒呼叫 poll() 時觸發回呼，因此回呼中可以直接修改畫面狀態。
+        :param engine_factory: engine_factory() -> pyttsx3 引擎 (在 TTS 執行緒中呼叫)。
+        :param on_sentence_start: (可選) on_sentence_start(utterance, index, sentence)。
+        :param on_sentence_end: (可選) on_sentence_end(utterance, index, sentence, interrupted)。
+        :param on_utterance_end: (可選) on_utterance_end(utterance)，utterance.cancelled 表示被打斷。
+        :param ready_timeout_s: start() 等待引擎建立的最長時間 (秒)。
+        """
+        self.engine_factory = engine_factory
+        self.on_sentence_start = on_sentence_start
+        self.on_sentence_end = on_sentence_end
+        self.on_utterance_end = on_utterance_end
+        self.ready_timeout_s = ready_timeout_s
+        self._queue = queue.PriorityQueue() # (優先順序, 序號, utterance, 句子索引)
+        self._events = queue.Queue() # (事件, 參數)，由 poll() 在主執行緒中處理
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._active = [] # 尚未結束的 utterance
+        self._current = None # 正在朗讀的 utterance
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._startup_error = None
+        self._engine = None
+        self._thread = None
+        self.counters = {"utterances": 0, "sentences": 0, "interrupted_sentences": 0, "skipped_sentences": 0,
+                         "preemptions": 0, "barge_ins": 0}
+
+    def start(self):
+        """啟動 TTS 執行緒並等待引擎建立完成。:raises RuntimeError: 引擎無法建立。"""
+        self._thread = threading.Thread(target=self._run, name="TTSWorker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(self.ready_timeout_s):
+            raise RuntimeError(f"TTS 引擎在 {self.ready_timeout_s} 秒內沒有完成初始化。")
+        if self._startup_error is not None:
+            raise RuntimeError(f"無法初始化 TTS 引擎: {self._startup_error}") from self._startup_error
+        return self
+
+    # --- 提交與中斷 (任何執行緒) ---
+
+    def begin_utterance(self, priority=PRIORITY_NORMAL, interrupt=True):
+        """
+        開始一段新的朗讀內容。
+        :param priority: PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW；優先順序較高的句子會先朗讀。
+        :param interrupt: 是否打斷重要性相同或較低的內容 (例如新的回應取代舊的回應)。
+        :return: Utterance
+        """
+        with self._lock:
+            utterance = Utterance(self, next(self._ids), priority)
+            self.counters["utterances"] += 1
+            if interrupt:
+                victims = [u for u in self._active if u.priority >= priority and not u.cancelled]
+                if victims:
+                    self.counters["preemptions"] += 1
+                for victim in victims:
+                    self._cancel_locked(victim, "interrupted")
+            self._active.append(utterance)
+        return utterance
+
+    def say(self, text, priority=PRIORITY_NORMAL, interrupt=True):
+        """朗讀一段完整的文字 (切成句子以觸發句子事件)。:return: Utterance"""
+        utterance = self.begin_utterance(priority, interrupt)
+        splitter = SentenceSplitter()
+        for sentence in splitter.feed(text):
+            utterance.add(sentence)
+        remainder = splitter.flush()
+        if remainder:
+            utterance.add(remainder)
+        utterance.close()
+        return utterance
+
+    def interrupt(self, priority=PRIORITY_HIGH, reason="interrupted"):
+        """打斷重要性等於或低於 priority 的所有內容 (預設為全部)。:return: 被打斷的數量。"""
+        with self._lock:
+            victims = [u for u in self._active if u.priority >= priority and not u.cancelled]
+            for victim in victims:
+                self._cancel_locked(victim, reason)
+        return len(victims)
+
+    def barge_in(self):
+        """使用者開始說話：立即停止所有朗讀。:return: 是否有內容被打斷。"""
+        interrupted = self.interrupt(reason="barge_in")
+        if interrupted:
+            with self._lock:
+                self.counters["barge_ins"] += 1
+        return interrupted > 0
+
+    def is_speaking(self):
+        """是否還有尚未結束、也沒有被打斷的朗讀內容 (包含排隊中的)。"""
+        with self._lock:
+            return any(not u.cancelled for u in self._active)
+
+    def _add(self, utterance, sentence):
+        sentence = sentence.strip() if sentence else ""
+        with self._lock:
+            if not sentence or utterance.closed or utterance.cancelled:
+                return False
+            index = len(utterance.sentences)
+            utterance.sentences.append(sentence)
+            utterance._pending += 1
+            self._queue.put((utterance.priority, next(self._seq), utterance, index))
+        return True
+
+    def _close(self, utterance):
+        with self._lock:
+            utterance.closed = True
+            self._finish_if_done_locked(utterance)
+
+    def _cancel(self, utterance, reason):
+        with self._lock:
+            self._cancel_locked(utterance, reason)
+
+    def _cancel_locked(self, utterance, reason):
+        """(需持有鎖) 排隊中的句子在取出時跳過；正在朗讀的句子由引擎的 started-word 回呼停止。"""
+        if utterance.finished or utterance.cancelled:
+            return
+        utterance.cancel_reason = reason
+        utterance.closed = True
+        self._finish_if_done_locked(utterance)
+
+    def _finish_if_done_locked(self, utterance):
+        if utterance.finished or not utterance.closed or utterance._pending > 0:
+            return
+        utterance.finished = True
+        if utterance in self._active:
+            self._active.remove(utterance)
+        self._events.put(("utterance_end", (utterance,)))
+
+    # --- TTS 執行緒 ---
+
+    def _run(self):
+        try:
+            self._engine = self.engine_factory()
+            self._engine.connect('started-word', self._on_word)
+        except Exception as e:
+            self._startup_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            _, _, utterance, index = self._queue.get()
+            if utterance is None: # stop()
+                break
+            with self._lock:
+                skip = utterance.cancelled
+                if skip:
+                    self.counters["skipped_sentences"] += 1
+                else:
+                    self._current = utterance
+            if not skip:
+                self._speak(utterance, index)
+            with self._lock:
+                self._current = None
+                utterance._pending -= 1
+                self._finish_if_done_locked(utterance)
+
+    def _speak(self, utterance, index):
+        sentence = utterance.sentences[index]
+        self._events.put(("sentence_start", (utterance, index, sentence)))
+        try:
+            self._engine.say(sentence)
+            self._engine.runAndWait()
+        except Exception as e:
+            print(f"TTS朗讀執行緒中發生錯誤: {e}")
+        interrupted = utterance.cancelled
+        with self._lock:
+            if interrupted:
+                self.counters["interrupted_sentences"] += 1
+            else:
+                utterance.spoken += 1
+                self.counters["sentences"] += 1
+        self._events.put(("sentence_end", (utterance, index, sentence, interrupted)))
+
+    def _on_word(self, name, location, length):
+        """(TTS 執行緒，引擎回呼) 目前的內容已被取消時停止朗讀。"""
+        current = self._current
+        if current is not None and current.cancelled:
+            self._engine.stop()
+
+    # --- 主執行緒 ---
+
+    def poll(self, max_events=100):
+        """
+        (繪製迴圈每幀呼叫) 觸發已發生的句子與結束事件的回呼。不會阻塞。
+        :return: 本次處理的事件數量。
+        """
+        handled = 0
+        while handled < max_events:
+            try:
+                kind, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            callback = getattr(self, f"on_{kind}")
+            if callback:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"TTS 回呼發生錯誤 ({kind}): {e}")
+        return handled
+
+    def stop(self, timeout_s=2.0):
+        """打斷所有內容並結束 TTS 執行緒。"""
+        self.interrupt(reason="shutdown")
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put((-1, next(self._seq), None, None))
+            self._thread.join(timeout_s)
+
+    @property
+    def stats(self):
+        """監控用統計：朗讀、打斷與跳過的句子數等。"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["active_utterances"] = len(self._active)
+        return stats
@@ -1,39 +1,185 @@
 # webcam_manager.py
+import threading
+import time
+from collections import deque
 import cv2
 
+from frame_sources import CameraSource, create_frame_source
+
+
+class CapturedFrame:
+    """擷取到的一幀，附帶擷取時間 (time.monotonic() 秒) 與幀序號。"""
+    __slots__ = ("frame", "timestamp", "seq")
+
+    def __init__(self, frame, timestamp, seq):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.seq = seq
+
+
 class WebcamManager:
-    def __init__(self, camera_index=0):
+    def __init__(self, camera_index=0, threaded=True, buffer_size=3, first_frame_timeout=5.0,
+                 capture_settings=None, source=None):
         """
-        初始化攝影機。
+        初始化攝影機 (或其他影像幀來源)。
         :param camera_index: 攝影機的索引，通常0是預設攝影機。
+        :param threaded: 是否使用背景擷取執行緒持續讀取畫面。啟用時 get_frame() 不會等待攝影機，總是回傳最新的一幀。
+        :param buffer_size: (threaded 模式) 環形緩衝區保留的最近幀數。
+        :param first_frame_timeout: (threaded 模式) 啟動時等待第一幀的最長秒數。
+        :param capture_settings: (可選) 擷取格式設定字典，例如
+                                 {"backend": ["v4l2", "any"], "width": 1280, "height": 720, "fps": 30, "fourcc": "MJPG"}。
+                                 未設定的項目保持驅動程式預設值。
+        :param source: (可選) frame_sources 中的 FrameSource 實例 (影片、影像序列、原始幀、合成幀...)。
+                       若提供則忽略 camera_index 與 capture_settings。
         """
         self.camera_index = camera_index
-        self.cap = cv2.VideoCapture(self.camera_index)
-        if not self.cap.isOpened():
-            raise IOError(f"無法開啟攝影機，索引: {self.camera_index}")
-        
-        # 可以設定攝影機的解析度 (可選)
-        # self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        # self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        print(f"攝影機 {self.camera_index} 已成功開啟。")
+        if source is None:
+            source = CameraSource(camera_index, **(capture_settings or {}))
+        self.source = source
+        self.capture_info = dict(source.capture_info)
+
+        self.threaded = threaded
+        self._ring = deque(maxlen=max(1, int(buffer_size))) # 最近擷取的幀 (環形緩衝區)
+        self._lock = threading.Lock()
+        self._new_frame_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._frames_captured = 0
+        self._last_delivered_seq = 0 # 最近一次交給呼叫端的幀序號
+        self._dropped_frames = 0 # 擷取後未曾被交給呼叫端就被較新幀取代的幀數
+        self._capture_failed = False
+        self._capture_exited = False # 擷取執行緒已離開 read() 並結束
+        self._release_on_exit = False # release() 時擷取執行緒仍在 read() 中：由擷取執行緒結束時釋放來源
+
+        if self.threaded:
+            self._start_capture_thread(first_frame_timeout)
+
+    @classmethod
+    def from_config(cls, camera_settings):
+        """
+        依 config.json 中的 camera_settings 區塊建立 WebcamManager。
+        :param camera_settings: 設定字典，例如 {"camera_index": 0, "width": 1280, "height": 720, "fps": 30, "fourcc": "MJPG", ...}。
+                                若含有 "source" (例如 {"type": "video", "path": "session.mp4", "pacing": "realtime"})，
+                                則改用該影像幀來源。
+        """
+        settings = dict(camera_settings or {})
+        camera_index = settings.pop("camera_index", 0)
+        source_settings = settings.pop("source", None)
+        source = None
+        if source_settings and source_settings.get("type", "camera") != "camera":
+            source = create_frame_source(source_settings)
+        return cls(
+            camera_index=camera_index,
+            threaded=settings.pop("threaded", True),
+            buffer_size=settings.pop("buffer_size", 3),
+            first_frame_timeout=settings.pop("first_frame_timeout", 5.0),
+            capture_settings=settings,
+            source=source)
+
+    def _start_capture_thread(self, first_frame_timeout):
+        """啟動背景擷取執行緒，並等待第一幀到達 (僅在啟動時等待一次)。"""
+        self._thread = threading.Thread(target=self._capture_loop, name="WebcamCapture")
+        self._thread.daemon = True # 守護執行緒，主程式結束時一併結束
+        self._thread.start()
+        if not self._new_frame_event.wait(timeout=first_frame_timeout):
+            print(f"警告：攝影機 {self.camera_index} 在 {first_frame_timeout} 秒內未送出第一幀。")
+
+    def _capture_loop(self):
+        """背景擷取執行緒：持續讀取來源，讓驅動程式的緩衝區不會堆積過時的幀。"""
+        try:
+            self._read_loop()
+        finally:
+            with self._lock:
+                self._capture_exited = True
+                release_source = self._release_on_exit
+            if release_source:
+                self.source.release()
+
+    def _read_loop(self):
+        while not self._stop_event.is_set():
+            ret, frame = self.source.get_frame()
+            timestamp = time.monotonic()
+            if not ret:
+                print(f"無法從影像來源 ({self.source.name}) 擷取畫面。")
+                with self._lock:
+                    self._capture_failed = True
+                self._new_frame_event.set() # 喚醒等待第一幀的呼叫端
+                break
+            with self._lock:
+                self._frames_captured += 1
+                self._ring.append(CapturedFrame(frame, timestamp, self._frames_captured))
+            self._new_frame_event.set()
+
+    def get_latest_frame(self):
+        """
+        取得最新的一幀及其擷取資訊 (threaded 模式下不會等待攝影機)。
+        :return: CapturedFrame，若尚無可用畫面或擷取已失敗 (且緩衝區中的幀都已交付) 則為 None。
+        """
+        if not self.threaded:
+            ret, frame = self.source.get_frame()
+            if not ret:
+                print(f"無法從影像來源 ({self.source.name}) 擷取畫面。")
+                return None
+            self._frames_captured += 1
+            self._last_delivered_seq = self._frames_captured
+            return CapturedFrame(frame, time.monotonic(), self._frames_captured)
+
+        with self._lock:
+            if not self._ring:
+                return None
+            if self._capture_failed:
+                # 來源已結束 (例如影片或原始幀檔案播完)：依序交付緩衝區中尚未交付的幀，全部交付後才回報失敗
+                for captured in self._ring:
+                    if captured.seq > self._last_delivered_seq:
+                        self._dropped_frames += captured.seq - self._last_delivered_seq - 1
+                        self._last_delivered_seq = captured.seq
+                        return captured
+                return None
+            latest = self._ring[-1]
+            if latest.seq > self._last_delivered_seq:
+                # 兩次取用之間被略過的幀都算作丟棄
+                self._dropped_frames += latest.seq - self._last_delivered_seq - 1
+                self._last_delivered_seq = latest.seq
+            return latest
 
     def get_frame(self):
         """
-        從攝影機擷取一幀畫面。
+        從攝影機擷取一幀畫面。threaded 模式下會立即回傳最新的一幀 (若尚無新幀，則回傳與上次相同的幀)。
         :return: (ret, frame) ret為True表示成功擷取，frame為影像幀。
         """
-        ret, frame = self.cap.read()
-        if not ret:
-            print("無法從攝影機擷取畫面。")
-        return ret, frame
+        captured = self.get_latest_frame()
+        if captured is None:
+            return False, None
+        return True, captured.frame
+
+    def get_recent_frames(self):
+        """回傳環形緩衝區中的所有幀 (由舊到新的 CapturedFrame 列表)。"""
+        with self._lock:
+            return list(self._ring)
+
+    @property
+    def stats(self):
+        """回傳擷取統計：已擷取幀數、已交付的最新幀序號與丟棄的幀數。"""
+        with self._lock:
+            return {
+                "frames_captured": self._frames_captured,
+                "last_delivered_seq": self._last_delivered_seq,
+                "dropped_frames": self._dropped_frames,
+            }
 
     def release(self):
         """
         釋放攝影機資源。
         """
-        if self.cap.isOpened():
-            self.cap.release()
-            print(f"攝影機 {self.camera_index} 已釋放。")
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+            with self._lock:
+                if not self._capture_exited: # 擷取執行緒仍在 read() 中：不能在這裡釋放原生的擷取物件
+                    self._release_on_exit = True
+                    return
+        self.source.release()
 
 if __name__ == '__main__':
     # 測試 WebcamManager
@@ -43,12 +189,13 @@ if __name__ == '__main__':
             ret, frame = webcam.get_frame()
             if not ret:
                 break
-            
+
             cv2.imshow("Webcam Test (攝影機測試)", frame) # 視窗標題中文化
-            
+
             if cv2.waitKey(1) & 0xFF == ord('q'): # 按 'q' 鍵退出
                 break
-        
+
+        print(f"擷取統計: {webcam.stats}")
         webcam.release()
         cv2.destroyAllWindows()
     except IOError as e: